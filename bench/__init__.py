@@ -0,0 +1,40 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Benchmarks for Abundant, run from the root of the repository:
+
+  python3 -m bench.generate DIR SIZE    build a synthetic database of
+                                        SIZE (1k, 10k, 100k, 1m) issues
+  python3 -m bench.scenarios DIR        time common operations against a
+                                        database, and output JSON results
+  python3 bench/startup.py              check how quickly ab starts
+
+The scenarios write to the database they're run against, so generate a
+fresh database to compare results between releases.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import os,sys
+
+src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'src')
+ab = os.path.join(src,'ab')
+
+# benchmark the abundant package alongside this one, not an installed one
+if src not in sys.path:
+    sys.path.insert(0,src)
+
+def env():
+    '''The environment to run ab in, so that it also uses the abundant
+    package alongside this one, and runs commands itself.'''
+    ret = dict(os.environ)
+    ret['PYTHONPATH'] = os.pathsep.join([src]+([ret['PYTHONPATH']] if ret.get('PYTHONPATH') else []))
+    ret.pop('AB_CMDSERVER',None)
+    return ret
@@ -0,0 +1,253 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Builds synthetic Abundant databases to benchmark against.
+
+  python3 -m bench.generate DIR SIZE [--seed SEED] [--users USERS]
+
+SIZE is a number of issues, optionally suffixed with k or m, such as
+1k, 10k, 100k or 1m.  The same size and seed always build the same
+database, apart from dates, which end at the time it's built.
+
+The data is meant to look like a long lived tracker's:
+  - a few users file most issues and are assigned most issues, and
+    users' activity falls off like a power law
+  - older issues are more likely to have been resolved, usually within
+    a few weeks
+  - severity, issue type, category and resolution follow skewed
+    distributions, and targets and estimates are set on some issues
+  - comment counts are geometric, and descriptions and stack traces are
+    log-normally sized, with most issues having no trace at all
+  - some issues are children of a nearby, older issue, and some are
+    resolved as duplicates of one with a similar title
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import bisect,itertools,math,optparse,os,random,sys,time
+
+if not __package__: # run as a script, rather than with -m
+    sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bench # puts the abundant package next to this one on sys.path
+from abundant import issue,util
+
+severities = [('Low',30),('Medium',40),('High',20),('Critical',10)]
+issue_types = [('Bug',60),('Feature Request',25),('Task',15)]
+resolutions = [('Fixed',70),("Won't Fix",10),('Cannot Reproduce',8),('Duplicate',12)]
+categories = ['Core','UI','Database','Networking','Build','Docs','Performance',
+              'Security','Installer','Plugins','CLI','Reporting']
+targets = ['1.0','1.1','1.2','2.0','2.1','3.0']
+estimates = [1,2,4,8,16,32]
+
+first_names = ['Alice','Bob','Carol','Dave','Erin','Frank','Grace','Heidi','Ivan',
+               'Judy','Mallory','Niaj','Olivia','Peggy','Rupert','Sybil','Trent',
+               'Uma','Victor','Walter','Xena','Yusuf','Zoe']
+last_names = ['Smith','Jones','Brown','Garcia','Miller','Davis','Lopez','Wilson',
+              'Moore','Taylor','Thomas','Lee','White','Harris','Clark','Young']
+
+# titles are made from these, so that there are plenty of similar titles
+components = ['parser','cache','index','socket','renderer','scheduler','config loader',
+              'importer','exporter','login form','search','report','editor','sync',
+              'prefix lookup','user list','plugin host','installer','build script','pager']
+problems = ['crashes','hangs','leaks memory','is slow','throws an exception',
+            'returns wrong results','corrupts data','times out','loses changes',
+            'ignores settings','fails silently','prints garbage']
+conditions = ['on startup','on large input','after an upgrade','with unicode titles',
+              'when offline','under load','on Windows','with an empty database',
+              'when the disk is full','after a restart','with many users','on shutdown']
+words = ('the a an this that when while after before with without on in for of to '
+         'issue value file user data error message request response server client '
+         'config option setting list table row column entry record field page view '
+         'load save read write update delete create open close start stop run '
+         'fails works breaks returns expected actual output input result should').split()
+
+year = 365*24*60*60
+day = 24*60*60
+
+def parse_size(size):
+    '''Turns a size like 10k or 1m into a number of issues'''
+    size = size.strip().lower()
+    scale = {'k':1000,'m':1000000}.get(size[-1:],1)
+    return int(size[:-1] if scale > 1 else size)*scale
+
+class _Weighted(object):
+    '''Picks from a list of (choice, weight) pairs'''
+    def __init__(self,choices):
+        self.choices = [c for c,_ in choices]
+        self.cum = list(itertools.accumulate(w for _,w in choices))
+    
+    def __call__(self,rng):
+        i = bisect.bisect(self.cum,rng.random()*self.cum[-1])
+        return self.choices[min(i,len(self.choices)-1)]
+
+def _text(rng,median,sigma=0.8):
+    '''Some words, log-normally many of them'''
+    count = max(1,int(rng.lognormvariate(math.log(median),sigma)))
+    return ' '.join(rng.choices(words,k=count))
+
+def _geometric(rng,mean):
+    '''A geometrically distributed count, with the given mean'''
+    p = 1.0/(mean+1)
+    return int(math.log(1.0-rng.random())/math.log(1.0-p))
+
+def _title(seed,i):
+    rng = random.Random("%d:title:%d" % (seed,i))
+    return "%s %s %s" % (rng.choice(components),rng.choice(problems),rng.choice(conditions))
+
+def _similar_title(seed,i,orig):
+    '''A title for a duplicate of an issue titled orig'''
+    rng = random.Random("%d:dup:%d" % (seed,i))
+    parts = orig.split(' ')
+    parts[rng.randrange(len(parts))] = rng.choice(words)
+    return ' '.join(parts)
+
+def make_users(count):
+    '''Returns count distinct user names, with email addresses'''
+    ret = []
+    for i in range(count):
+        first = first_names[i % len(first_names)]
+        last = last_names[(i // len(first_names)) % len(last_names)]
+        n = i // (len(first_names)*len(last_names))
+        name = "%s %s%s" % (first,last,n if n else '')
+        ret.append("%s <%s.%s%s@example.com>" % (name,first.lower(),last.lower(),n if n else ''))
+    return ret
+
+def generate(path,count,seed=0,users=None,out=None):
+    '''Builds a database of count issues in path, which must not already
+    contain a database.  users is the number of users, by default about
+    twice the square root of count.  Progress is written to out, if set.'''
+    db = os.path.join(path,'.ab')
+    if os.path.exists(db):
+        raise ValueError("%s already contains a database" % path)
+    issues = os.path.join(db,'issues')
+    os.makedirs(issues)
+    os.mkdir(os.path.join(db,'.cache'))
+
+    users = make_users(users or max(5,int(2*math.sqrt(count))))
+    with open(os.path.join(db,'users'),'w') as f:
+        f.write(''.join("%s\n" % u for u in users))
+    with open(os.path.join(db,'ab.conf'),'w') as f:
+        f.write("[metadata]\n"
+                "issue = %s\nissue.default = Bug\n"
+                "severity = %s\nseverity.default = Medium\n"
+                "category = %s\n"
+                "resolution = %s\n"
+                "status = Open, In Progress, Closed\nstatus.default = Open\n" %
+                (', '.join(i for i,_ in issue_types),', '.join(i for i,_ in severities),
+                 ', '.join(categories),', '.join(i for i,_ in resolutions)))
+    with open(os.path.join(db,'ab.local.conf'),'w') as f:
+        f.write("[ui]\nusername = %s\n" % users[0])
+
+    # users' activity falls off like a power law
+    user = _Weighted([(u,1.0/(r+1)**1.1) for r,u in enumerate(users)])
+    category = _Weighted([(c,1.0/(r+1)) for r,c in enumerate(categories)])
+    issue_type = _Weighted(issue_types)
+    severity = _Weighted(severities)
+    resolution = _Weighted(resolutions[:-1]) # duplicates are chosen below
+    ids = [util.hash("bench:%d:%d" % (seed,i)) for i in range(count)]
+
+    # decide the relationships first, so each parent can list its children
+    rel = random.Random("%d:relations" % seed)
+    parents = {}
+    duplicates = {}
+    children = {}
+    for i in range(1,count):
+        r = rel.random()
+        if r < 0.08:
+            parents[i] = max(0,i-1-int(rel.expovariate(1/50.0)))
+            children.setdefault(parents[i],[]).append(i)
+        elif r < 0.11:
+            duplicates[i] = rel.randrange(i)
+            children.setdefault(duplicates[i],[]).append(i)
+
+    rng = random.Random("%d:issues" % seed)
+    end = time.time()
+    start = end - 3*year
+    progress = max(1,count//10)
+    timer = time.perf_counter()
+    for i in range(count):
+        created = start + (end-start)*(i+rng.random())/count
+        age = (end-created)/(end-start)
+        title = _title(seed,i)
+        data = {'id':ids[i],'title':title,'creation_date':created,
+                'creator':user(rng),
+                'issue':issue_type(rng),
+                'severity':severity(rng),
+                'category':category(rng) if rng.random() < 0.7 else None,
+                'status':'Open'}
+        if rng.random() < 0.85:
+            data['assigned_to'] = user(rng)
+        listeners = set(user(rng) for _ in range(_geometric(rng,0.8)))
+        data['listeners'] = sorted(listeners)
+        if rng.random() < 0.3:
+            data['target'] = rng.choice(targets)
+        if rng.random() < 0.4:
+            data['estimate'] = rng.choice(estimates)
+
+        if rng.random() < 0.9:
+            data['description'] = _text(rng,40)
+        if rng.random() < 0.3:
+            data['reproduction'] = _text(rng,25)
+            data['expected'] = _text(rng,10)
+        if rng.random() < 0.2:
+            data['paths'] = ["src/%s/%s.py" % (rng.choice(categories).lower(),rng.choice(words))
+                             for _ in range(rng.randint(1,3))]
+        if rng.random() < 0.15:
+            lines = min(400,max(1,int(rng.lognormvariate(math.log(15),0.9))))
+            data['trace'] = ''.join("  at %s.%s(%s.java:%d)\n" %
+                                    (rng.choice(components).replace(' ','_'),rng.choice(words),
+                                     rng.choice(words).capitalize(),rng.randint(1,2000))
+                                    for _ in range(lines))
+
+        # older issues are more likely to have been resolved
+        resolved = i in duplicates or rng.random() < 0.95*age**0.5
+        if resolved:
+            data['status'] = 'Closed'
+            data['resolution'] = 'Duplicate' if i in duplicates else resolution(rng)
+            data['resolved_date'] = min(end,created+rng.expovariate(1/(20.0*day)))
+        elif rng.random() < 0.2:
+            data['status'] = 'In Progress'
+
+        last = data.get('resolved_date',end)
+        data['comments'] = sorted([[user(rng),
+                                    created+rng.random()*(last-created),_text(rng,20)]
+                                   for _ in range(_geometric(rng,2.5))],key=lambda c: c[1])
+
+        if i in parents:
+            data['parent'] = ids[parents[i]]
+        if i in duplicates:
+            data['duplicates'] = ids[duplicates[i]]
+            data['title'] = _similar_title(seed,i,_title(seed,duplicates[i]))
+        if i in children:
+            data['children'] = [ids[c] for c in children[i]]
+
+        with open(os.path.join(issues,ids[i]+issue.ext),'w') as f:
+            f.write(issue.Issue(**data).to_JSON_str())
+
+        if out is not None and (i+1) % progress == 0:
+            out.write("%d of %d issues written (%.1fs)\n" % (i+1,count,time.perf_counter()-timer))
+            out.flush()
+    return ids
+
+def main():
+    parser = optparse.OptionParser(usage="%prog DIR SIZE [--seed SEED] [--users USERS]")
+    parser.add_option('--seed',type='int',default=0,help="seed for the random data")
+    parser.add_option('--users',type='int',help="number of users")
+    opts, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("expected a directory and a size")
+    try:
+        generate(args[0],parse_size(args[1]),opts.seed,opts.users,sys.stdout)
+    except ValueError as err:
+        parser.error(str(err))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
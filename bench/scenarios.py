@@ -0,0 +1,248 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Times common operations against an Abundant database, such as one built
+by bench.generate, and outputs the results as JSON.
+
+  python3 -m bench.scenarios DIR [-n RUNS] [-s SCENARIO]... [-o FILE]
+                                 [--compare FILE [--tolerance RATIO]]
+
+Command scenarios run ab in a new process each time, as a user would,
+so they include starting up and loading the database.  The first run
+of a command against a freshly generated database also builds its
+caches, so the time of the first run is reported alongside the rest.
+Library scenarios time operations on a new DB object in this process.
+The memory scenarios hold a copy of the issues in a storage.MemoryStore,
+which is read from the database the first time one runs, so they time
+the work done in memory without the filesystem.
+
+The new, comment and resolve scenarios write to the database.
+
+With --compare, the median time of each scenario is compared against
+the results in FILE, from an earlier run, and the exit code is 1 if
+any is slower by more than the tolerance, by default 1.25 times.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import json,optparse,os,platform,random,subprocess,sys,time
+
+if not __package__: # run as a script, rather than with -m
+    sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bench # puts the abundant package next to this one on sys.path
+from abundant import abundant,storage
+from abundant import db as database, ui as usrint
+
+class Context(object):
+    '''The database being benchmarked, and state shared by scenarios'''
+    def __init__(self,path,seed=0):
+        self.path = os.path.abspath(path)
+        self.db = database.DB(self.path,ui=usrint.UI())
+        if not self.db.exists():
+            raise ValueError("No Abundant database found at %s" % path)
+        self.db.ui.db_conf(self.db)
+        self.ids = self.db.store.ids()
+        self.rng = random.Random(seed)
+        # issues created by the new scenario, for resolve to resolve
+        self.created = []
+        self._memory = None
+
+    def memory_store(self):
+        '''A MemoryStore of the database's issues, shared by every run'''
+        if self._memory is None:
+            self._memory = storage.MemoryStore(self.db.iter_issues())
+        return self._memory
+
+    def random_id(self,length=10):
+        return self.rng.choice(self.ids)[:length]
+
+    def users(self):
+        with open(self.db.users) as f:
+            return sum(1 for line in f if line.strip() and line.strip()[0] != '#')
+
+    def ab(self,args):
+        '''Runs ab, returning the time it took and its output'''
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable,bench.ab]+args,cwd=self.path,env=bench.env(),
+                              stdin=subprocess.DEVNULL,stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,universal_newlines=True)
+        took = time.perf_counter() - start
+        if proc.returncode not in (0,1): # 1 is no matching issues
+            raise RuntimeError("ab %s exited with %d:\n%s" %
+                               (' '.join(args),proc.returncode,proc.stderr.strip()))
+        return took, proc.stdout
+
+class Command(object):
+    '''Times a command, run with the arguments args(ctx) returns'''
+    def __init__(self,name,desc,args):
+        self.name = name
+        self.desc = desc
+        self.args = args
+
+    def setup(self,ctx,runs):
+        pass
+
+    def run(self,ctx):
+        return ctx.ab(self.args(ctx))[0]
+
+class New(Command):
+    def run(self,ctx):
+        took, out = ctx.ab(self.args(ctx))
+        ctx.created.append(out.strip())
+        return took
+
+class Resolve(Command):
+    def setup(self,ctx,runs):
+        # resolve issues created by the new scenario, making more if needed
+        while len(ctx.created) < runs:
+            ctx.created.append(ctx.ab(['new','Benchmark setup issue','-q'])[1].strip())
+
+class Library(object):
+    '''Times func(db,ctx) on a new DB object, after calling prepare(db).
+    If memory is set the DB's issues are held in ctx.memory_store().'''
+    def __init__(self,name,desc,func,prepare=None,memory=False):
+        self.name = name
+        self.desc = desc
+        self.func = func
+        self.prepare = prepare
+        self.memory = memory
+
+    def setup(self,ctx,runs):
+        if self.memory:
+            ctx.memory_store()
+
+    def run(self,ctx):
+        db = database.DB(ctx.path,ui=ctx.db.ui,store=ctx.memory_store() if self.memory else None)
+        if self.prepare:
+            self.prepare(db)
+        start = time.perf_counter()
+        self.func(db,ctx)
+        return time.perf_counter() - start
+
+class SimilarLookup(Library):
+    def setup(self,ctx,runs):
+        # lookups as new does them don't build the index, so build it first
+        ctx.db.similar_index
+
+def _lookups(db,ctx):
+    for _ in range(1000):
+        db.iss_prefix[ctx.random_id(8)]
+
+scenarios = [
+    Command('list',"list every open issue",lambda ctx: ['list']),
+    Command('list-filtered',"list open high severity bugs",
+            lambda ctx: ['list','-s','High','-i','Bug']),
+    Command('tasks',"list the current user's open issues",lambda ctx: ['tasks']),
+    Command('burndown',"weekly opened, resolved and backlog counts for 12 weeks",
+            lambda ctx: ['burndown']),
+    Command('stats',"count issues by assignee and severity",
+            lambda ctx: ['stats','--by','assignee,severity']),
+    Command('details',"show a random issue",lambda ctx: ['details',ctx.random_id()]),
+    New('new',"create an issue",
+        lambda ctx: ['new','Benchmark issue %d' % len(ctx.created),'-s','High','-q']),
+    Command('comment',"comment on a random issue",
+            lambda ctx: ['comment',ctx.random_id(),'-m','Benchmark comment']),
+    Resolve('resolve',"resolve an issue made by new",lambda ctx: ['resolve',ctx.created.pop()]),
+    Library('prefix-load',"load the issue prefix",lambda db,ctx: db.iss_prefix),
+    Library('prefix-lookup',"look up 1000 random issue prefixes",_lookups,
+            lambda db: db.iss_prefix),
+    Library('usr-prefix',"load the user prefix",lambda db,ctx: db.usr_prefix),
+    SimilarLookup('similar-lookup',"look up likely duplicates of a random issue, as new does",
+            lambda db,ctx: db.similar_issues(db.get_issue(ctx.random_id()),5,current=False)),
+    Library('memory-list',"find every open issue, held in memory",
+            lambda db,ctx: sum(1 for _ in db.get_issues(opened=True)),memory=True),
+    Library('memory-newest',"find the 20 newest open high severity issues, held in memory",
+            lambda db,ctx: [i.title for i in db.get_issues(opened=True,severity='High',
+                                                           sort='creation_date',reverse=True,
+                                                           limit=20)],memory=True),
+]
+
+def run(ctx,names=None,runs=5,out=None):
+    '''Runs the named scenarios, or all of them, and returns the results.
+    Progress is written to out, if set.'''
+    results = {}
+    for scenario in scenarios:
+        if names and scenario.name not in names:
+            continue
+        res = results[scenario.name] = {'description':scenario.desc}
+        try:
+            scenario.setup(ctx,runs)
+            times = [scenario.run(ctx) for _ in range(runs)]
+        except Exception as err:
+            res['error'] = str(err)
+            if out is not None:
+                out.write("%-14s failed: %s\n" % (scenario.name,err))
+            continue
+        ordered = sorted(times)
+        res.update({'first':times[0],'min':ordered[0],'median':ordered[len(ordered)//2],
+                    'mean':sum(times)/len(times),'max':ordered[-1],'times':times})
+        if out is not None:
+            out.write("%-14s median %8.1f ms  first %8.1f ms\n" %
+                      (scenario.name,res['median']*1000,res['first']*1000))
+            out.flush()
+    return {'version':"%d.%d" % abundant.version,
+            'python':platform.python_version(),
+            'platform':platform.platform(),
+            'date':time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database':{'path':ctx.path,'issues':len(ctx.ids),'users':ctx.users()},
+            'runs':runs,
+            'scenarios':results}
+
+def compare(results,baseline,tolerance,out):
+    '''Writes how much faster or slower each scenario was than in the
+    baseline results to out, and returns the names of scenarios which
+    were slower than the tolerance allows.'''
+    slower = []
+    for name, res in sorted(results['scenarios'].items()):
+        base = baseline.get('scenarios',{}).get(name,{})
+        if 'median' not in res or not base.get('median'):
+            continue
+        ratio = res['median']/base['median']
+        out.write("%-14s %6.2fx%s\n" % (name,ratio,"  SLOWER" if ratio > tolerance else ''))
+        if ratio > tolerance:
+            slower.append(name)
+    return slower
+
+def main():
+    parser = optparse.OptionParser(usage="%prog DIR [-n RUNS] [-s SCENARIO]... [-o FILE] "
+                                         "[--compare FILE [--tolerance RATIO]]")
+    parser.add_option('-n','--runs',type='int',default=5,help="runs of each scenario")
+    parser.add_option('-s','--scenario',action='append',
+                      help="scenario to run, one of: %s" % ', '.join(i.name for i in scenarios))
+    parser.add_option('-o','--output',help="file to write the JSON results to")
+    parser.add_option('--seed',type='int',default=0,help="seed for choosing random issues")
+    parser.add_option('--compare',help="JSON results to compare against")
+    parser.add_option('--tolerance',type='float',default=1.25,
+                      help="how many times slower than --compare is too slow")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected a database directory")
+    try:
+        ctx = Context(args[0],opts.seed)
+    except ValueError as err:
+        parser.error(str(err))
+
+    results = run(ctx,opts.scenario,max(opts.runs,1),sys.stderr)
+    data = json.dumps(results,indent=1,sort_keys=True)
+    if opts.output:
+        with open(opts.output,'w') as f:
+            f.write(data+'\n')
+    else:
+        sys.stdout.write(data+'\n')
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        if compare(results,baseline,opts.tolerance,sys.stderr):
+            return 1
+    return 1 if any('error' in i for i in results['scenarios'].values()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
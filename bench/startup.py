@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Startup benchmark for the ab command line frontend
+
+Runs ab under python -X importtime, and reports how long each command
+took to run and to import the modules it needed.  Commands which don't
+need a database, like help and version, should never import the
+modules only other commands need, and this fails (exit code 1) if they
+do, or if any command's imports take longer than --max-import-ms.
+
+  python3 bench/startup.py [-n RUNS] [--db DIR] [--max-import-ms MS]
+  python3 -m bench.startup [-n RUNS] [--db DIR] [--max-import-ms MS]
+
+With --db, commands which load the database are run in DIR as well.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import optparse,os,subprocess,sys,time
+
+if not __package__: # run as a script, rather than with -m
+    sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench import ab,env
+
+# commands which don't need a database
+no_db_cmds = [['version'],['help'],['help','list']]
+db_cmds = [['list'],['list','-s','High'],['tasks']]
+
+# modules that commands which don't need a database shouldn't import
+forbidden = ['json','optparse','subprocess','hashlib','tempfile','traceback',
+             'concurrent.futures','abundant.config','abundant.db','abundant.issue']
+
+def run(args,cwd):
+    '''Runs ab once, returning the wall clock time it took, in seconds,
+    and a dict of each module it imported to the time, in microseconds,
+    spent importing that module alone.'''
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable,'-X','importtime',ab]+args,cwd=cwd,env=env(),
+                          stdout=subprocess.DEVNULL,stderr=subprocess.PIPE,universal_newlines=True)
+    wall = time.perf_counter() - start
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            modules[fields[2].strip()] = int(fields[0])
+        except ValueError:
+            pass # the header
+    return wall,modules
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+def bench(args,cwd,runs):
+    '''Returns the median wall clock and import times, in milliseconds,
+    of running ab with args, and the modules it imported'''
+    walls, imports = [], []
+    for _ in range(runs):
+        wall, modules = run(args,cwd)
+        walls.append(wall*1000)
+        imports.append(sum(modules.values())/1000)
+    return median(walls),median(imports),modules
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [-n RUNS] [--db DIR] [--max-import-ms MS]")
+    parser.add_option('-n','--runs',type='int',default=10,help="runs of each command")
+    parser.add_option('--db',help="a database to run commands which need one in")
+    parser.add_option('--max-import-ms',type='float',help="fail if any command's imports take longer")
+    opts, _ = parser.parse_args()
+
+    cmds = [(i,os.getcwd(),True) for i in no_db_cmds]
+    if opts.db:
+        cmds += [(i,opts.db,False) for i in db_cmds]
+
+    failed = False
+    print("%-20s %10s %10s %8s" % ('command','wall ms','import ms','modules'))
+    for args, cwd, no_db in cmds:
+        wall, imports, modules = bench(args,cwd,max(opts.runs,1))
+        print("%-20s %10.1f %10.1f %8d" % (' '.join(args),wall,imports,len(modules)))
+        if no_db:
+            bad = [i for i in forbidden if i in modules]
+            if bad:
+                failed = True
+                print("  imported %s" % ', '.join(bad))
+        if opts.max_import_ms is not None and imports > opts.max_import_ms:
+            failed = True
+            print("  imports took longer than %.1f ms" % opts.max_import_ms)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,10 +13,9 @@ data, and passing work off to commands
 @author: Michael Diamond
 Created on Feb 10, 2011
 '''
-import os,sys,traceback
-from abundant import commands,error,prefix,util
+import os,sys
+from abundant import commands,error,prefix,trace,util
 from abundant import ui as usrint
-from abundant import db as database
 
 #Major/Minor release number.
 #Any updates to this should be tagged change sets.
@@ -31,21 +30,36 @@ globalArgs = [util.parser_option('-D','--database',help="the directory to search
                                  help="Output additional content the user wouldn't usually need"),
               util.parser_option('--debug',action='store_const',const=usrint.debug,dest='volume',
                                  help="Output debug information useful for development / debugging"),
+              util.parser_option('--trace-file',metavar='FILE',
+                                 help="Write a trace of where the command spent its time to FILE"),
+              util.parser_option('--profile',metavar='FILE',implicit='ab.prof',
+                                 help="Profile the command, writing the stats to FILE, by default ab.prof"),
               util.parser_option('-h','--help',action="store_true")]
 
-def exec(cmds,cwd):
-    exec_timer = util.Timer("Full command execution")
+def exec(cmds,cwd,ui=None,dbs=None,external=True):
+    '''Runs a command, returning its exit code.
+    
+    A ui to use can be passed in, otherwise one is constructed
+    writing to the sys streams.  Long running processes can pass
+    a dict as dbs, which is used to cache a DB object for each
+    database path, to be refreshed and reused by later commands.
+    external is passed on to DB.refresh().'''
+    # commands run by another command, like help after an invalid
+    # command, are traced as part of it
+    tracing = not trace.enabled()
+    exec_span = trace.Span("Full command execution",'command')
     try:
-        ui_load_timer = util.Timer("UI load")
-        ui = usrint.UI()
-        ui_load_timer.stop() # since we haven't parsed --debug yet, we can't use ui.debug()
+        ui_load_span = trace.Span("UI load")
+        if ui is None:
+            ui = usrint.UI()
+        ui_load_span.end() # since we haven't parsed --debug yet, it's recorded below
     except:
         sys.stderr.write("FAILED TO CREATE UI OBJECT.\n"
               "This should not have been possible.\n"
               "Please report this issue immediately.\n\n")
         raise
     try:
-        parse_timer = util.Timer("Command parsing")
+        parse_span = trace.Span("Command parsing")
         if len(cmds) < 1 or (len(cmds[0]) > 0 and cmds[0][0] == '-'):
             prefix = commands.fallback_cmd
             args = cmds
@@ -72,9 +86,12 @@ def exec(cmds,cwd):
         
         #set volume
         ui.set_volume(options['volume'])
+        parse_span.end()
         
-        ui.debug(ui_load_timer)
-        ui.debug(parse_timer)
+        if tracing:
+            trace.start(ui if ui.is_debug() else None,
+                        os.path.join(cwd,options['trace_file']) if options['trace_file'] else None)
+            trace.record(ui_load_span,parse_span)
         
         #check for -h,--help
         if options['help']:
@@ -82,31 +99,17 @@ def exec(cmds,cwd):
             task = commands.fallback_cmd
             func, options, args_left = _parse(task,new_args)
         
-        command_timer = None
-        if task not in commands.no_db:
-            db_load_timer = util.Timer("Database load")
-            path = os.path.join(cwd,options['database']) if options['database'] else cwd
-            
-            db = database.DB(path,ui=ui)
-            if not db.exists():
-                raise error.Abort("No Abundant database found.")
-            ui.db_conf(db)
-            ui.debug(db_load_timer)
-            
-            command_timer = util.Timer("Command '%s'" % task)
-            ret = func(ui,db,*args_left,**options)
-        else:
-            command_timer = util.Timer("Command %s" % task)
-            ret = func(ui,*args_left,**options)
-        
-        ui.debug(command_timer)
-        ui.debug(exec_timer)
+        with trace.profile(ui,trace.profile_path(cwd,options['profile'],
+                                                 os.environ.get('AB_PROFILE'),task)):
+            ret = _dispatch(ui,cwd,task,func,options,args_left,dbs,external)
         
         if ret is None:
             return 0
         else: return ret
             
         # Global error handling starts here
+    except error.OutputClosed:
+        return 0
     except error.Abort as err:
         ui.alert("Abort: ",err)
         return 2
@@ -114,7 +117,7 @@ def exec(cmds,cwd):
         ui.alert("Invalid Command:\n",err)
         try:
             ui.flush() # ensure error displays first
-            exec([commands.fallback_cmd,err.task],cwd)
+            exec([commands.fallback_cmd,err.task],cwd,ui)
         except:
             # if there is no err.task then don't bother outputting help on it
             pass
@@ -122,12 +125,45 @@ def exec(cmds,cwd):
         
     except Exception as err:
         '''Exceptions we were not expecting.'''
+        import traceback
         exc_type, exc_value, exc_traceback = sys.exc_info()
         sys.stderr.write("Unexpected exception was raised.  This should not happen.\n")
         sys.stderr.write("Please report the entire output to Michael\n")
         sys.stderr.write("\nCommand line arguments:\n  %s\n" % ' '.join(sys.argv))
         traceback.print_exception(exc_type,exc_value,exc_traceback)
         return 10
+    finally:
+        ui.close_pager()
+        exec_span.end()
+        if tracing:
+            trace.stop(ui,command=cmds,cwd=cwd,version="%d.%d" % version)
+
+def _dispatch(ui,cwd,task,func,options,args,dbs,external):
+    '''Loads the database, if the task needs one, and runs it'''
+    if task in commands.no_db:
+        with trace.span("Command '%s'" % task,'command',args=args):
+            return func(ui,*args,**options)
+    
+    from abundant import db as database
+    with trace.span("Database load"):
+        path = os.path.join(cwd,options['database']) if options['database'] else cwd
+        
+        with trace.span("Database find",path=path):
+            db = database.DB(path,ui=ui)
+        if not db.exists():
+            raise error.Abort("No Abundant database found.")
+        if dbs is not None:
+            if db.path in dbs:
+                db = dbs[db.path]
+                with trace.span("Database refresh"):
+                    db.refresh(ui,external)
+            else:
+                dbs[db.path] = db
+        with trace.span("Database config"):
+            ui.db_conf(db)
+    
+    with trace.span("Command '%s'" % task,'command',args=args):
+        return func(ui,db,*args,**options)
 
 def _parse(task,args):
     entry = commands.table[task]
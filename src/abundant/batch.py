@@ -0,0 +1,107 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Runs many commands in one process, for scripts which would otherwise
+run ab over and over again.
+
+Commands are read from an input stream, one command line per line, or
+per NUL terminated record.  A command line is split like a shell would
+split it, unless it starts with [, in which case it is a JSON array of
+the command's arguments.  Blank lines, and lines starting with #, are
+skipped.
+
+After each command runs one line of JSON is written to the output
+stream, an object holding the command's arguments (args), exit code
+(ret), and everything it wrote to its output (out) and error (err)
+streams.  The output is flushed after every command, so a script can
+send a command and wait for its result.
+
+Every command shares the DB object loaded for its database, so the
+prefixes, caches and indexes loaded by one command are reused by the
+next.  Writes update them as they're made, so they aren't checked
+against the files on disk again.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import codecs,io,json,shlex,sys
+from abundant import abundant
+
+# NUL terminated input is read in chunks of about this size
+_bufsize = 64*1024
+
+def _lines(inp):
+    for line in iter(inp.readline,''):
+        yield line[:-1] if line.endswith('\n') else line
+
+def _records(inp):
+    '''NUL terminated records, read as they become available'''
+    binary = getattr(inp,'buffer',None)
+    if binary is not None and hasattr(binary,'read1'):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        read = lambda: decoder.decode(binary.read1(_bufsize),False)
+    else:
+        read = lambda: inp.read(_bufsize)
+    rest = ''
+    while True:
+        data = read()
+        if not data:
+            break
+        records = (rest+data).split('\0')
+        rest = records.pop()
+        for record in records:
+            yield record
+    if rest:
+        yield rest
+
+def _split(line):
+    '''Returns the arguments of a command line, or None if it should be
+    skipped.  Raises ValueError if it can't be parsed.'''
+    line = line.strip()
+    if not line or line[0] == '#':
+        return None
+    if line[0] == '[':
+        args = json.loads(line)
+        if not isinstance(args,list) or not all(isinstance(a,str) for a in args):
+            raise ValueError("Expected a JSON array of strings")
+        return args
+    return shlex.split(line)
+
+def run(ui,cwd,null=False):
+    '''Runs each command read from ui.inp against the database found
+    from cwd, and writes their results to ui.out.  If null is True
+    commands are NUL terminated, rather than newline terminated.
+
+    Commands do not read from ui.inp, so prompts are given their
+    default answers.'''
+    dbs = {}
+    for line in (_records(ui.inp) if null else _lines(ui.inp)):
+        out = io.StringIO()
+        err = io.StringIO()
+        try:
+            args = _split(line)
+        except ValueError as e:
+            args = None
+            err.write("Invalid command line: %s\n" % e)
+            ret = 3
+        else:
+            if args is None:
+                continue
+            # anything written straight to the sys streams, such as
+            # tracebacks, belongs to the command too
+            oldout, olderr = sys.stdout, sys.stderr
+            sys.stdout, sys.stderr = out, err
+            try:
+                ret = abundant.exec(args,cwd,ui.copy(io.StringIO(),out,err),dbs,False)
+            finally:
+                sys.stdout, sys.stderr = oldout, olderr
+        ui.quiet(json.dumps({'args':args,'ret':ret,'out':out.getvalue(),'err':err.getvalue()}))
+        ui.flush()
+    return 0
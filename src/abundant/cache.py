@@ -1,96 +1,1146 @@
-# Copyright 2011 Michael Diamond
-# 
-# This file is part of Abundant.
-# 
-# This software may be used and distributed according to the terms of
-# the  GNU General Public License version 3 or any later version.
-# See http://www.gnu.org/licenses/ for the full license text.
-
-'''
-Classes, methods, and decorators to enable data-caching behavior and
-minimize program execution time. 
-
-@author: Michael Diamond
-Created on June 14, 2012
-'''
-
-import functools
-from abundant import util
-
-class lazy_property(object):
-    '''Decorator: Enables the value of a property to be lazy-loaded.
-    From Mercurial's util.propertycache
-    
-    Apply this decorator to a no-argument method of a class and you
-    will be able to access the result as a lazy-loaded class property.
-    The method becomes inaccessible, and the property isn't loaded
-    until the first time it's called.  Repeated calls to the property
-    don't re-run the function.
-    
-    This takes advantage of the override behavior of Descriptors - 
-    __get__ is only called if an attribute with the same name does
-    not exist.  By not setting __set__ this is a non-data descriptor,
-    and "If an instance's dictionary has an entry with the same name
-    as a non-data descriptor, the dictionary entry takes precedence."
-     - http://users.rcn.com/python/download/Descriptor.htm
-    
-    To trigger a re-computation, 'del' the property - the value, not
-    this class, will be deleted, and the value will be restored upon
-    the next attempt to access the property.
-    '''
-    def __init__(self,func):
-        self.func = func
-        self.name = func.__name__
-    def __get__(self, obj, type=None):
-        result = self.func(obj)
-        setattr(obj, self.name, result)
-        return result
-
-class lazy_dict(object):
-    '''Decorator: Enables a dictionary property to be lazy-loaded,
-    in a similar fashion to lazy_property.
-    
-    Apply this decorator to a method which takes hashable arguments,
-    and use the name as a dictionary in external code.  Repeated
-    calls to the same index will not be recomputed.
-    
-    Exceptions raised by the decorated function will be wrapped as
-    KeyErrors and raised.
-    '''
-    def __init__(self,func):
-        self.orig_func = func
-        self.func = func
-        self.cache = {}
-    
-    def __get__(self, obj, objtype):
-        '''Necessary to pass 'self' down to methods - not called for functions'''
-        self.func = functools.partial(self.orig_func,obj)
-        return self
-    
-    def __getitem__(self,*key):
-        try:
-            return self.cache[key]
-        except KeyError: # Value not loaded yet
-            try:
-                value = self.func(*key)
-            except Exception as e:
-                raise KeyError("Invalid arguments '%s' for %s" % (util.list2str(key),self.orig_func.__name__)) from e
-            self.cache[key] = value
-            return value
-        # a TypeError will be raised if passed a non-hashable argument
-    
-    def __setitem__(self,*key,value):
-        '''Set is provided for convenience, it should be avoided - this
-        dict is backed by a function, breaking that contract isn't advisable.
-        '''
-        self.cache[key] = value
-    
-    def __delitem__(self,*key):
-        '''Clears the given value, re-accessing it recalls the function'''
-        del self.cache[key]
-    
-    def __iter__(self):
-        raise NotImplementedError("Unable to iter over lazy-loaded dictionary")
-    
-    def __contains__(self):
-        raise NotImplementedError("Unable to do contains checks on lazy-loaded dictionary")
\ No newline at end of file
+# Copyright 2011 Michael Diamond
+# 
+# This file is part of Abundant.
+# 
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Classes, methods, and decorators to enable data-caching behavior and
+minimize program execution time. 
+
+@author: Michael Diamond
+Created on June 14, 2012
+'''
+
+import array,base64,bisect,functools,heapq,itertools,json,os,re,struct,sys,time,zlib
+from abundant import error,issue,trace,util
+
+class lazy_property(object):
+    '''Decorator: Enables the value of a property to be lazy-loaded.
+    From Mercurial's util.propertycache
+    
+    Apply this decorator to a no-argument method of a class and you
+    will be able to access the result as a lazy-loaded class property.
+    The method becomes inaccessible, and the property isn't loaded
+    until the first time it's called.  Repeated calls to the property
+    don't re-run the function.
+    
+    This takes advantage of the override behavior of Descriptors - 
+    __get__ is only called if an attribute with the same name does
+    not exist.  By not setting __set__ this is a non-data descriptor,
+    and "If an instance's dictionary has an entry with the same name
+    as a non-data descriptor, the dictionary entry takes precedence."
+     - http://users.rcn.com/python/download/Descriptor.htm
+    
+    To trigger a re-computation, 'del' the property - the value, not
+    this class, will be deleted, and the value will be restored upon
+    the next attempt to access the property.
+    '''
+    def __init__(self,func):
+        self.func = func
+        self.name = func.__name__
+    def __get__(self, obj, type=None):
+        result = self.func(obj)
+        setattr(obj, self.name, result)
+        return result
+
+class lazy_dict(object):
+    '''Decorator: Enables a dictionary property to be lazy-loaded,
+    in a similar fashion to lazy_property.
+    
+    Apply this decorator to a method which takes hashable arguments,
+    and use the name as a dictionary in external code.  Repeated
+    calls to the same index will not be recomputed.
+    
+    Exceptions raised by the decorated function will be wrapped as
+    KeyErrors and raised.
+    '''
+    def __init__(self,func):
+        self.orig_func = func
+        self.func = func
+        self.cache = {}
+    
+    def __get__(self, obj, objtype):
+        '''Necessary to pass 'self' down to methods - not called for functions'''
+        self.func = functools.partial(self.orig_func,obj)
+        return self
+    
+    def __getitem__(self,*key):
+        try:
+            return self.cache[key]
+        except KeyError: # Value not loaded yet
+            try:
+                value = self.func(*key)
+            except Exception as e:
+                raise KeyError("Invalid arguments '%s' for %s" % (util.list2str(key),self.orig_func.__name__)) from e
+            self.cache[key] = value
+            return value
+        # a TypeError will be raised if passed a non-hashable argument
+    
+    def __setitem__(self,*key,value):
+        '''Set is provided for convenience, it should be avoided - this
+        dict is backed by a function, breaking that contract isn't advisable.
+        '''
+        self.cache[key] = value
+    
+    def __delitem__(self,*key):
+        '''Clears the given value, re-accessing it recalls the function'''
+        del self.cache[key]
+    
+    def __iter__(self):
+        raise NotImplementedError("Unable to iter over lazy-loaded dictionary")
+    
+    def __contains__(self):
+        raise NotImplementedError("Unable to do contains checks on lazy-loaded dictionary")
+
+class IssueCache(object):
+    '''A persistent cache of the summary data of every issue in a
+    database, stored as a single file in the database's .cache directory.
+    
+    Each entry records the stat signature (mtime, size, inode) of the
+    issue file it was read from, along with the issue's summary data
+    (see Issue.summary()).  refresh() stats every issue file and only
+    re-reads the files whose signature has changed, so issues modified
+    in place, by an editor or version control, are noticed as well as
+    those written through a Store.  The cache also records the
+    modification time of the issues directory, which changes whenever
+    an issue file is added or removed.  While it matches, the cached ids
+    are the files to stat, and the directory isn't listed.
+    
+    Every refresh which finds changes increments the cache's generation,
+    and changed entries and removed issues are stamped with it.  This
+    lets indexes derived from the cache (see DerivedIndex) update only
+    the issues that changed since they were last written.  The epoch
+    identifies one continuous run of generations, and changes whenever
+    the cache has to be rebuilt from scratch.
+    
+    Summaries are kept compactly, since the cache of a large database
+    is most of the memory a command uses: each is a tuple of the values
+    of fields, rather than a dict, and values which many issues share,
+    such as users and metadata, are one shared string, stored once in
+    the cache file.  get(), items() and the like build a summary dict on
+    request, which the caller is free to keep or modify.
+    
+    If the cache file is missing, from a different version, or cannot
+    be parsed, it is silently rebuilt.
+    
+    Like Mercurial's dirstate, a file modified within the timestamp
+    granularity of the filesystem cannot be trusted to have a stable
+    signature, so such entries are stored as unknown and re-read
+    the next time the cache is refreshed.  The same goes for the issues
+    directory, which is checked again if it was modified that recently.
+    '''
+    version = 4
+    # seconds in the past a file must have been modified to be trusted
+    _racy = 2
+    # the summary data kept for each issue, apart from its id, in order
+    fields = [f for f in issue.Issue._summary if f != 'id']
+    # fields whose values are shared by many issues
+    _shared = set(['creator','assigned_to','listeners','issue','target','severity',
+                   'status','resolution','category'])
+    
+    def __init__(self,issues,path,ui=None):
+        self.issues = issues
+        self.path = path
+        self.ui = ui
+        self._entries = None
+        self._removed = None
+        # the shared string of each value of the fields in _shared
+        self._strings = None
+        self._dirty = False
+        self.epoch = None
+        self.generation = 0
+        # the mtime of the issues directory when the cache was last
+        # checked against it, or -1 if it needs to be checked
+        self.stamp = -1
+    
+    def _debug(self,*msg):
+        if self.ui is not None:
+            self.ui.debug(*msg)
+    
+    def _load(self):
+        '''Reads the cache file, starting a new epoch if it
+        does not exist or is corrupt'''
+        try:
+            with trace.span("Issue cache read",path=self.path), open(self.path) as cache_file:
+                data = json.load(cache_file)
+            if data['version'] != self.version or data['fields'] != self.fields:
+                raise ValueError("Cache version %s is not %s" % (data['version'],self.version))
+            strings = data['values']
+            self._strings = dict((v,v) for v in strings)
+            entries = data['entries']
+            # decoded in place, so the decoded entries replace the parsed ones
+            # as they're made, rather than both being held at once
+            for id, e in entries.items():
+                if len(e) != 5 or not isinstance(e[4],list):
+                    raise ValueError("Malformed cache entry")
+                entries[id] = (e[0],e[1],e[2],e[3],self._decode(e[4],strings))
+            self._entries = entries
+            self._removed = data['removed']
+            self.epoch = data['epoch']
+            self.generation = data['generation']
+            self.stamp = data['stamp']
+            return
+        except IOError:
+            pass
+        except Exception as err:
+            self._debug("Issue cache at %s is invalid, rebuilding: %s" % (self.path,err))
+        self._entries = {}
+        self._removed = {}
+        self._strings = {}
+        self.epoch = util.hash("%r%d" % (time.time(),os.getpid()))
+        self.generation = 0
+        self.stamp = -1
+        self._dirty = True
+    
+    def _decode(self,stored,strings):
+        '''Returns the values tuple of a summary stored in the cache file,
+        where shared values are indexes of strings'''
+        ret = []
+        for f, v in itertools.zip_longest(self.fields,stored):
+            if v is not None:
+                if f in self._shared:
+                    v = tuple(strings[i] for i in v) if isinstance(v,list) else strings[v]
+                elif isinstance(v,list):
+                    v = tuple(v)
+            ret.append(v)
+        return tuple(ret)
+    
+    def _compact(self,summary):
+        '''Returns the values tuple of a summary dict, as it's kept in memory'''
+        strings = self._strings
+        ret = []
+        for f in self.fields:
+            v = summary.get(f)
+            if isinstance(v,list):
+                v = tuple(strings.setdefault(i,i) for i in v) if f in self._shared else tuple(v)
+            elif v is not None and f in self._shared:
+                v = strings.setdefault(v,v)
+            ret.append(v if v != () else None)
+        return tuple(ret)
+    
+    def _summary(self,id,values):
+        '''Returns the summary dict of a values tuple'''
+        ret = {'id':id}
+        for f, v in zip(self.fields,values):
+            if v is not None:
+                ret[f] = list(v) if isinstance(v,tuple) else v
+        return ret
+    
+    def refresh(self):
+        '''Brings the cache up to date with the issue files on disk,
+        and writes it back out if anything changed.  Returns self.'''
+        if self._entries is None:
+            self._load()
+        entries = self._entries
+        try:
+            mtime = os.stat(self.issues).st_mtime_ns
+        except OSError:
+            mtime = -1
+        if mtime == self.stamp and mtime != -1:
+            # no file has been added or removed, so the cached ids are
+            # the files to check, without listing the directory
+            ids = list(entries)
+        else:
+            # stamped before the scan, so changes made during it are seen next time
+            stamp = mtime if mtime < (time.time() - self._racy) * 1e9 else -1
+            if stamp != self.stamp:
+                self.stamp = stamp
+                self._dirty = True
+            ids = [i[:-len(issue.ext)] for i in os.listdir(self.issues) if i.endswith(issue.ext)]
+        
+        gen = self.generation + 1
+        changed = False
+        seen = set()
+        with trace.span("Issue cache scan",issues=self.issues):
+            for id in ids:
+                file = os.path.join(self.issues,id+issue.ext)
+                try:
+                    st = os.stat(file)
+                except OSError:
+                    continue # removed while we were looking
+                entry = entries.get(id)
+                if (entry is not None and entry[0] == st.st_mtime_ns and
+                    entry[1] == st.st_size and entry[2] == st.st_ino):
+                    seen.add(id)
+                    continue
+                try:
+                    summary = issue.JSON_to_Issue(file).summary()
+                except error.NoSuchIssue:
+                    # not cached, so list the directory to find it again
+                    self.stamp = -1
+                    continue
+                seen.add(id)
+                entries[id] = (st.st_mtime_ns,st.st_size,st.st_ino,gen,self._compact(summary))
+                self._removed.pop(id,None)
+                changed = True
+        
+        if len(seen) != len(entries):
+            for id in [i for i in entries if i not in seen]:
+                del entries[id]
+                self._removed[id] = gen
+            changed = True
+        
+        if changed:
+            self.generation = gen
+            self._dirty = True
+        if self._dirty:
+            self.save()
+        return self
+    
+    def save(self):
+        '''Writes the cache to disk.  Failing to write is not an error,
+        the cache will simply be rebuilt next time.'''
+        racy = (time.time() - self._racy) * 1e9
+        strings = []
+        index = {}
+        def code(v):
+            i = index.get(v)
+            if i is None:
+                i = index[v] = len(strings)
+                strings.append(v)
+            return i
+        shared = [f in self._shared for f in self.fields]
+        entries = {}
+        for id, e in self._entries.items():
+            values = e[4]
+            stored = [v if v is None or not s else [code(i) for i in v] if isinstance(v,tuple) else code(v)
+                      for s, v in zip(shared,values)]
+            while stored and stored[-1] is None:
+                stored.pop()
+            entries[id] = [-1,-1,-1,e[3],stored] if e[0] >= racy else [e[0],e[1],e[2],e[3],stored]
+        
+        with trace.span("Issue cache write",path=self.path):
+            if write_cache_file(self.path,{'version':self.version,'fields':self.fields,
+                                           'epoch':self.epoch,'generation':self.generation,
+                                           'stamp':self.stamp,'values':strings,'entries':entries,
+                                           'removed':self._removed},self.ui):
+                self._dirty = False
+    
+    def update(self,summaries):
+        '''Records the given issues, a dict of ids to summary data, which
+        have just been written, without checking any other issue files.
+        Writing them changed the issues directory, so the next refresh()
+        checks every file.'''
+        if self._entries is None:
+            self._load()
+        self.stamp = -1
+        gen = self.generation + 1
+        for id, summary in summaries.items():
+            try:
+                st = os.stat(os.path.join(self.issues,id+issue.ext))
+            except OSError:
+                continue
+            self._entries[id] = (st.st_mtime_ns,st.st_size,st.st_ino,gen,self._compact(summary))
+            self._removed.pop(id,None)
+        self.generation = gen
+        self.save()
+    
+    def changes(self,since):
+        '''Returns a dict of ids to summary data of the issues which have
+        changed after the given generation, and a set of the ids of issues
+        which have been removed after it.'''
+        changed = dict((id,self._summary(id,e[4])) for id, e in self._entries.items() if e[3] > since)
+        removed = set(id for id, g in self._removed.items() if g > since)
+        return changed, removed
+    
+    def __iter__(self):
+        '''Iterates over the summary data of each cached issue'''
+        return (self._summary(id,e[4]) for id, e in self._entries.items())
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def items(self):
+        '''Returns an iterator of (id, summary data) pairs of every cached issue'''
+        return ((id,self._summary(id,e[4])) for id, e in self._entries.items())
+    
+    def get(self,id):
+        '''Returns the summary data for the given full issue id,
+        or None if it is not cached'''
+        entry = self._entries.get(id)
+        return self._summary(id,entry[4]) if entry is not None else None
+    
+    def load(self,id):
+        '''Reads the Issue with the given full id from its file'''
+        return issue.JSON_to_Issue(os.path.join(self.issues,id+issue.ext))
+
+class DerivedIndex(object):
+    '''Base class for persistent indexes built from an IssueCache.
+    
+    An index records the epoch and generation of the IssueCache it was
+    last brought up to date with.  refresh() asks the cache for the
+    issues which changed since then, and passes only those to _update(),
+    falling back to a full rebuild if the cache's epoch has changed or
+    the index is missing or corrupt.
+    
+    Subclasses set version, implement _clear() to reset their data,
+    _update(changed,removed) to incorporate changes, and _data() and
+    _set_data() to convert their data to and from JSON-safe values.
+    Indexes which don't fit in one file can instead override _load()
+    and _save(), using _current() and _header().
+    
+    An index whose path is None is only kept in memory, as is done for
+    stores which aren't persistent, see storage.MemoryStore.
+    '''
+    version = 1
+    
+    def __init__(self,issue_cache,path,ui=None):
+        self.issue_cache = issue_cache
+        self.path = path
+        self.ui = ui
+        self.generation = -1
+    
+    def _current(self,data):
+        '''Indicates the header of a stored index (see _header()) is for
+        this kind of index, and can be brought up to date with the cache'''
+        return (data['version'] == self.version and
+                data['epoch'] == self.issue_cache.epoch and
+                0 <= data['generation'] <= self.issue_cache.generation)
+    
+    def _header(self):
+        return {'version':self.version,'epoch':self.issue_cache.epoch,
+                'generation':self.generation}
+    
+    def _load(self):
+        '''Loads the stored index, returning False if it's missing,
+        corrupt, or cannot be brought up to date with the cache'''
+        try:
+            with open(self.path) as index_file:
+                data = json.load(index_file)
+            if not self._current(data):
+                return False
+            self._set_data(data['data'])
+            self.generation = data['generation']
+            return True
+        except IOError:
+            return False
+        except Exception as err:
+            if self.ui is not None:
+                self.ui.debug("Index at %s is invalid, rebuilding: %s" % (self.path,err))
+            return False
+    
+    def _save(self):
+        data = self._header()
+        data['data'] = self._data()
+        write_cache_file(self.path,data,self.ui)
+    
+    def refresh(self):
+        '''Brings the index up to date with the issue cache, and writes
+        it back out if anything changed.  Returns self.'''
+        name = type(self).__name__
+        loaded = self.generation >= 0
+        if not loaded and self.path is not None:
+            with trace.span("%s read" % name,path=self.path):
+                loaded = self._load()
+        if not loaded:
+            self._clear()
+            self.generation = 0
+            changed, removed = dict(self.issue_cache.items()), set()
+        elif self.generation == self.issue_cache.generation:
+            return self
+        else:
+            changed, removed = self.issue_cache.changes(self.generation)
+            removed.update(changed)
+        with trace.span("%s update" % name,changed=len(changed),removed=len(removed)):
+            self._update(changed,removed)
+        self.generation = self.issue_cache.generation
+        if self.path is not None:
+            with trace.span("%s write" % name,path=self.path):
+                self._save()
+        return self
+    
+    def _clear(self):
+        raise NotImplementedError()
+    
+    def _update(self,changed,removed):
+        '''Removes the issues in removed, which includes every changed issue,
+        and then adds the summary data in changed, a dict of ids to summaries'''
+        raise NotImplementedError()
+    
+    def _data(self):
+        raise NotImplementedError()
+    
+    def _set_data(self,data):
+        raise NotImplementedError()
+
+class FieldIndex(DerivedIndex):
+    '''A secondary index of the values of issue metadata fields to the
+    ids of the issues which have them.
+    
+    Empty values are indexed under the empty string, so for instance
+    the ids of all open issues are found under resolution ''.
+    
+    Each id is stored once, and the postings as arrays of positions in
+    that list of ids, so that loading the index doesn't make a string
+    for every time an id is listed.
+    '''
+    version = 2
+    fields = ['assigned_to','creator','listeners',
+              'issue','target','severity','status','resolution','category']
+    
+    def _clear(self):
+        self._index = dict((f,{}) for f in self.fields)
+    
+    def _update(self,changed,removed):
+        if removed:
+            for postings in self._index.values():
+                for value, ids in [(v,i) for v, i in postings.items() if not removed.isdisjoint(i)]:
+                    ids = [i for i in ids if i not in removed]
+                    if ids:
+                        postings[value] = ids
+                    else:
+                        del postings[value]
+        for id, summary in changed.items():
+            for f in self.fields:
+                values = summary.get(f)
+                if not isinstance(values,list):
+                    values = [values if values is not None else '']
+                for v in values:
+                    self._index[f].setdefault(v,[]).append(id)
+    
+    def _data(self):
+        positions = {}
+        def encode(ids):
+            return _encode_array(array.array('I',[positions.setdefault(i,len(positions)) for i in ids]))
+        index = dict((f,dict((v,encode(ids)) for v, ids in postings.items()))
+                     for f, postings in self._index.items())
+        return {'byteorder':sys.byteorder,'ids':[i for i in positions],'index':index}
+    
+    def _set_data(self,data):
+        self._clear()
+        ids = data['ids']
+        for f, postings in data['index'].items():
+            self._index[f] = dict((v,[ids[n] for n in _decode_array('I',text,data['byteorder'])])
+                                  for v, text in postings.items())
+    
+    def lookup(self,filters):
+        '''Returns the set of ids which could match the given filters
+        (see db.matches()), or None if no indexed filter was given.
+        
+        The result is a superset of the matching issues - filters
+        which are not indexed still need to be checked.'''
+        sets = []
+        for f in self.fields:
+            key = 'listener' if f == 'listeners' else f
+            if key not in filters:
+                continue
+            postings = self._index[f]
+            if f == 'listeners':
+                ids = set()
+                for l in filters[key]:
+                    ids.update(postings.get(l,[]))
+            else:
+                v = filters[key]
+                ids = set(postings.get(v if v is not None else '',[]))
+            sets.append(ids)
+        if 'resolved' in filters:
+            postings = self._index['resolution']
+            if filters['resolved']:
+                ids = set()
+                for v, i in postings.items():
+                    if v != '':
+                        ids.update(i)
+            else:
+                ids = set(postings.get('',[]))
+            sets.append(ids)
+        
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+class DateIndex(DerivedIndex):
+    '''A secondary index of issues ordered by their creation and
+    resolution dates, so issues can be walked oldest or newest first
+    without loading and sorting every issue.
+    
+    Each date field is stored as a sorted array of dates and a parallel
+    list of the ids of the issues with those dates, ordered by id where
+    dates are equal.  Issues without a date aren't indexed.  As in
+    FieldIndex, ids are stored once, with each field's listed as an
+    array of positions.
+    '''
+    version = 2
+    fields = ['creation_date','resolved_date']
+    
+    def _clear(self):
+        self._index = dict((f,(array.array('d'),[])) for f in self.fields)
+    
+    def _update(self,changed,removed):
+        for f in self.fields:
+            dates, ids = self._index[f]
+            pairs = [(d,i) for d, i in zip(dates,ids) if i not in removed]
+            pairs.extend((s[f],id) for id, s in changed.items() if s.get(f) is not None)
+            pairs.sort()
+            self._index[f] = (array.array('d',[d for d,_ in pairs]),[i for _,i in pairs])
+    
+    def _data(self):
+        positions = {}
+        def encode(ids):
+            return _encode_array(array.array('I',[positions.setdefault(i,len(positions)) for i in ids]))
+        index = dict((f,{'dates':_encode_array(d),'ids':encode(i)}) for f, (d,i) in self._index.items())
+        return {'byteorder':sys.byteorder,'ids':[i for i in positions],'index':index}
+    
+    def _set_data(self,data):
+        self._clear()
+        ids, byteorder = data['ids'], data['byteorder']
+        for f in self.fields:
+            stored = data['index'][f]
+            self._index[f] = (_decode_array('d',stored['dates'],byteorder),
+                              [ids[n] for n in _decode_array('I',stored['ids'],byteorder)])
+    
+    def ordered(self,field,reverse=False):
+        '''Returns an iterator of the ids of the issues with a value for
+        the given date field, oldest first, or newest first if reverse'''
+        ids = self._index[field][1]
+        return reversed(ids) if reverse else iter(ids)
+    
+    def position(self,field,date):
+        '''The number of issues whose date field is before date, found by
+        bisecting the sorted dates'''
+        return bisect.bisect_left(self._index[field][0],date)
+    
+    def range(self,field,since=None,before=None):
+        '''Returns a list of the ids of the issues whose date field is on
+        or after since, and before before, oldest first.  Either bound can
+        be None to leave that end open.'''
+        ids = self._index[field][1]
+        start = self.position(field,since) if since is not None else 0
+        end = self.position(field,before) if before is not None else len(ids)
+        return ids[start:end]
+
+class ColumnIndex(DerivedIndex):
+    '''A columnar snapshot of the metadata of every issue, for working
+    out aggregates over many issues without building an Issue, or even
+    a dict, for each of them, see stats.
+    
+    Each field is dictionary encoded: the distinct values it has are
+    listed in values[field], and codes[field] is an array with the index
+    into that list of each issue's value.  Code 0 is no value.  dates is
+    an array of each issue's creation date, and ids lists the issue in
+    each row.  Removing an issue moves the last row into its place, so
+    rows are in no particular order.
+    
+    The arrays are stored as base64 encoded bytes, so reading the index
+    needs almost no parsing.  Values are never removed from the
+    dictionaries until the index is rebuilt.
+    '''
+    version = 1
+    fields = ['assigned_to','creator','issue','target','severity','status',
+              'resolution','category']
+    
+    def _clear(self):
+        self.ids = []
+        self.values = dict((f,[None]) for f in self.fields)
+        self.codes = dict((f,array.array('I')) for f in self.fields)
+        self.dates = array.array('d')
+        self._rows = {}
+        self._coded = dict((f,{}) for f in self.fields)
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def code(self,field,value):
+        '''The code of a value of field, or None if no issue has it'''
+        if value is None or value == '':
+            return 0
+        return self._coded[field].get(value)
+    
+    def _update(self,changed,removed):
+        last = len(self.ids) - 1
+        for id in removed:
+            row = self._rows.pop(id,None)
+            if row is None:
+                continue
+            if row != last:
+                moved = self.ids[last]
+                self.ids[row] = moved
+                self._rows[moved] = row
+                for column in itertools.chain(self.codes.values(),[self.dates]):
+                    column[row] = column[last]
+            self.ids.pop()
+            for column in itertools.chain(self.codes.values(),[self.dates]):
+                column.pop()
+            last -= 1
+        
+        for id, summary in changed.items():
+            self._rows[id] = len(self.ids)
+            self.ids.append(id)
+            for f in self.fields:
+                value = summary.get(f)
+                code = self.code(f,value)
+                if code is None:
+                    code = self._coded[f][value] = len(self.values[f])
+                    self.values[f].append(value)
+                self.codes[f].append(code)
+            self.dates.append(summary.get('creation_date') or 0.0)
+    
+    def _data(self):
+        return {'byteorder':sys.byteorder,'ids':self.ids,'values':self.values,
+                'codes':dict((f,_encode_array(c)) for f, c in self.codes.items()),
+                'dates':_encode_array(self.dates)}
+    
+    def _set_data(self,data):
+        self._clear()
+        self.ids = data['ids']
+        self.values = data['values']
+        self.codes = dict((f,_decode_array('I',data['codes'][f],data['byteorder'])) for f in self.fields)
+        self.dates = _decode_array('d',data['dates'],data['byteorder'])
+        self._rows = dict((id,n) for n, id in enumerate(self.ids))
+        self._coded = dict((f,dict((v,n) for n, v in enumerate(vs) if n > 0))
+                           for f, vs in self.values.items())
+
+class RelationIndex(DerivedIndex):
+    '''A secondary index of the links between issues, so whole trees of
+    children and duplicates can be walked without reading each issue.
+    
+    Links are stored in both of the issues involved: a child names its
+    parent, and a parent lists its children, along with the issues
+    marked as duplicates of it, which name it as what they duplicate.
+    The index stores the [parent, children, duplicates] of each issue
+    with any link, and builds the links in the other direction in memory
+    the first time they're needed, so a link recorded on only one end is
+    still found.  A child listed by an issue which it doesn't name as its
+    parent, because it has since been moved, is ignored.
+    '''
+    version = 1
+    
+    def _clear(self):
+        self._links = {}
+        self._reverse = None
+    
+    def _update(self,changed,removed):
+        for id in removed:
+            self._links.pop(id,None)
+        for id, s in changed.items():
+            link = [s.get('parent'),s.get('children',[]),s.get('duplicates')]
+            if link[0] or link[1] or link[2]:
+                self._links[id] = link
+        self._reverse = None
+    
+    def _data(self):
+        return self._links
+    
+    def _set_data(self,data):
+        self._links = data
+        self._reverse = None
+    
+    def _build(self):
+        '''Works out each issue's children and duplicates, and the
+        issue each is under'''
+        children, dups, up = {}, {}, {}
+        for id, (parent, kids, dup) in self._links.items():
+            if dup:
+                dups.setdefault(dup,set()).add(id)
+                up[id] = dup
+            elif parent:
+                children.setdefault(parent,set()).add(id)
+                up[id] = parent
+        for id, (_, kids, _) in self._links.items():
+            for kid in kids:
+                link = self._links.get(kid)
+                if link is None or not (link[0] or link[2]):
+                    children.setdefault(id,set()).add(kid)
+                    up.setdefault(kid,id)
+        self._reverse = (children,dups,up)
+        return self._reverse
+    
+    def children(self,id):
+        '''Returns a set of the ids of the children of the issue id,
+        not including its duplicates'''
+        return (self._reverse or self._build())[0].get(id,set())
+    
+    def duplicates(self,id):
+        '''Returns a set of the ids of the duplicates of the issue id'''
+        return (self._reverse or self._build())[1].get(id,set())
+    
+    def parent(self,id):
+        '''Returns the id of the issue id is a child or duplicate of,
+        or None'''
+        return (self._reverse or self._build())[2].get(id)
+    
+    def roots(self):
+        '''Returns a set of the ids of the issues which have children or
+        duplicates, but aren't under another issue themselves'''
+        children, dups, up = self._reverse or self._build()
+        return set(i for i in itertools.chain(children,dups) if i not in up)
+
+class ShardedIndex(DerivedIndex):
+    '''Base class for indexes too large to read whole for every lookup.
+    
+    The index is stored in a directory, with its entries split between a
+    fixed number of bucket files of each of the kinds of entry it holds,
+    by a hash of their key, plus a meta file holding the header.  Buckets
+    are read the first time a key in them is looked up, and only the
+    buckets which changed are rewritten.
+    
+    Subclasses set kinds, a string of the one letter names of their kinds
+    of entry, and look up entries with _bucket().
+    '''
+    buckets = 64
+    kinds = ''
+    
+    def __init__(self,issue_cache,path,ui=None):
+        DerivedIndex.__init__(self,issue_cache,path,ui)
+        self._buckets = {}
+        self._dirty = set()
+    
+    def _file(self,name):
+        return os.path.join(self.path,name)
+    
+    def _bucket(self,kind,key):
+        '''Returns the name and contents of the bucket of the given kind the
+        key belongs in'''
+        name = '%s%02x' % (kind,zlib.crc32(key.encode('utf-8')) % self.buckets)
+        if name not in self._buckets:
+            try:
+                with open(self._file(name)) as bucket_file:
+                    self._buckets[name] = json.load(bucket_file)
+            except IOError:
+                self._buckets[name] = {}
+        return name, self._buckets[name]
+    
+    def _load(self):
+        try:
+            with open(self._file('meta')) as meta_file:
+                data = json.load(meta_file)
+            if not self._current(data):
+                return False
+            self.generation = data['generation']
+            return True
+        except IOError:
+            return False
+        except Exception as err:
+            if self.ui is not None:
+                self.ui.debug("Index at %s is invalid, rebuilding: %s" % (self.path,err))
+            return False
+    
+    def _save(self):
+        # invalidate the index while it is being written, so an interrupted
+        # write is rebuilt rather than trusted
+        if not write_cache_file(self._file('meta'),{'version':self.version,'epoch':None,
+                                                    'generation':-1},self.ui):
+            return
+        if self._save_buckets():
+            write_cache_file(self._file('meta'),self._header(),self.ui)
+    
+    def _save_buckets(self):
+        '''Writes the buckets which changed, returning False if any could
+        not be written'''
+        for name in list(self._dirty):
+            if not write_cache_file(self._file(name),self._buckets[name],self.ui):
+                return False
+            self._dirty.discard(name)
+        return True
+    
+    def _clear(self):
+        self._buckets = {}
+        for kind in self.kinds:
+            for n in range(self.buckets):
+                self._buckets['%s%02x' % (kind,n)] = {}
+        self._dirty = set(self._buckets)
+
+class SearchIndex(ShardedIndex):
+    '''A full-text inverted index of the text of every issue - its title,
+    description, reproduction steps, expected result, stack trace and
+    comments - mapping each token to the ids of the issues containing it,
+    and how many times it occurs in each.
+    
+    The postings are kept in 'p' buckets by token, so a search only reads
+    the buckets of the terms being searched for.  A forward index of each
+    issue's tokens is kept in 'd' buckets by issue id, and updates only
+    read and rewrite the buckets of the issues that changed.
+    '''
+    version = 1
+    kinds = 'pd'
+    _token_re = re.compile(r'\w\w+')
+    
+    @classmethod
+    def tokens(cls,text):
+        '''Splits text into lower case search tokens'''
+        return cls._token_re.findall(text.lower()) if text else []
+    
+    def _update(self,changed,removed):
+        for id in removed:
+            name, docs = self._bucket('d',id)
+            tokens = docs.pop(id,None)
+            if tokens is None:
+                continue
+            self._dirty.add(name)
+            for token in tokens:
+                name, postings = self._bucket('p',token)
+                ids = postings.get(token)
+                if ids is not None and ids.pop(id,None) is not None:
+                    if not ids:
+                        del postings[token]
+                    self._dirty.add(name)
+        
+        for id in changed:
+            try:
+                iss = self.issue_cache.load(id)
+            except error.NoSuchIssue:
+                continue
+            counts = {}
+            for text in [iss.title,iss.description,iss.reproduction,iss.expected,iss.trace]+[c[2] for c in iss.comments]:
+                for token in self.tokens(text):
+                    counts[token] = counts.get(token,0) + 1
+            name, docs = self._bucket('d',id)
+            docs[id] = [t for t in counts]
+            self._dirty.add(name)
+            for token, count in counts.items():
+                name, postings = self._bucket('p',token)
+                postings.setdefault(token,{})[id] = count
+                self._dirty.add(name)
+    
+    def search(self,groups):
+        '''Returns a list of (id, score) pairs of the issues matching any
+        of the given groups of terms, where an issue matches a group if it
+        contains every term in it.  Results are ranked by the sum of the
+        number of times the terms of each matching group occur.'''
+        scores = {}
+        for group in groups:
+            tokens = []
+            for term in group:
+                tokens.extend(self.tokens(term))
+            if not tokens:
+                continue
+            postings = [self._bucket('p',t)[1].get(t,{}) for t in tokens]
+            postings.sort(key=len)
+            for id in postings[0]:
+                if all(id in p for p in postings[1:]):
+                    scores[id] = scores.get(id,0) + sum(p[id] for p in postings)
+        return sorted(scores.items(),key=lambda i: (-i[1],i[0]))
+
+class SimilarIndex(ShardedIndex):
+    '''A MinHash index of the titles and stack traces of every issue, to
+    find issues which are likely duplicates of one another.
+    
+    Each issue is reduced to a set of shingles: the words of its title,
+    and the first trace_lines distinct lines of its stack trace, with
+    numbers removed so the same crash reported from another version
+    still matches.  Its signature holds, for each of perms hash
+    functions, the smallest hash of any of its shingles; two issues
+    share each value with probability equal to the Jaccard similarity of
+    their shingles, so the fraction of values they share estimates it.
+    Only the low 16 bits of each value are kept, which barely changes the
+    estimate but halves the size of the index.
+    
+    Signatures are split into bands, and each band is a key in the 'b'
+    buckets, listing the issues with that band, so a lookup only reads
+    the buckets of its own bands, and only compares signatures with the
+    issues sharing at least one of them.  With 12 bands of 3 values an
+    issue 50% similar shares a band 80% of the time, and one 70% similar
+    almost always does.  Signatures are kept in 'd' buckets.  Buckets
+    refer to issues by the first id_length characters of their id, to
+    keep them small, and the 'd' bucket records the full id.
+    
+    Since bringing the index up to date means loading the issue cache,
+    it can also be used as it was last written, passing None for the
+    issue_cache, see stored() and add().
+    '''
+    version = 1
+    buckets = 256
+    kinds = 'bd'
+    perms = 36
+    bands = 12
+    trace_lines = 20
+    id_length = 12
+    # how many of the issues sharing the most bands to compare signatures with
+    candidates = 50
+    # the least estimated similarity reported by similar()
+    threshold = 0.5
+    _word_re = re.compile(r'\w\w+')
+    _number_re = re.compile(r'\d+')
+    _prime = (1 << 61) - 1
+    _coefficients = None
+    
+    @classmethod
+    def shingles(cls,title,trace):
+        '''Returns the set of shingles of an issue's title and trace'''
+        ret = set('t:'+w for w in cls._word_re.findall(title.lower())) if title else set()
+        if trace:
+            lines = set()
+            for line in trace.splitlines():
+                line = ' '.join(cls._number_re.sub('',line).split())
+                if line and line not in lines:
+                    lines.add(line)
+                    if len(lines) >= cls.trace_lines:
+                        break
+            ret.update('s:'+l for l in lines)
+        return ret
+    
+    @classmethod
+    def signature(cls,shingles):
+        '''Returns the MinHash signature of a set of shingles, as a tuple
+        of perms ints, or None if it's empty'''
+        if not shingles:
+            return None
+        if cls._coefficients is None:
+            import random
+            # changing the seed changes every signature, so needs a new version
+            rng = random.Random(0)
+            SimilarIndex._coefficients = [(rng.randrange(1,cls._prime),rng.randrange(cls._prime))
+                                          for _ in range(cls.perms)]
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles]
+        prime = cls._prime
+        return tuple(min([(a*h+b) % prime for h in hashes]) & 0xffff
+                     for a, b in cls._coefficients)
+    
+    @classmethod
+    def issue_signature(cls,iss):
+        return cls.signature(cls.shingles(iss.title,iss.trace))
+    
+    @classmethod
+    def _encode(cls,sig):
+        '''Returns a signature as a string of 4 hex digits per value'''
+        return struct.pack('>%dH' % cls.perms,*sig).hex()
+    
+    @classmethod
+    def _decode(cls,data):
+        return struct.unpack('>%dH' % cls.perms,bytes.fromhex(data))
+    
+    @classmethod
+    def _keys(cls,data):
+        '''The bucket keys of each band of an encoded signature'''
+        width = 4 * cls.perms // cls.bands
+        return ['%x:%s' % (n,data[n*width:(n+1)*width]) for n in range(cls.bands)]
+    
+    def stored(self):
+        '''Indicates the index has been written, though it may be out of
+        date, for using it without an issue cache.  If so, sets epoch and
+        generation to those of the cache it was last brought up to date
+        with, and written to when it was, in nanoseconds, see stale().'''
+        try:
+            meta = self._file('meta')
+            with open(meta) as meta_file:
+                data = json.load(meta_file)
+                written = os.fstat(meta_file.fileno()).st_mtime_ns
+            if data['version'] != self.version or data['generation'] < 0:
+                return False
+        except (IOError,ValueError,KeyError,TypeError):
+            return False
+        self.epoch, self.generation, self.written = data['epoch'], data['generation'], written
+        return True
+    
+    def stale(self,store):
+        '''Indicates issues may have been added to or removed from store,
+        the store the index is of, since the stored index was written,
+        without loading the issue cache.  Call stored() first.  An indexed
+        store is its own issue cache, so its generation is compared, and
+        otherwise the store's stamp is compared with when the index was
+        written.  Issues changed in place aren't detected, only by a
+        refresh().'''
+        if store.indexed:
+            store.refresh()
+            return store.epoch != self.epoch or store.generation > self.generation
+        stamp = store.stamp()
+        return stamp is not None and stamp >= self.written
+    
+    def _remove(self,id):
+        short = id[:self.id_length]
+        name, docs = self._bucket('d',short)
+        doc = docs.get(short)
+        if doc is None or doc[0] != id:
+            return
+        del docs[short]
+        self._dirty.add(name)
+        for key in self._keys(doc[1]):
+            name, bucket = self._bucket('b',key)
+            ids = bucket.get(key)
+            if ids is not None and short in ids:
+                ids.remove(short)
+                if not ids:
+                    del bucket[key]
+                self._dirty.add(name)
+    
+    def _add(self,iss):
+        '''Adds an issue, which must not be in the index'''
+        sig = self.issue_signature(iss)
+        if sig is None:
+            return
+        short = iss.id[:self.id_length]
+        data = self._encode(sig)
+        name, docs = self._bucket('d',short)
+        docs[short] = [iss.id,data]
+        self._dirty.add(name)
+        for key in self._keys(data):
+            name, bucket = self._bucket('b',key)
+            bucket.setdefault(key,[]).append(short)
+            self._dirty.add(name)
+    
+    def _update(self,changed,removed):
+        for id in removed:
+            self._remove(id)
+        for id in changed:
+            try:
+                self._add(self.issue_cache.load(id))
+            except error.NoSuchIssue:
+                continue
+    
+    def add(self,issues):
+        '''Adds or replaces the given issues in the stored index, without
+        bringing it up to date, leaving its generation alone, so they are
+        added again by the next refresh().  Used to make new issues visible
+        to lookups which don't refresh the index.'''
+        for iss in issues:
+            self._remove(iss.id)
+            self._add(iss)
+        self._save_buckets()
+    
+    def similar(self,iss,threshold=None):
+        '''Returns a list of (id, similarity) pairs of the issues whose
+        estimated similarity to iss is at least threshold, most similar
+        first, excluding iss itself'''
+        if threshold is None:
+            threshold = self.threshold
+        sig = self.issue_signature(iss)
+        if sig is None:
+            return []
+        counts = {}
+        for key in self._keys(self._encode(sig)):
+            for short in self._bucket('b',key)[1].get(key,[]):
+                counts[short] = counts.get(short,0) + 1
+        counts.pop(iss.id[:self.id_length],None)
+        best = heapq.nlargest(self.candidates,counts,key=counts.get)
+        ret = []
+        for short in best:
+            doc = self._bucket('d',short)[1].get(short)
+            if doc is None:
+                continue
+            score = sum(1 for a, b in zip(sig,self._decode(doc[1])) if a == b) / self.perms
+            if score >= threshold:
+                ret.append((doc[0],score))
+        ret.sort(key=lambda i: (-i[1],i[0]))
+        return ret
+
+def _encode_array(column):
+    '''Encodes an array as base64 text, to be stored in a JSON cache file
+    along with sys.byteorder, so reading it needs almost no parsing'''
+    return base64.b64encode(column.tobytes()).decode('ascii')
+
+def _decode_array(typecode,text,byteorder):
+    '''Decodes an array encoded by _encode_array() on a machine with the
+    given byteorder'''
+    column = array.array(typecode)
+    column.frombytes(base64.b64decode(text))
+    if byteorder != sys.byteorder:
+        column.byteswap()
+    return column
+
+def write_cache_file(path,data,ui=None):
+    '''Atomically writes the given data as JSON to the given path in a
+    .cache directory, creating the directory if necessary.
+    
+    Returns True if the file was written.  Failing to write a cache is
+    not an error, the cache will simply be rebuilt next time.'''
+    try:
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        util.atomic_write(path,json.dumps(data,separators=(',',':')))
+        return True
+    except (IOError,OSError) as err:
+        if ui is not None:
+            ui.debug("Could not write cache file %s: %s" % (path,err))
+        return False
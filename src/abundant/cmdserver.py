@@ -0,0 +1,223 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+A command server, which runs commands sent to it over a Unix socket
+in one long running process.  Commands run by the server skip starting
+the interpreter, importing Abundant, and parsing config files, and
+reuse the prefixes and caches already loaded for their database, which
+are refreshed, or dropped and reloaded, when the files behind them
+change.
+
+Styled after Mercurial's command server.  Every message, in either
+direction, is a one byte channel, a four byte big-endian length, and
+that many bytes of data.  The client sends:
+  r  a command to run: the working directory and then each argument,
+     each followed by a NUL byte
+  i  a line of input, in response to an I message, empty at EOF
+The server sends:
+  o  output
+  e  error output
+  I  a request for a line of input
+  x  the command has finished, the data is its exit code as a four
+     byte big-endian signed integer
+
+The client half of this module is used by the ab script before anything
+else is imported, and so should only import what it needs.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import os,socket,struct,sys
+
+_header = struct.Struct('>cI')
+# set while this process is serving commands
+_serving = False
+# output is sent in chunks of about this size
+_bufsize = 64*1024
+
+def _send(sock,channel,data):
+    sock.sendall(_header.pack(channel,len(data))+data)
+
+def _recvall(sock,size):
+    data = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError("Command server connection closed")
+        data.append(chunk)
+        size -= len(chunk)
+    return b''.join(data)
+
+def _recv(sock):
+    channel, size = _header.unpack(_recvall(sock,_header.size))
+    return channel, _recvall(sock,size)
+
+#
+# Client
+#
+
+def connect(address,args,cwd):
+    '''Runs a command on the command server listening at address,
+    forwarding its input and output to the sys streams, and returns
+    its exit code.
+
+    Raises OSError only if the server cannot be reached, in which
+    case nothing has been run, and the caller can run the command
+    itself.'''
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+
+    out = sys.stdout.buffer
+    err = sys.stderr.buffer
+    try:
+        _send(sock,b'r',(''.join(i+'\0' for i in [cwd]+args)).encode('utf-8'))
+        while True:
+            channel, data = _recv(sock)
+            if channel == b'o':
+                out.write(data)
+            elif channel == b'e':
+                out.flush()
+                err.write(data)
+                err.flush()
+            elif channel == b'I':
+                out.flush()
+                _send(sock,b'i',sys.stdin.buffer.readline())
+            elif channel == b'x':
+                return struct.unpack('>i',data)[0]
+    except (OSError,EOFError) as e:
+        err.write(("Lost connection to command server: %s\n" % e).encode('utf-8'))
+        return 255
+    finally:
+        try: out.flush()
+        except OSError: pass
+        sock.close()
+
+#
+# Server
+#
+
+class _Channel(object):
+    '''A file-like object which buffers writes to a channel'''
+    def __init__(self,sock,channel):
+        self.sock = sock
+        self.channel = channel
+        self._buf = []
+        self._size = 0
+
+    def write(self,data):
+        self._buf.append(data)
+        self._size += len(data)
+        if self._size >= _bufsize:
+            self.flush()
+
+    def flush(self):
+        if self._buf:
+            data = ''.join(self._buf).encode('utf-8')
+            self._buf = []
+            self._size = 0
+            _send(self.sock,self.channel,data)
+
+    def isatty(self):
+        return False
+
+class _Input(object):
+    '''A file-like object which reads lines from the client'''
+    def __init__(self,sock,channels):
+        self.sock = sock
+        self.channels = channels
+
+    def readline(self):
+        for c in self.channels:
+            c.flush()
+        _send(self.sock,b'I',b'')
+        channel, data = _recv(self.sock)
+        if channel != b'i':
+            raise EOFError("Expected input from the command server client")
+        return data.decode('utf-8')
+
+def serve(ui,address):
+    '''Listens on a Unix socket at address, and runs the commands sent to
+    it one at a time, until interrupted.
+
+    Commands run with the working directory sent by the client, but
+    with the server's environment.  Commands which launch an editor
+    launch it from the server.'''
+    from abundant import error
+
+    global _serving
+    if _serving:
+        raise error.Abort("Cannot start a command server from a command server")
+    if not address:
+        raise error.Abort("No address to listen on, use -a,--address.")
+    if os.path.exists(address):
+        probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            probe.connect(address)
+            raise error.Abort("A command server is already listening on %s" % address)
+        except OSError:
+            os.unlink(address) # left behind by a server which didn't exit cleanly
+        finally:
+            probe.close()
+
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    sock.bind(address)
+    try:
+        sock.listen(16)
+        ui.write("Command server listening on %s" % address)
+        ui.flush()
+        dbs = {}
+        _serving = True
+        while True:
+            conn, _ = sock.accept()
+            try:
+                _runcommand(conn,dbs)
+            except (OSError,EOFError) as err:
+                ui.debug("Command server client went away: %s" % err)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _serving = False
+        sock.close()
+        os.unlink(address)
+
+def _runcommand(conn,dbs):
+    '''Runs one command sent over conn, reusing the DB objects in dbs'''
+    from abundant import abundant
+    from abundant import ui as usrint
+
+    channel, data = _recv(conn)
+    if channel != b'r':
+        return
+    args = data.decode('utf-8').split('\0')[:-1]
+    cwd, args = args[0], args[1:]
+
+    out = _Channel(conn,b'o')
+    err = _Channel(conn,b'e')
+    inp = _Input(conn,[out,err])
+
+    # anything written straight to the sys streams, such as tracebacks,
+    # should go to the client too
+    oldcwd, oldout, olderr = os.getcwd(), sys.stdout, sys.stderr
+    os.chdir(cwd)
+    sys.stdout, sys.stderr = out, err
+    try:
+        ret = abundant.exec(args,cwd,usrint.UI(inp,out,err),dbs)
+    finally:
+        sys.stdout, sys.stderr = oldout, olderr
+        os.chdir(oldcwd)
+    out.flush()
+    err.flush()
+    _send(conn,b'x',struct.pack('>i',ret))
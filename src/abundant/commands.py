@@ -15,14 +15,17 @@ of command line tasks to functions in this module.
 Created on Feb 10, 2011
 '''
 
-import os,sys,time
-from abundant import error,issue,util
-from abundant import db as database, ui as useri
+import itertools,os,sys,time
+from abundant import error,util
+from abundant import ui as useri
 
 # commands ordered alphabetically
 # the doc comments for functions in this module should
 # be considered world readable, as they are served up
 # as the help documentation for each command.
+# modules only some commands need are imported by those
+# commands, so that commands like help and version start
+# as quickly as possible.
 
 def adduser(ui,db,*args,**opts):
     '''Manually add a user to the list of users
@@ -58,6 +61,63 @@ def assign(ui,db,prefix,user,*args,**opts):
                listener=[],rl=[],issue=None,target=None,severity=None,
                status=None,resolution=None,category=None)
 
+def batch(ui,*args,**opts):
+    '''Run many commands, read from standard input
+    
+    Reads one command line per line of input, and runs them all in
+    this process, so that loading Abundant and the database is only
+    paid for once.  Command lines are split like a shell would split
+    them, or can be a JSON array of arguments, such as
+    ["new","A title","-s","High"].  Use -0,--null if command lines
+    are separated by NUL characters rather than newlines.
+    
+    After each command a line of JSON is output, an object with the
+    command's arguments (args), exit code (ret), output (out) and
+    error output (err).  Commands cannot prompt for input, and get
+    the default answer to any question they would ask.
+    '''
+    from abundant import batch as batchmode
+    cwd = os.path.join(os.getcwd(),opts['database']) if opts['database'] else os.getcwd()
+    return batchmode.run(ui,cwd,opts['null'])
+
+def burndown(ui,db,*args,**opts):
+    '''Show how many issues were opened and resolved over time
+    
+    For each day or week, set by --bucket, by default week, shows how
+    many issues matching the filters, which are the same as list's, were
+    opened and resolved, and the backlog of issues still open at its end,
+    each with the sum of their estimates.  Weeks start on Monday.
+    
+    The last 12 periods, up to and including the current one, are shown,
+    use -n,--periods to show more or fewer, or --since to start from the
+    period containing a date, like 2011-03-14.
+    
+    Resolved issues without a resolved date can't be placed in time, so
+    aren't counted.
+    '''
+    from abundant import stats as aggregate
+    if opts['bucket'] not in aggregate.period_days:
+        raise error.Abort("Cannot bucket by %s, choices: %s" %
+                          (opts['bucket'],util.list2str(sorted(aggregate.period_days))))
+    if opts['periods'] is not None and opts['periods'] < 1:
+        raise error.Abort("There must be at least one period")
+    since = _date(opts,'since')
+    filters = _filters(db,opts)
+    
+    edges = aggregate.periods(opts['bucket'],opts['periods'] or 12,since)
+    periods = aggregate.burndown(db,edges,filters)
+    
+    rows = [["Week of" if opts['bucket'] == 'week' else "Day","Opened","Resolved","Backlog",
+             "Est. Opened","Est. Resolved","Est. Backlog"]]
+    for p in periods:
+        rows.append([time.strftime('%Y-%m-%d',time.localtime(p.start)),
+                     str(p.opened),str(p.resolved),str(p.backlog),
+                     "%.1f" % p.opened_estimate,"%.1f" % p.resolved_estimate,
+                     "%.1f" % p.backlog_estimate])
+    ui.pager('burndown')
+    _table(ui,rows,1)
+    return 0
+
 def child(ui,db,child_pref,parent_pref,*args,**opts):
     '''Mark an issue as a child of another issue
     
@@ -72,15 +132,17 @@ def child(ui,db,child_pref,parent_pref,*args,**opts):
         if not ui.confirm("Issue %s is already a child of issue %s, do you really want to change it's parent to issue %s?"
                    % (child_pref,db.iss_prefix.prefix(child.parent),parent_pref), True):
             raise error.Abort("Did not change issue %s's parent." % child_pref)
-        orig = db.get_issue(child.parent)
-        orig.children.remove(child.id)
-        orig.to_JSON(db.issues)
-    
-    child.parent = parent.id
-    parent.children.append(child.id)
     
-    child.to_JSON(db.issues)
-    parent.to_JSON(db.issues)
+    with db.batch() as batch:
+        if child.parent:
+            orig = db.get_issue(child.parent)
+            orig.children.remove(child.id)
+            batch.put(orig)
+        
+        child.parent = parent.id
+        parent.children.append(child.id)
+        
+        batch.put(child,parent)
     
     ui.write("Marked issue %s as a child of issue %s" % (child_pref,parent_pref))
     return 0
@@ -94,6 +156,7 @@ def comment(ui,db,pref,*args,**opts):
     Otherwise, an editor is launched and the user is prompted
     to construct a comment.
     '''
+    from abundant import issue
     
     iss = db.get_issue(pref)
     
@@ -111,7 +174,7 @@ def comment(ui,db,pref,*args,**opts):
     comment = [ui.config('ui','username'),time.time(),message]
     iss.comments.append(comment)
     
-    iss.to_JSON(db.issues)
+    db.put_issue(iss)
     
     ui.write("Added Comment to Issue %s:" % db.iss_prefix.prefix(iss.id))
     ui.write(issue.comment_to_str(comment,ui))
@@ -138,17 +201,17 @@ def duplicate(ui,db,dup_pref,parent_pref,*args,**opts):
     dup_iss = db.get_issue(dup_pref)
     par_iss = db.get_issue(parent_pref)
     
-    # clear original parent
-    if dup_iss.parent:
-        orig_par = db.get_issue(dup_iss.parent)
-        orig_par.children.remove(dup_iss.id)
-        orig_par.to_JSON(db.issues)
-    
-    par_iss.children.append(dup_iss.id)
-    dup_iss.duplicates = par_iss.id
-    
-    par_iss.to_JSON(db.issues)
-    dup_iss.to_JSON(db.issues)
+    with db.batch() as batch:
+        # clear original parent
+        if dup_iss.parent:
+            orig_par = db.get_issue(dup_iss.parent)
+            orig_par.children.remove(dup_iss.id)
+            batch.put(orig_par)
+        
+        par_iss.children.append(dup_iss.id)
+        dup_iss.duplicates = par_iss.id
+        
+        batch.put(par_iss,dup_iss)
     
     ui.write("Marked issue %s as a duplicate of issue %s" % (dup_pref,parent_pref))
 
@@ -213,13 +276,43 @@ def edit(ui,db,pref,*args,**opts):
         iss.expected = expected if expected else None
         iss.trace = trace if trace else None
         
-    iss.to_JSON(db.issues)
+    db.put_issue(iss)
     
     ui.write("Updated issue %s" % db.iss_prefix.pref_str(iss.id,True))
     ui.write(iss.descChanges(origiss,ui))
     
     return 0
 
+def export(ui, db, *args, **opts):
+    '''Export issues as JSON Lines
+    
+    Writes every issue, one per line, as a JSON object of the same
+    data as its file, for ab import or other tools to read.  Issues
+    are written as they're read, so any number can be exported.
+    
+    Use the same options as list to export only some issues, except
+    that resolved issues are included unless -o,--open is set, and
+    -r,--resolved exports only resolved issues.  Issues are written to
+    the output stream unless --output is set.
+    '''
+    from abundant import transfer
+    filters = _filters(db,opts)
+    if opts['resolved'] and opts['open']:
+        raise error.Abort("Cannot export only open and only resolved issues")
+    if opts['resolved'] or opts['open']:
+        filters['resolved'] = bool(opts['resolved'])
+    issues = _get_issues(db,filters,opts)
+    
+    if opts['output']:
+        path = opts['output']
+        with open(path,'w') as out:
+            count = transfer.export(issues,out.write)
+        ui.write("Exported %d issue%s to %s" % (count,'' if count == 1 else 's',path))
+    else:
+        ui.pager('export')
+        transfer.export(issues,lambda line: ui.quiet(line,ln=False))
+    return 0
+
 def help(ui,prefix=None,*args,**opts):
     '''Get help using Abundant'''
     from abundant import abundant
@@ -265,17 +358,88 @@ def help(ui,prefix=None,*args,**opts):
     
     return 1 if fail else 0
         
+def import_iss(ui, db, path, *args, **opts):
+    '''Import issues from a JSON Lines or CSV file
+    
+    Creates an issue for each record in the file, which is read in
+    the format of ab export if it's JSON Lines.  A CSV file needs a
+    header row naming the issue field in each column.  The format is
+    guessed from the file name unless -f,--format is set, and - reads
+    from the input stream.
+    
+    Records without an id get a new one, and every issue needs a
+    title.  Metadata like severity must be one of the database's
+    options, and users must already be in the users file, unless
+    --add-users is set to add them.  Importing stops at the first
+    invalid record, after writing the records before it, and adding
+    the users they name, so use --check first to validate the whole
+    file without importing it.
+    
+    Issues are written in batches, and the caches are brought up to
+    date once every issue has been written.
+    '''
+    from abundant import transfer
+    format = opts['format'] or transfer.guess_format(path)
+    importer = transfer.Importer(ui,db,opts['add_users'],opts['check'])
+    # load the issue cache before writing, so it's updated with what's
+    # imported rather than re-reading every new issue later
+    if not opts['check']:
+        db.issue_cache
+    
+    count = 0
+    fp = ui.inp if path == '-' else open(path,newline='')
+    try:
+        with db.batch(fsync=False,size=transfer.batch_size) as batch:
+            try:
+                for line, record in transfer.records(fp,format):
+                    iss = importer.convert(line,record)
+                    if not opts['check']:
+                        batch.put(iss)
+                    count += 1
+                    if count % 10000 == 0:
+                        ui.verbose("%d issues read" % count)
+            except error.Abort:
+                # keep every record before the invalid one, not just
+                # the batches which happen to have been written already
+                if not opts['check']:
+                    batch.commit()
+                    db.store.sync()
+                    importer.write_users()
+                    ui.write("Imported %d issue%s before the invalid record" %
+                             (count,'' if count == 1 else 's'))
+                raise
+        importer.write_users()
+    finally:
+        if fp is not ui.inp:
+            fp.close()
+    
+    if opts['check']:
+        ui.write("%d issue%s can be imported" % (count,'' if count == 1 else 's'))
+    else:
+        db.store.sync()
+        if not db.store.indexed:
+            db.field_index
+            db.date_index
+        ui.write("Imported %d issue%s" % (count,'' if count == 1 else 's'))
+    if importer.added_users:
+        ui.write("%s %d user%s: %s" % ("Would add" if opts['check'] else "Added",
+                                     len(importer.added_users),
+                                     '' if len(importer.added_users) == 1 else 's',
+                                     util.list2str(importer.added_users)))
+    return 0
+
 def init(ui, dir='.',*args,**opts):
     '''Initialize an Abundant database
     
     Creates an '.ab' directory in the specified directory,
     or the cwd if not otherwise set.
     '''
+    from abundant import db as database
     db = database.DB(dir,False)
     if db.exists():
         raise error.Abort("Abundant database already exists.")
     # don't need to make db.db because makedirs handles that
-    os.makedirs(db.issues)
+    db.store.create()
     os.mkdir(db.cache)
     with open(db.conf,'w'):# as conf:
         # write any initial configuration to config file
@@ -296,12 +460,54 @@ def list(ui, db, *args, **opts):
     
     Use the other parameters, detailed below, to further filter
     the issues you wish to see.
+    
+    Issues are listed in no particular order, unless --sort is set to
+    creation_date, resolved_date, severity, assignee or title.
+    Severities are ordered as they're listed in the database's config.
+    Use --reverse to sort in descending order, such as newest first,
+    and -n,--limit to show only the first few issues, for instance:
+    
+    ab list -i Bug --sort creation_date --reverse -n 20
+    
+    --created-since, --created-before and --resolved-since take a date,
+    like 2011-03-14, optionally followed by a time, like 2011-03-14 15:09,
+    and are found with the date index, for instance the bugs resolved
+    since the start of March:
+    
+    ab list -r -i Bug --resolved-since 2011-03-01
     '''
     
+    filters = _filters(db,opts)
+    filters['resolved'] = bool(opts['resolved'])
+    
+    iss_iter = _get_issues(db,filters,opts)
+    
+    count = 0
+    
+    ui.pager('list')
+    for i in iss_iter:
+        ui.quiet(db.iss_prefix.prefix(i.id),ln=False)
+        ui.write(":\t%s" % i.title,ln=False)
+        ui.quiet()
+        count += 1
+    
+    ui.write("Found %s matching issue%s" % (count if count > 0 else "no","" if count == 1 else "s"))
+    
+    return 0 if count > 0 else 1
+
+def _filters(db,opts):
+    '''Turns the filtering options list takes into filters for
+    db.get_issues(), apart from -r,--resolved.  Options other commands
+    taking these filters don't have are ignored.'''
+    filters = {}
     if opts['assigned_to'] != '*':
-        user = db.get_user(opts['assigned_to']) if opts['assigned_to'] else None
+        filters['assigned_to'] = db.get_user(opts['assigned_to']) if opts['assigned_to'] else None
     if opts['listener']:
-        lstset = set([db.get_user(i) for i in opts['listener']])
+        filters['listener'] = set([db.get_user(i) for i in opts['listener']])
+    if opts['creator']:
+        filters['creator'] = db.get_user(opts['creator'])
+    if opts['grep']:
+        filters['grep'] = opts['grep']
     
     # Metadata
     metas = ['issue','severity','status','category','resolution']
@@ -314,34 +520,86 @@ def list(ui, db, *args, **opts):
                               (err.prefix,meta,util.list2str(err.choices)))
         except Exception as err:
             pass # do nothing, it's not a valid prefix
+    for meta in metas+['target']:
+        if opts[meta]:
+            filters[meta] = opts[meta]
+    
+    for key in ['created_since','created_before','resolved_since']:
+        if opts.get(key):
+            filters[key] = _date(opts,key)
+    return filters
+
+def _date(opts,key):
+    '''Parses the date given to an option, or returns None if it wasn't'''
+    if not opts.get(key):
+        return None
+    try:
+        return util.parse_date(opts[key])
+    except ValueError:
+        raise error.Abort("%s is not a valid date for --%s, use a date like 2011-03-14" %
+                          (opts[key],key.replace('_','-')))
+
+def _get_issues(db,filters,opts):
+    '''Gets the issues matching filters, ordered by the --sort,
+    --reverse and --limit options list takes'''
+    sort = {'assignee':'assigned_to'}.get(opts.get('sort'),opts.get('sort'))
+    if opts.get('limit') is not None and opts['limit'] < 0:
+        raise error.Abort("The limit cannot be negative")
+    return db.get_issues(sort=sort,reverse=bool(opts.get('reverse')),limit=opts.get('limit'),
+                         **filters)
 
-    iss_iter = (i for i in db.get_issues()
-            if (bool(i.resolution) == bool(opts['resolved'])) and
-               (opts['assigned_to'] == '*' or i.assigned_to == user) and
-               (not opts['listener'] or not set(i.listeners).isdisjoint(lstset)) and
-               (not opts['issue'] or i.issue == opts['issue']) and
-               (not opts['target'] or i.target == opts['target']) and
-               (not opts['severity'] or i.severity == opts['severity']) and 
-               (not opts['status'] or i.status == opts['status']) and 
-               (not opts['category'] or i.category == opts['category']) and
-               (not opts['resolution'] or i.resolution == opts['resolution']) and 
-               (not opts['creator'] or i.creator == db.get_user(opts['creator'])) and
-               (not opts['grep'] or opts['grep'].lower() in i.title.lower())
-            )
+def migrate(ui, db, backend, *args, **opts):
+    '''Move the issues to another storage backend
     
-    count = 0
+    Copies every issue to the given backend, and sets the backend
+    setting of the [storage] section of the database's ab.conf to use
+    it from then on.  The backends are:
     
-    # for now, if the user wants to slow down output, they must pipe output through less/more
-    # we ought to be able to do this for them in certain cases
-    for i in iss_iter:
-        ui.quiet(db.iss_prefix.prefix(i.id),ln=False)
-        ui.write(":\t%s" % i.title,ln=False)
-        ui.quiet()
-        count += 1
+      json    a JSON file per issue in .ab/issues, the default, which
+              merges well in version control
+      sqlite  a single SQLite file, .ab/issues.sqlite, with indexed
+              columns, so list's filters and sorting are a query
     
-    ui.write("Found %s matching issue%s" % (count if count > 0 else "no","" if count == 1 else "s"))
+    The issues are then removed from the old backend, unless --keep
+    is set.  The new backend must not already hold any issues.
+    '''
+    from abundant import config,storage,transfer
+    from abundant import db as database
+    current = db.store.name
+    if backend not in storage.backends:
+        raise error.Abort("Unknown storage backend %s, choices: %s" %
+                          (backend,util.list2str(storage.backends)))
+    if backend == current:
+        raise error.Abort("Issues are already stored as %s" % backend)
     
-    return 0 if count > 0 else 1
+    target = database.DB(db.path,False,ui,db.open_store(backend))
+    target.store.create()
+    if target.store.ids():
+        raise error.Abort("The %s backend already holds issues" % backend)
+    
+    count = 0
+    with target.batch(fsync=False,size=transfer.batch_size) as batch:
+        for iss in db.iter_issues():
+            batch.put(iss)
+            count += 1
+            if count % 10000 == 0:
+                ui.verbose("%d issues copied" % count)
+    target.store.sync()
+    
+    config.write_value(db.conf,'storage','backend',backend)
+    # a setting in ab.local.conf would override ab.conf
+    local = config.config()
+    try:
+        local.read(db.local_conf)
+    except IOError:
+        pass
+    if local.get('storage','backend') is not None:
+        config.write_value(db.local_conf,'storage','backend',backend)
+    
+    if not opts['keep']:
+        db.store.destroy()
+    ui.write("Migrated %d issue%s to %s" % (count,'' if count == 1 else 's',backend))
+    return 0
 
 def open_iss(ui, db, prefix, status=None, *args, **opts):
     '''Opens a previously resolved issue
@@ -356,8 +614,9 @@ def open_iss(ui, db, prefix, status=None, *args, **opts):
     
     iss.status = status or ui.config('metadata','status.opened')
     iss.resolution = None
+    iss.resolved_date = None
     
-    iss.to_JSON(db.issues)
+    db.put_issue(iss)
     
     ui.write("Reopened issue %s, set status to %s" % (db.iss_prefix.pref_str(iss.id,True),iss.status))
     
@@ -367,7 +626,16 @@ def new(ui, db, *args, **opts):
     Creates a new open issue and, if set, marks the current user as the creator.
     Options can be used to set additional information about the issue.  See the
     update command to change/add/remove this information from an existing issue. 
+    
+    Existing issues with a similar title, which may be duplicates of the new
+    issue, are listed, up to [ui] suggest_duplicates, by default 5, or 0 to
+    turn the check off.  See the similar and duplicate commands.  The index
+    of titles this is checked against is built in the background the first
+    time, and until it's ready no duplicates are listed.  Issues added by
+    other commands, such as import, are added to it in the background
+    too, so they're suggested by the next new.
     '''
+    from abundant import issue
     if not opts['user']:
         opts['user'] = ui.config('ui','username')
     if not opts['assign_to']:
@@ -405,19 +673,29 @@ def new(ui, db, *args, **opts):
                       parent=db.get_issue_id(opts['parent']) if opts['parent'] else None,
                       creator=db.get_user(opts['user']) if opts['user'] else None
                       )
-    if opts['parent']:
-        parent = db.get_issue(opts['parent'])
-        parent.children.append(iss.id)
-        parent.to_JSON(db.issues)
+    # looked up before the new issue is in the index
+    suggest = ui.configint('ui','suggest_duplicates',5) if ui.volume > useri.quiet else 0
+    similar = db.similar_issues(iss,suggest,current=False) if suggest > 0 else []
     
-    db.iss_prefix.add(iss.id)
-    iss.to_JSON(db.issues)
+    with db.batch() as batch:
+        if opts['parent']:
+            parent = db.get_issue(opts['parent'])
+            parent.children.append(iss.id)
+            batch.put(parent)
+        batch.put(iss)
     
     if ui.volume == useri.quiet:
         ui.quiet(iss.id)
     ui.write("Created new issue with ID %s" % db.iss_prefix.pref_str(iss.id,True))
     skip=['id','creation_date'] + (['creator','assigned_to'] if db.single_user() and ui.volume < useri.verbose else [])
     ui.write(iss.descChanges(issue.base,ui,skip=skip))
+    if similar:
+        ui.write("Possible duplicates, see 'ab duplicate':")
+        for other, score in similar:
+            ui.write("  %s:\t%s%s" % (db.iss_prefix.prefix(other.id),other.title,
+                                      " (%s)" % other.resolution if other.resolution else ''),ln=False)
+            ui.verbose(" (%d%%)" % round(score*100),ln=False)
+            ui.write()
 
 def resolve(ui, db, prefix, resolution=None, *args, **opts):
     '''Marks an issue resolved
@@ -444,11 +722,159 @@ def resolve(ui, db, prefix, resolution=None, *args, **opts):
     
     iss.status = ui.config('metadata','status.resolved')
     iss.resolution = resolution or ui.config('metadata','resolution.default')
+    iss.resolved_date = time.time()
     
-    iss.to_JSON(db.issues)
+    db.put_issue(iss)
     
     ui.write("Resolved issue %s with resolution %s" % (db.iss_prefix.pref_str(iss.id,True),iss.resolution))
 
+def search(ui, db, *args, **opts):
+    '''Search the text of every issue
+    
+    Finds issues whose title, description, reproduction steps,
+    expected result, stack trace or comments contain every one of
+    the given terms.  Separate terms with OR to find issues matching
+    any of several groups of terms, for instance:
+    
+    ab search socket timeout OR connection refused
+    
+    Results are ranked by how often the terms occur in each issue.
+    Resolved issues are included, use -o,--open to exclude them.
+    '''
+    groups = [[]]
+    for arg in args:
+        if arg == 'OR':
+            groups.append([])
+        else:
+            groups[-1].append(arg)
+    
+    count = 0
+    ui.pager('search')
+    for iss, score in db.search_issues(*groups):
+        if opts['open'] and iss.resolution:
+            continue
+        if opts['limit'] is not None and count >= opts['limit']:
+            break
+        ui.quiet(db.iss_prefix.prefix(iss.id),ln=False)
+        ui.write(":\t%s" % iss.title,ln=False)
+        ui.verbose(" (%d)" % score,ln=False)
+        ui.quiet()
+        count += 1
+    
+    ui.write("Found %s matching issue%s" % (count if count > 0 else "no","" if count == 1 else "s"))
+    
+    return 0 if count > 0 else 1
+
+def serve(ui, *args, **opts):
+    '''Run a command server
+    
+    Listens on a Unix socket for commands, and runs them in this
+    process, so they don't have to pay to start up, load config,
+    and load the database each time.  Set the AB_CMDSERVER
+    environment variable to the socket's path, and ab will send
+    commands to the server rather than running them itself.
+    
+    The socket is created at -a,--address, or the cmdserver.address
+    config setting, or AB_CMDSERVER.  The server runs until
+    interrupted.
+    '''
+    from abundant import cmdserver
+    address = (opts['address'] or ui.config('cmdserver','address') or
+               os.environ.get('AB_CMDSERVER'))
+    cmdserver.serve(ui, os.path.abspath(util.expandpath(address)) if address else None)
+
+def similar(ui, db, prefix, *args, **opts):
+    '''List issues which may be duplicates of an issue
+    
+    Compares the words of the issue's title and the lines of its stack
+    trace, ignoring numbers, with every other issue's, and lists those
+    with at least the given similarity, by default 0.5, most similar
+    first.  Similarity is estimated from a MinHash index, so only issues
+    sharing enough with this one are compared, and issues whose
+    similarity is near the threshold can be missed.
+    
+    Resolved issues are included, use -o,--open to exclude them.
+    '''
+    threshold = opts['threshold']
+    if threshold is not None and not 0 < threshold <= 1:
+        raise error.Abort("The threshold must be more than 0 and at most 1")
+    iss = db.get_issue(prefix)
+    
+    count = 0
+    ui.pager('similar')
+    for other, score in db.similar_issues(iss,threshold=threshold):
+        if opts['open'] and other.resolution:
+            continue
+        if opts['limit'] is not None and count >= opts['limit']:
+            break
+        ui.quiet(db.iss_prefix.prefix(other.id),ln=False)
+        ui.write(":\t%s" % other.title,ln=False)
+        if other.resolution:
+            ui.write(" (%s)" % other.resolution,ln=False)
+        ui.verbose(" (%d%%)" % round(score*100),ln=False)
+        ui.quiet()
+        count += 1
+    
+    ui.write("Found %s similar issue%s" % (count if count > 0 else "no","" if count == 1 else "s"))
+    
+    return 0 if count > 0 else 1
+
+def stats(ui, db, *args, **opts):
+    '''Count issues, grouped by their metadata
+    
+    Counts the issues matching the filters, which are the same as list's,
+    grouped by the values of the fields given to --by, separated by
+    commas, for instance to count the bugs assigned to each user by
+    severity:
+    
+    ab stats --by assigned_to,severity -i Bug
+    
+    Each group shows how many issues it has, how many are open and how
+    many resolved, the percentage open, and the mean age in days of the
+    open issues, largest groups first.  Fields are assigned_to (or
+    assignee), creator, issue, target, severity, status, resolution and
+    category.  Without --by only the totals are shown.
+    
+    Unlike list, both open and resolved issues are counted, use -o,--open
+    or -r,--resolved to count only one or the other.
+    '''
+    from abundant import stats as aggregate
+    if opts['open'] and opts['resolved']:
+        raise error.Abort("Cannot count only open and only resolved issues at once")
+    by = [{'assignee':'assigned_to'}.get(f,f) for f in util.split_list(opts['by'])] if opts['by'] else []
+    filters = _filters(db,opts)
+    if opts['open'] or opts['resolved']:
+        filters['resolved'] = bool(opts['resolved'])
+    
+    groups = aggregate.group(db,by,filters)
+    if len(groups) > 1:
+        groups.append(aggregate.Group(('Total',)+('',)*(len(by)-1),sum(g.count for g in groups),
+                                      sum(g.resolved for g in groups),sum(g.age for g in groups)))
+    if not groups:
+        ui.write("Found no matching issues")
+        return 1
+    
+    from abundant import issue
+    day = 24*60*60
+    rows = [[issue.Issue._pretty[f] for f in by]+["Issues","Open","Resolved","% Open","Age (days)"]]
+    for g in groups:
+        age = g.mean_age()
+        rows.append(["(none)" if v is None else str(v) for v in g.values]+
+                    [str(g.count),str(g.open),str(g.resolved),"%d%%" % round(100*g.open/g.count),
+                     "%.1f" % (age/day) if age is not None else "-"])
+    ui.pager('stats')
+    _table(ui,rows,len(by))
+    return 0
+
+def _table(ui,rows,left):
+    '''Writes rows of strings, the first of which is the header, as a
+    table, with the first left columns left aligned, and the rest, which
+    should be numbers, right aligned'''
+    widths = [max(len(r[n]) for r in rows) for n in range(len(rows[0]))]
+    for r in rows:
+        ui.write("  ".join(v.ljust(w) if n < left else v.rjust(w)
+                           for n, (v,w) in enumerate(zip(r,widths))).rstrip())
+
 def tasks(ui, db, user='me', *args, **opts):
     '''List issues assigned to current user
     
@@ -458,6 +884,113 @@ def tasks(ui, db, user='me', *args, **opts):
     '''
     return list(ui, db, assigned_to=user, **opts)
 
+def tree(ui, db, prefix=None, *args, **opts):
+    '''Show the children and duplicates of issues as trees
+    
+    Shows the given issue, its children, their children and so on,
+    with the duplicates of each issue listed under it, marked with =.
+    Without a PREFIX, shows every tree: each issue with children or
+    duplicates which isn't a child or duplicate of another issue.
+    
+    Resolved issues are followed by their resolution, and issues with
+    children by how many of the issues below them are open and how
+    many are resolved, not counting duplicates.
+    
+    Use -o,--open to leave out resolved issues with nothing open below
+    them, and -d,--depth to show only that many levels below each
+    tree's root, though the issues below are still counted.
+    '''
+    if opts['depth'] is not None and opts['depth'] < 0:
+        raise error.Abort("The depth cannot be negative")
+    rel = db.relation_index
+    summaries = db.issue_cache
+    
+    def order(id):
+        summary = summaries.get(id) or {}
+        return (summary.get('creation_date') or 0,id)
+    def resolution(id):
+        summary = summaries.get(id)
+        return summary.get('resolution') if summary else None
+    
+    if prefix is not None:
+        roots = [db.get_issue_id(prefix)]
+    else:
+        roots = sorted(rel.roots(),key=order)
+    
+    ui.pager('tree')
+    trees = count = 0
+    for root in roots:
+        counts = _rollup(rel,root,lambda id: bool(resolution(id)))
+        if opts['open'] and prefix is None and resolution(root) and not counts[root][0]:
+            continue
+        trees += 1
+        # walked depth first, so push each issue's children and duplicates
+        # in reverse to pop them in order
+        stack = [(root,0,False)]
+        shown = set()
+        while stack:
+            id, depth, dup = stack.pop()
+            if id in shown:
+                continue # a link back up the tree
+            shown.add(id)
+            count += 1
+            summary = summaries.get(id)
+            line = '  '*depth + ('= ' if dup else '')
+            if summary is None:
+                line += "%s:\t(missing)" % id
+            else:
+                line += "%s:\t%s" % (db.iss_prefix.prefix(id),summary.get('title'))
+            if resolution(id):
+                line += "  (%s)" % resolution(id)
+            if rel.children(id):
+                line += "  [%d open, %d resolved]" % counts[id]
+            ui.write(line)
+            
+            if opts['depth'] is not None and depth >= opts['depth']:
+                continue
+            kids = sorted(rel.children(id),key=order)
+            dups = sorted(rel.duplicates(id),key=order)
+            if opts['open']:
+                kids = [i for i in kids if not resolution(i) or counts[i][0]]
+                dups = [i for i in dups if not resolution(i)]
+            stack.extend((i,depth+1,False) for i in reversed(kids))
+            stack.extend((i,depth+1,True) for i in reversed(dups))
+    
+    ui.write("Found %s issue%s in %d tree%s" % (count if count > 0 else "no","" if count == 1 else "s",
+                                              trees,"" if trees == 1 else "s"))
+    return 0 if count > 0 else 1
+
+def _rollup(rel,root,resolved):
+    '''Returns a dict of root and every issue below it, through children
+    and duplicates, to the number of open and resolved issues below it
+    through children alone, given rel, a cache.RelationIndex, and
+    resolved, a function of an issue's id.  Counted from the deepest
+    issues up, without recursing, since trees can be very deep.'''
+    counts = {}
+    stack = [(root,False)]
+    seen = set([root])
+    while stack:
+        id, done = stack.pop()
+        if done:
+            opened = closed = 0
+            for kid in rel.children(id):
+                if kid not in counts:
+                    continue # a link back up the tree
+                opened += counts[kid][0]
+                closed += counts[kid][1]
+                if resolved(kid):
+                    closed += 1
+                else:
+                    opened += 1
+            counts[id] = (opened,closed)
+            continue
+        stack.append((id,True))
+        for kid in itertools.chain(rel.children(id),rel.duplicates(id)):
+            if kid not in seen:
+                seen.add(kid)
+                stack.append((kid,False))
+    return counts
+
 def update(ui, db, prefix, *args, **opts):
     '''Updates the information associated with an issue'''
     
@@ -502,7 +1035,7 @@ def update(ui, db, prefix, *args, **opts):
     if opts['category']:
         iss.category = opts['category']
     
-    iss.to_JSON(db.issues)
+    db.put_issue(iss)
     
     ui.write("Updated issue %s" % db.iss_prefix.pref_str(iss.id,True))
     ui.write(iss.descChanges(origiss,ui))
@@ -527,12 +1060,53 @@ def version(ui, *args, **opts):
 #     a list of optparse Options
 #     the number of mandatory positional arguments
 #     a usage string
+# options filtering the issues list, tasks, export, stats and burndown
+# look at, which every one of them takes the same way
+assignedArg = util.parser_option('-a','--assigned_to',default='*',help="issues assigned to this user")
+openArg = util.parser_option('-o','--open',action='store_true',default=False,help="only open issues")
+resolvedArg = util.parser_option('-r','--resolved',action='store_true',default=False,
+                                 help="only resolved issues")
+filterArgs = [util.parser_option('-l','--listener',action='append',help="issues being followed by these users"),
+              util.parser_option('-i','--issue',help="the type of issue, such as Bug or Feature Request"),
+              util.parser_option('-t','--target',help="a target date or milestone for resolution"),
+              util.parser_option('-s','--severity',help="the severity of the issue"),
+              util.parser_option('-S','--status',help="the status of the issue"),
+              util.parser_option('-c','--category',help="the category of the issue"),
+              util.parser_option('-C','--creator',help="the user filing the bug"),
+              util.parser_option('-R','--resolution',help="the issues resolution"),
+              util.parser_option('-g','--grep',help="text to match in the title")]
+filterUsage = ("[-l LISTENER]... [-i ISSUE] [-t TARGET] [-s SEVERITY] [-S STATUS] [-c CATEGORY] "
+               "[-C USER] [-R RESOLUTION] [-g SEARCH]")
+dateArgs = [util.parser_option('--created-since',metavar='DATE',help="issues created on or after this date"),
+            util.parser_option('--created-before',metavar='DATE',help="issues created before this date"),
+            util.parser_option('--resolved-since',metavar='DATE',help="issues resolved on or after this date")]
+dateUsage = "[--created-since DATE] [--created-before DATE] [--resolved-since DATE]"
+sortArgs = [util.parser_option('--sort',metavar='FIELD',help="order the issues by this field"),
+            util.parser_option('--reverse',action='store_true',default=False,help="sort in descending order")]
+sortUsage = "[--sort FIELD] [--reverse]"
+
 table = {'adduser':
             (adduser,
              [util.parser_option('-e','--email')],
              1,
              "NAME [-e EMAIL]"),
          'assign': (assign,[],2,"PREFIX USER"),
+         'batch':
+            (batch,
+             [util.parser_option('-0','--null',action='store_true',default=False,
+                                 help="commands are separated by NUL characters")],
+             0,
+             "[-0]"),
+         'burndown':
+            (burndown,
+             [
+              util.parser_option('--bucket',default='week',help="the length of each period, day or week"),
+              util.parser_option('-n','--periods',type='int',help="show this many periods, by default 12"),
+              util.parser_option('--since',metavar='DATE',help="start from the period containing this date"),
+              assignedArg
+              ]+filterArgs,
+             0,
+             "[--bucket day|week] [-n PERIODS] [--since DATE] [-a USER] "+filterUsage),
          'child':
             (child,
              [],
@@ -558,8 +1132,31 @@ table = {'adduser':
              ],
              0,
              "[-p PATHS] [-d DESCRIPTION] [-r REPRODUCTION] [-e EXPECTED] [-t TRACE]"),
+         'export':
+            (export,
+             [
+              util.parser_option('--output',metavar='FILE',help="write the issues to FILE"),
+              assignedArg,
+              openArg,
+              resolvedArg
+              ]+filterArgs+dateArgs+sortArgs+[
+              util.parser_option('-n','--limit',type='int',help="export at most this many issues")
+              ],
+             0,
+             "[--output FILE] [-a USER] [-o|-r] "+filterUsage+" "+dateUsage+" "+sortUsage+" [-n LIMIT]"),
          'help':
             (help,[],0,"[topic]"),
+         'import':
+            (import_iss,
+             [
+              util.parser_option('-f','--format',help="jsonl or csv, by default guessed from FILE"),
+              util.parser_option('--add-users',action='store_true',default=False,
+                                 help="add unknown users to the users file"),
+              util.parser_option('--check',action='store_true',default=False,
+                                 help="validate the file without importing it")
+              ],
+             1,
+             "FILE [-f FORMAT] [--add-users] [--check]"),
          'init':
             (init,
              [],
@@ -567,22 +1164,17 @@ table = {'adduser':
              "[DIR]"),
          'list':
             (list,
-             [
-              util.parser_option('-a','--assigned_to',default='*',help="issues assigned to this user"),
-              util.parser_option('-r','--resolved',action='store_true',default=False,help="the issue is resolved"),
-              util.parser_option('-l','--listener',action='append',help="issues being followed by these users"),
-              util.parser_option('-i','--issue',help="the type of issue, such as Bug or Feature Request"),
-              util.parser_option('-t','--target',help="a target date or milestone for resolution"),
-              util.parser_option('-s','--severity',help="the severity of the issue"),
-              util.parser_option('-S','--status',help="the status of the issue"),
-              util.parser_option('-c','--category',help="the category of the issue"),
-              util.parser_option('-C','--creator',help="the user filing the bug"),
-              util.parser_option('-R','--resolution',help="the issues resolution"),
-              util.parser_option('-g','--grep',help="text to match in the title")
+             [assignedArg,resolvedArg]+filterArgs+dateArgs+sortArgs+[
+              util.parser_option('-n','--limit',type='int',help="show at most this many issues")
               ],
              0,
-             "[-a USER] [-r] [-l LISTENER]... [-i ISSUE] [-t TARGET] [-s SEVERITY] "
-             "[-S STATUS] [-c CATEGORY] [-C USER] [-g SEARCH]"),
+             "[-a USER] [-r] "+filterUsage+" "+dateUsage+" "+sortUsage+" [-n LIMIT]"),
+         'migrate':
+            (migrate,
+             [util.parser_option('--keep',action='store_true',default=False,
+                                 help="leave the issues in the old backend as well")],
+             1,
+             "BACKEND [--keep]"),
          'open':
             (open_iss,[],0,"PREFIX [STATUS]"),
          'new':
@@ -602,23 +1194,54 @@ table = {'adduser':
              "[-s SEVERITY] [-c CATEGORY] [-u USER]"),
           'resolve':
              (resolve,[],0,"PREFIX [RESOLUTION]"),
-          'tasks':
+          'search':
+             (search,
+              [
+               openArg,
+               util.parser_option('-n','--limit',type='int',help="show at most this many issues")
+               ],
+              1,
+              "TERM... [OR TERM...]... [-o] [-n LIMIT]"),
+          'serve':
+             (serve,
+              [util.parser_option('-a','--address',help="path of the Unix socket to listen on")],
+              0,
+              "[-a ADDRESS]"),
+          'similar':
+             (similar,
+              [
+               openArg,
+               util.parser_option('-n','--limit',type='int',help="show at most this many issues"),
+               util.parser_option('-t','--threshold',type='float',help="the least similarity to show, from 0 to 1")
+               ],
+              1,
+              "PREFIX [-o] [-n LIMIT] [-t THRESHOLD]"),
+         'stats':
+            (stats,
+             [
+              util.parser_option('--by',metavar='FIELD[,FIELD]...',help="fields to group the issues by"),
+              openArg,
+              resolvedArg,
+              assignedArg
+              ]+filterArgs+dateArgs,
+             0,
+             "[--by FIELD[,FIELD]...] [-o|-r] [-a USER] "+filterUsage+" "+dateUsage),
+         'tasks':
              (tasks,
+              [resolvedArg]+filterArgs+dateArgs+sortArgs+[
+               util.parser_option('-n','--limit',type='int',help="show at most this many issues")
+               ],
+              0,
+              "[assigned_to] [-r] "+filterUsage+" "+dateUsage+" "+sortUsage+" [-n LIMIT]"),
+          'tree':
+             (tree,
               [
-               util.parser_option('-r','--resolved',action='store_true',default=False,help="the issue is resolved"),
-               util.parser_option('-l','--listener',action='append',help="issues being followed by these users"),
-               util.parser_option('-i','--issue',help="the type of issue, such as Bug or Feature Request"),
-               util.parser_option('-t','--target',help="a target date or milestone for resolution"),
-               util.parser_option('-s','--severity',help="the severity of the issue"),
-               util.parser_option('-S','--status',help="the status of the issue"),
-               util.parser_option('-c','--category',help="the category of the issue"),
-               util.parser_option('-C','--creator',help="the user filing the bug"),
-               util.parser_option('-R','--resolution',help="the issues resolution"),
-               util.parser_option('-g','--grep',help="text to match in the title")
+               util.parser_option('-o','--open',action='store_true',default=False,
+                                  help="leave out resolved issues with nothing open below them"),
+               util.parser_option('-d','--depth',type='int',help="show at most this many levels")
                ],
               0,
-              "[assigned_to] [-r] [-l LISTENER]... [-i ISSUE] [-t TARGET] [-s SEVERITY] "
-             "[-c CATEGORY] [-C USER] [-g SEARCH]"),
+              "[PREFIX] [-o] [-d DEPTH]"),
           'update':
              (update,
               [
@@ -642,4 +1265,4 @@ table = {'adduser':
 fallback_cmd = 'help'
 
 # commands that do not need a db object
-no_db = ['init','help','version']
\ No newline at end of file
+no_db = ['batch','init','help','serve','version']
\ No newline at end of file
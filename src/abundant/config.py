@@ -27,41 +27,40 @@ Created on Feb 10, 2011
 '''
 
 from abundant import error,util
-import re, os
+import collections, re, os
 
-class sortdict(dict):
-    '''a simple sorted dictionary'''
-    def __init__(self, data=None):
-        self._list = []
-        if data:
-            self.update(data)
+_sectionre = re.compile(r'\[([^\[]+)\]')
+_itemre = re.compile(r'([^=\s][^=]*?)\s*=\s*(.*\S|)')
+_contre = re.compile(r'\s+(\S|\S.*\S)\s*$')
+_emptyre = re.compile(r'(;|#|\s*$)')
+_unsetre = re.compile(r'%unset\s+(\S+)')
+_includere = re.compile(r'%include\s+(\S|\S.*\S)\s*$')
+
+class sortdict(collections.OrderedDict):
+    '''a simple sorted dictionary, ordered by when each key was last set'''
     def copy(self):
         return sortdict(self)
     def __setitem__(self, key, val):
-        if key in self:
-            self._list.remove(key)
-        self._list.append(key)
-        dict.__setitem__(self, key, val)
-    def __iter__(self):
-        return self._list.__iter__()
+        collections.OrderedDict.__setitem__(self, key, val)
+        self.move_to_end(key)
     def update(self, src):
         for k in src:
             self[k] = src[k]
     def items(self):
-        return [(k, self[k]) for k in self._list]
-    def __delitem__(self, key):
-        dict.__delitem__(self, key)
-        self._list.remove(key)
+        return list(collections.OrderedDict.items(self))
 
 class config(object):
     '''Constructs a config object, a 2D dict of sections to keys to values'''
     def __init__(self, data=None):
         self._data = {}
         self._source = {}
+        # every file read, including those included by others
+        self.files = []
         if data:
             for k in data._data:
                 self._data[k] = data[k].copy()
             self._source = data._source.copy()
+            self.files = list(data.files)
     def copy(self):
         return config(self)
     def __contains__(self, section):
@@ -77,6 +76,7 @@ class config(object):
                 self._data[s] = sortdict()
             self._data[s].update(src._data[s])
         self._source.update(src._source)
+        self.files.extend(f for f in src.files if f not in self.files)
     def get(self, section, item, default=None):
         return self._data.get(section, {}).get(item, default)
     def source(self, section, item):
@@ -101,12 +101,12 @@ class config(object):
         include: if set, will be used to include sub-config files
         '''
         
-        sectionre = re.compile(r'\[([^\[]+)\]')
-        itemre = re.compile(r'([^=\s][^=]*?)\s*=\s*(.*\S|)')
-        contre = re.compile(r'\s+(\S|\S.*\S)\s*$')
-        emptyre = re.compile(r'(;|#|\s*$)')
-        unsetre = re.compile(r'%unset\s+(\S+)')
-        includere = re.compile(r'%include\s+(\S|\S.*\S)\s*$')
+        sectionre = _sectionre
+        itemre = _itemre
+        contre = _contre
+        emptyre = _emptyre
+        unsetre = _unsetre
+        includere = _includere
         section = ""
         item = None
         line = 0
@@ -167,7 +167,76 @@ class config(object):
             raise error.ConfigError(l.rstrip(), ("%s:%s" % (src, line)))
 
     def read(self, path, fp=None, sections=None, remap=None):
-        '''Reads a config file given a filename and a handle to the file
+        '''Reads a config file given a filename and a handle to the file,
+        which is opened if it's not passed
         
         See parse for other argument info'''
-        self.parse(path, fp.read(), sections, remap, self.read)
+        if fp is None:
+            with open(path) as fp:
+                data = fp.read()
+        else:
+            data = fp.read()
+        if path not in self.files:
+            self.files.append(path)
+        self.parse(path, data, sections, remap, self.read)
+    
+    def to_snapshot(self):
+        '''Returns the config's data as JSON-safe values, in order, which
+        from_snapshot() turns back into a config'''
+        return {'data':[[s,self._data[s].items()] for s in self._data],
+                'source':[[s,i,src] for (s,i), src in self._source.items()],
+                'files':self.files}
+    
+    @classmethod
+    def from_snapshot(cls, data):
+        ret = cls()
+        for s, items in data['data']:
+            ret._data[s] = sortdict(items)
+        ret._source = dict(((s,i),src) for s, i, src in data['source'])
+        ret.files = data['files']
+        return ret
+
+def write_value(path, section, item, value):
+    '''Sets item in section of the config file at path to value,
+    replacing its current value, if it has one in the file itself, and
+    otherwise adding it to the end of the section, or of the file.  The
+    rest of the file, including comments, is left as it was.'''
+    try:
+        with open(path) as fp:
+            lines = fp.read().splitlines(True)
+    except IOError:
+        lines = []
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+    entry = "%s = %s\n" % (item, value)
+    cur = None
+    # where to add the item if it isn't found: after the section's last item
+    insert = None
+    i = 0
+    while i < len(lines):
+        l = lines[i]
+        m = _sectionre.match(l)
+        if m:
+            cur = m.group(1)
+            if cur == section and insert is None:
+                insert = i + 1
+        elif cur == section and not _emptyre.match(l):
+            m = _itemre.match(l)
+            end = i + 1
+            while end < len(lines) and _contre.match(lines[end]):
+                end += 1
+            if m and m.group(1) == item:
+                lines[i:end] = [entry]
+                break
+            insert = end
+            i = end
+            continue
+        i += 1
+    else:
+        if insert is None:
+            if lines:
+                lines.append('\n')
+            lines.append("[%s]\n" % section)
+            insert = len(lines)
+        lines.insert(insert, entry)
+    util.atomic_write(path, ''.join(lines))
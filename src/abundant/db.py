@@ -14,19 +14,22 @@ working against.
 Created on Feb 13, 2011
 '''
 
-import os
-from abundant import cache,error,issue,prefix,util
+import functools,itertools,operator,os,time
+from abundant import cache,error,issue,prefix,storage,trace,util
 
 class DB(object):
     '''
     A representation of the current database
     '''
 
-    def __init__(self,path,recurse=True,ui=None):
+    def __init__(self,path,recurse=True,ui=None,store=None):
         '''
         Tries to find an Abundant database in the current or
         parent directory of path.  If it cannot, constructs what
         database should look like, use exists() to check for existence
+        
+        Issues are read and written through the backend set by the
+        config (see storage), unless a storage.Store is passed.
         '''
         path = os.path.abspath(path)
         self.search = path
@@ -38,42 +41,79 @@ class DB(object):
             self.path = path
         self.db = os.path.join(self.path,'.ab')
         self.issues = os.path.join(self.db,'issues')
+        self.sqlite = os.path.join(self.db,'issues.sqlite')
         self.cache = os.path.join(self.db,'.cache')
         self.conf = os.path.join(self.db,"ab.conf")
         self.local_conf = os.path.join(self.db,"ab.local.conf")
         self.users = os.path.join(self.db,"users")
+        if store is not None:
+            self.store = store
+        # the similar index as last written, see similar_issues()
+        self._stored_similar = None
         
     def exists(self):
         return os.path.exists(self.db)
     
+    def refresh(self,ui,external=True):
+        '''Prepares a DB object to be reused for another command, by a long
+        running process such as the command server, with the given ui.
+        
+        Loaded data which no longer reflects the files on disk is dropped,
+        to be reloaded when next needed, and loaded caches are refreshed.
+        If external is False the caller promises that issues have only
+        been written through this object, whose caches are kept up to date
+        by its batches, so the caches are not checked against every file.'''
+        self.ui = ui
+        # lazy properties are stored in __dict__ once they have been loaded
+        loaded = self.__dict__
+        if ('store' in loaded and self.store.name in storage.backends and
+            self.store.name != self._backend()):
+            self.store.close()
+            for name in ['store','iss_prefix','issue_cache','field_index','date_index',
+                         'column_index','relation_index','search_index','similar_index']:
+                loaded.pop(name,None)
+        self._stored_similar = None
+        if 'usr_prefix' in loaded and self._users_stat != util.filestat(self.users):
+            del self.usr_prefix
+        if 'iss_prefix' in loaded:
+            if (not isinstance(self.iss_prefix,prefix.FilePrefix) or
+                self.iss_prefix.stamp != self.store.stamp()):
+                del self.iss_prefix
+        for name in ['issue_cache','field_index','date_index','column_index','relation_index',
+                     'search_index','similar_index']:
+            if name in loaded:
+                loaded[name].ui = ui
+                if external:
+                    loaded[name].refresh()
+        self.meta_prefix.cache.clear()
+    
     # User Operations
     
-    #FIXME - O(n) add calls is O(n^2) behavior
     @cache.lazy_property
     def usr_prefix(self):
-        try:
-            usr_timer = util.Timer("User Prefix load")
-            ret = prefix.Prefix()
+        with trace.span("User Prefix load"):
+            users = []
+            aliases = []
+            self._users_stat = util.filestat(self.users)
             try:
-                count = 0
                 with open(self.users, 'r') as usr_file:
                     for line in usr_file:
                         line = line.strip()
                         if line == '' or line[0] == '#':
                             continue
-                        count += 1
-                        ret.add(line)
+                        users.append(line)
                         lt = line.find('<')
                         gt = line.find('>')
                         if lt >= 0 and gt >= 0 and gt > lt:
-                            ret.alias(line[lt+1:gt], line)
-                self._single_user = count <= 1
+                            aliases.append((line[lt+1:gt], line))
             except IOError:
                 pass # file doesn't exist, nbd
             except: raise
+            self._single_user = len(users) <= 1
+            ret = prefix.Prefix(users)
+            for alias, user in aliases:
+                ret.alias(alias, user)
             return ret
-        finally:
-            self.ui.debug(usr_timer)
     
     def get_user(self,prefix):
         try:
@@ -94,21 +134,168 @@ class DB(object):
     
     # Issue Operations
     
+    def _backend(self):
+        backend = self.ui.config('storage','backend','json') if self.ui is not None else 'json'
+        if backend not in storage.backends:
+            raise error.Abort("Unknown storage backend %s, choices: %s" %
+                              (backend,util.list2str(storage.backends)))
+        return backend
+    
+    def open_store(self,backend):
+        '''Returns a new storage.Store of this database's issues in the
+        given backend, one of storage.backends'''
+        if backend == 'sqlite':
+            return storage.SQLiteStore(self.sqlite,self.ui)
+        return storage.JSONStore(self.issues)
+    
+    @cache.lazy_property
+    def store(self):
+        '''The storage.Store the issues are kept in, as set by the config
+        setting storage.backend, by default json.'''
+        return self.open_store(self._backend())
+    
     @cache.lazy_property
     def iss_prefix(self):
+        '''A prefix of all issue IDs.
+        
+        This is stored as a memory-mapped prefix.FilePrefix in the
+        .cache directory, which is trusted as long as the store's stamp
+        (for issue files, the modification time of the issues directory,
+        which changes whenever issues are added or removed) matches its
+        stamp.  Otherwise it's rebuilt from the store's list of ids.
+        
+        Stores without a stamp, such as SQLite, which lists its ids
+        quickly, are only held in memory.'''
+        with trace.span("Issue Prefix load"):
+            return self._load_iss_prefix()
+    
+    def _load_iss_prefix(self,rebuild=False):
+        '''Loads the issue prefix, see iss_prefix, or if rebuild is set
+        rebuilds the prefix file even though its stamp matches'''
+        stamp = self.store.stamp()
+        if stamp is None:
+            return prefix.Prefix(self.store.ids(),True)
+        path = os.path.join(self.cache,'ids')
+        if not rebuild:
+            try:
+                ret = prefix.FilePrefix(path,self.store.stamp)
+                if ret.stamp == stamp:
+                    return ret
+                ret.close()
+            except (IOError,ValueError):
+                pass
+        
+        ids = self.store.ids()
         try:
-            iss_timer = util.Timer("Issue Prefix load")
-            return prefix.Prefix((i.replace(issue.ext,'') for i in os.listdir(self.issues)))
-        finally:
-            self.ui.debug(iss_timer)
+            os.makedirs(self.cache,exist_ok=True)
+            prefix.FilePrefix.write(path,ids,stamp)
+            return prefix.FilePrefix(path,self.store.stamp)
+        except (IOError,ValueError) as err:
+            self.ui.debug("Could not write issue prefix file: %s" % err)
+            return prefix.Prefix(ids,True)
+    
+    def _iss_prefix_stale(self):
+        '''Indicates the loaded prefix file may be missing issues: the
+        store has changed since it was loaded, or the file was written so
+        soon after the store last changed that an issue added in the same
+        instant wouldn't have changed the store's stamp'''
+        pfx = self.iss_prefix
+        try:
+            written = os.stat(pfx.path).st_mtime_ns
+        except OSError:
+            return True
+        return (self.store.stamp() != pfx.stamp or
+                written - pfx.stamp < cache.IssueCache._racy * 10**9)
+    
+    def batch(self,fsync=True,size=None):
+        '''Returns a Batch, used to write several issues together.
+        
+        Use it as a context manager - the issues put to it are written
+        when the block exits, unless an exception was raised:
+        
+          with db.batch() as batch:
+              batch.put(child,parent)
+        
+        To write more issues than should be held in memory at once,
+        pass a size, see Batch.
+        '''
+        return Batch(self,fsync,size)
+    
+    def put_issue(self,*issues):
+        '''Writes the given issues in a single batch'''
+        with self.batch() as batch:
+            batch.put(*issues)
+    
+    def _written(self,summaries,added,stamp):
+        '''Brings the caches up to date after a batch has written issues,
+        given as a dict of their ids to their summary data, including
+        the ids in added which did not already exist.  stamp is the
+        store's stamp before the batch was written, which is used to tell
+        if the prefix file was current before the batch replaced any files.'''
+        # lazy properties are stored in __dict__ once they have been loaded
+        if 'iss_prefix' in self.__dict__:
+            pfx = self.iss_prefix
+        elif stamp is None:
+            pfx = None
+        else:
+            try:
+                pfx = prefix.FilePrefix(os.path.join(self.cache,'ids'),self.store.stamp)
+            except (IOError,ValueError):
+                pfx = None
+        if isinstance(pfx,prefix.FilePrefix):
+            if pfx.stamp == stamp:
+                try:
+                    pfx.update(added)
+                except (IOError,ValueError) as err:
+                    self.ui.debug("Could not update issue prefix file: %s" % err)
+        elif pfx is not None:
+            pfx.update(added)
+        
+        if 'issue_cache' in self.__dict__:
+            self.issue_cache.update(summaries)
+        if 'field_index' in self.__dict__:
+            self.field_index.refresh()
+        if 'date_index' in self.__dict__:
+            self.date_index.refresh()
+        if 'column_index' in self.__dict__:
+            self.column_index.refresh()
+        if 'relation_index' in self.__dict__:
+            self.relation_index.refresh()
+        if 'search_index' in self.__dict__:
+            self.search_index.refresh()
+        if 'similar_index' in self.__dict__:
+            self.similar_index.refresh()
+        elif self._stored_similar is not None:
+            self._stored_similar.add(self.store.load(id) for id in summaries)
+    
             
                 
     def get_issue(self,pref):
-        return issue.JSON_to_Issue(os.path.join(self.issues,self.get_issue_id(pref)+issue.ext))
+        return self.store.load(self.get_issue_id(pref))
+    
+    def has_issue(self,id):
+        '''Indicates whether an issue with the given full id exists'''
+        return self.store.contains(id)
+    
+    def iter_issues(self):
+        '''Generates every issue in the database, fully loaded, in order
+        of id, reading them one at a time'''
+        return self.store.issues()
     
     def get_issue_id(self,pref):
         try:
-            return self.iss_prefix[pref]
+            try:
+                return self.iss_prefix[pref]
+            except error.UnknownPrefix:
+                # an on-disk prefix could miss an issue added since it was
+                # loaded, or in the same instant it was written, so rebuild
+                # it before giving up, but not for every unknown prefix
+                if (not isinstance(self.iss_prefix,prefix.FilePrefix) or
+                    not self._iss_prefix_stale()):
+                    raise
+                self.iss_prefix.close()
+                self.iss_prefix = self._load_iss_prefix(rebuild=True)
+                return self.iss_prefix[pref]
         except error.AmbiguousPrefix as err:
             def choices(issLs):
                 ls = (self.get_issue(i) for i in 
@@ -119,21 +306,290 @@ class DB(object):
         except error.UnknownPrefix as err:
             raise error.Abort("Issue prefix %s does not correspond to any issues" % err.prefix)
     
-    def get_issues(self,opened=None,cur_user=False,use_cache=True):
-        '''Returns a generator of all Issue objects in the database.
+    @cache.lazy_property
+    def issue_cache(self):
+        '''The cache.IssueCache of every issue's summary data, or the
+        store itself, if it's indexed'''
+        if self.store.indexed:
+            return self.store.refresh()
+        with trace.span("Issue cache load"):
+            return cache.IssueCache(self.store.path,os.path.join(self.cache,'issues'),self.ui).refresh()
+    
+    def _index_path(self,name):
+        '''Where the index name is kept in the .cache directory, or None if
+        the store isn't persistent, so its indexes are only kept in memory'''
+        return os.path.join(self.cache,name) if self.store.persistent else None
+    
+    @cache.lazy_property
+    def field_index(self):
+        with trace.span("Field index load"):
+            return cache.FieldIndex(self.issue_cache,self._index_path('fields'),self.ui).refresh()
+    
+    @cache.lazy_property
+    def date_index(self):
+        with trace.span("Date index load"):
+            return cache.DateIndex(self.issue_cache,self._index_path('dates'),self.ui).refresh()
+    
+    @cache.lazy_property
+    def column_index(self):
+        with trace.span("Column index load"):
+            return cache.ColumnIndex(self.issue_cache,self._index_path('columns'),self.ui).refresh()
+    
+    @cache.lazy_property
+    def relation_index(self):
+        with trace.span("Relation index load"):
+            return cache.RelationIndex(self.issue_cache,self._index_path('relations'),self.ui).refresh()
+    
+    @cache.lazy_property
+    def search_index(self):
+        with trace.span("Search index load"):
+            return cache.SearchIndex(self.issue_cache,self._index_path('search'),self.ui).refresh()
+    
+    @cache.lazy_property
+    def similar_index(self):
+        with trace.span("Similar index load"):
+            return cache.SimilarIndex(self.issue_cache,self._index_path('similar'),self.ui).refresh()
+    
+    def similar_issues(self,iss,limit=None,threshold=None,current=True):
+        '''Returns a list of the (Issue, similarity) pairs of the issues
+        which are likely duplicates of iss, most similar first.  See
+        cache.SimilarIndex.
+        
+        If current is False, and the index isn't already loaded, it's used
+        as it was last written, rather than loading the issue cache to
+        bring it up to date, which takes far longer than the lookup.
+        Issues this object writes are added to it as they're written, and
+        if other commands have added or removed issues since it was
+        written it's brought up to date in the background, for the next
+        lookup.  An index which has never been written isn't built, since
+        that reads every issue, but is started building in the background,
+        and no issues are returned.'''
+        index = None
+        if (not current and 'similar_index' not in self.__dict__ and
+            self.store.persistent):
+            if self._stored_similar is None:
+                stored = cache.SimilarIndex(None,self._index_path('similar'),self.ui)
+                if not stored.stored():
+                    self._build_in_background('similar_index')
+                    return []
+                if stored.stale(self.store):
+                    self._build_in_background('similar_index')
+                if not self.store.indexed:
+                    self._stored_similar = stored
+            index = self._stored_similar
+        if index is None:
+            index = self.similar_index
+        
+        ret = []
+        with trace.span("Similar issues lookup"):
+            for id, score in index.similar(iss,threshold):
+                if 'issue_cache' in self.__dict__:
+                    summary = self.issue_cache.get(id)
+                    if summary is None:
+                        continue
+                    found = issue.lazy_Issue(self.store,summary)
+                else:
+                    try:
+                        found = self.store.load(id)
+                    except error.NoSuchIssue:
+                        continue
+                ret.append((found,score))
+                if limit is not None and len(ret) >= limit:
+                    break
+        return ret
+    
+    def _build_in_background(self,name):
+        '''Starts a new process loading the lazy property name, an index
+        which writes itself to the .cache directory once it's built, unless
+        one was started in the last build_timeout seconds and is still
+        running.  The process's output is discarded.'''
+        import subprocess,sys
+        marker = os.path.join(self.cache,name+'.building')
+        try:
+            if time.time() - os.stat(marker).st_mtime < build_timeout:
+                return
+        except OSError:
+            pass
+        try:
+            os.makedirs(self.cache,exist_ok=True)
+            open(marker,'w').close()
+            env = dict(os.environ)
+            src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            env['PYTHONPATH'] = os.pathsep.join([src]+([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+            subprocess.Popen([sys.executable,'-c','import sys; from abundant import db; db._build(*sys.argv[1:])',
+                              self.path,name,marker],
+                             cwd=self.path,env=env,stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL,close_fds=True,start_new_session=True)
+            self.ui.debug("Building %s in the background" % name)
+        except OSError as err:
+            self.ui.debug("Could not start building %s: %s" % (name,err))
+    
+    def search_issues(self,*groups):
+        '''Returns a list of the (Issue, score) pairs of the issues which
+        contain all of the terms in any of the given groups of terms, best
+        matches first.  See cache.SearchIndex.'''
+        ret = []
+        for id, score in self.search_index.search(groups):
+            summary = self.issue_cache.get(id)
+            if summary is not None:
+                ret.append((issue.lazy_Issue(self.store,summary),score))
+        return ret
+    
+    def get_issues(self,opened=None,cur_user=False,use_cache=True,
+                   sort=None,reverse=False,limit=None,**filters):
+        '''Returns a generator of the Issue objects in the database
+        which match the given filters.
         
-        TODO:
-        Simple filters can be specified and this method will do its best
-        to optimize the returned generator.
+        Filters are passed as keyword arguments, and only filters which
+        are passed are applied, see matches() for their meaning.  Users
+        and metadata values must already be resolved to their full
+        values.  Additionally:
           opened    True: only opened issues; False only closed issues
           cur_user  True: only issues assigned to the current user
+          sort      one of sort_fields, to order the issues by
+          reverse   True: sort in descending order
+          limit     the most issues to return
+        
+        Issues without a value for the sort field come last, either way.
+        With a limit, only the best limit issues are kept while sorting,
+        in a heap.  Issues sorted by date are instead walked in order
+        from the date index (see cache.DateIndex), stopping once limit
+        matching issues are found.
+        
+        When possible (and use_cache is True) this generator will use
+        the issue cache and its secondary indexes (see cache.FieldIndex)
+        to find matching issues, rather than reading each file in turn.
+        Issues loaded from the cache only contain summary data (see
+        Issue.summary()), the rest is loaded from the issue's file
+        if it's accessed.
+        
+        Without the cache (use_cache is False, or the config setting
+        cache.enabled is false) large databases are read and filtered
+        in parallel by a pool of processes, see _parallel_issues().
+        
+        Issues in an indexed store, such as SQLite, are instead found by
+        its query() method, see _query().
+        '''
+        if opened is not None:
+            filters['resolved'] = not opened
+        if cur_user:
+            filters['assigned_to'] = self.get_user('me')
+        
+        key = self._sort_key(sort)
+        if self.store.indexed:
+            return self._query(filters,sort,reverse,limit)
+        if use_cache and self.ui.configbool('cache','enabled',True):
+            ids = self.field_index.lookup(filters)
+            dated = self._date_lookup(filters)
+            if dated is not None:
+                ids = dated if ids is None else ids & dated
+            # walking the date index only pays off if it isn't mostly
+            # issues the other filters have already ruled out
+            if (sort in cache.DateIndex.fields and limit is not None and
+                (ids is None or len(ids)*8 >= len(self.issue_cache))):
+                summaries = itertools.islice(self._by_date(sort,reverse,ids,filters),limit)
+            else:
+                if ids is None:
+                    summaries = iter(self.issue_cache)
+                else:
+                    summaries = (self.issue_cache.get(i) for i in sorted(ids))
+                summaries = _ordered((i for i in summaries if matches(i,filters)),
+                                     key,reverse,limit)
+            return (issue.lazy_Issue(self.store,i) for i in summaries)
+        summaries = _ordered(self._parallel_issues(filters),key,reverse,limit)
+        return (issue.lazy_Issue(self.store,i) for i in summaries)
+    
+    def _sort_key(self,field):
+        '''Returns a function of an issue's summary data to the value it
+        is sorted by, or None if there is none, or None if field is None.
+        Severities are ordered as they're listed in [metadata] severity.'''
+        if field is None:
+            return None
+        if field not in sort_fields:
+            raise error.Abort("Cannot sort by %s, choices: %s" % (field,util.list2str(sort_fields)))
+        return sort_key(field,self._severities())
+    
+    def _severities(self):
+        choices = self.ui.config('metadata','severity')
+        return util.split_list(choices) if choices else []
+    
+    def _query(self,filters,sort,reverse,limit):
+        '''Gets the issues matching filters from an indexed store, pushing
+        the filters, sort and limit down to its query.  Any filters the
+        store can't apply are checked here, and then the limit is too.'''
+        pushed = dict((k,v) for k, v in filters.items() if self.store.can_filter(k))
+        rest = dict((k,v) for k, v in filters.items() if k not in pushed)
+        summaries = self.store.query(pushed,sort,reverse,None if rest else limit,
+                                     self._severities() if sort == 'severity' else None)
+        if rest:
+            summaries = (i for i in summaries if matches(i,rest))
+            if limit is not None:
+                summaries = itertools.islice(summaries,limit)
+        return (issue.lazy_Issue(self.store,i) for i in summaries)
+    
+    def _date_lookup(self,filters):
+        '''Returns the set of ids within the date filters' ranges, found
+        with the date index, or None if no date filter was given'''
+        ret = None
+        for key, (field,since) in sorted(date_filters.items()):
+            if key not in filters:
+                continue
+            if since:
+                ids = set(self.date_index.range(field,since=filters[key]))
+            else:
+                ids = set(self.date_index.range(field,before=filters[key]))
+            ret = ids if ret is None else ret & ids
+        return ret
+    
+    def _by_date(self,field,reverse,ids,filters):
+        '''Generates the summaries of the issues matching the given
+        filters, and in ids unless it's None, in order of the given date
+        field, followed by the matching issues without that date, with
+        ties ordered by id, as _ordered() does.'''
+        for id in self.date_index.ordered(field,reverse):
+            if ids is not None and id not in ids:
+                continue
+            summary = self.issue_cache.get(id)
+            if summary is not None and matches(summary,filters):
+                yield summary
+        summaries = iter(self.issue_cache) if ids is None else (self.issue_cache.get(i) for i in ids)
+        undated = [s for s in summaries
+                   if s is not None and s.get(field) is None and matches(s,filters)]
+        undated.sort(key=operator.itemgetter('id'),reverse=reverse)
+        for summary in undated:
+            yield summary
+    
+    def _parallel_issues(self,filters):
+        '''Reads and filters every issue file, spreading the work across
+        a pool of processes, and generates the summary data of each
+        matching issue.  The workers only send back the summary, which is
+        all that's needed to sort the issues, so the rest of each issue's
+        data is loaded from its file if it's accessed.
         
-        When possible (and use_cache is True) this generator will
-        attempt to access cached data, rather than reading each file
-        in turn.
+        The number of processes and the number of files handed to each
+        at a time are set by parallel.workers (default: one per CPU) and
+        parallel.chunksize.  Databases of no more than one chunk are
+        simply read in this process.
         '''
-        return (issue.JSON_to_Issue(os.path.join(self.issues,i))
-                  for i in os.listdir(self.issues))
+        path = self.store.path
+        names = [i for i in os.listdir(path) if i.endswith(issue.ext)]
+        workers = self.ui.configint('parallel','workers',0) or os.cpu_count() or 1
+        chunksize = max(self.ui.configint('parallel','chunksize',1000),1)
+        
+        if workers < 2 or len(names) <= chunksize:
+            for summary in _load_matching(path,filters,names):
+                yield summary
+            return
+        
+        import concurrent.futures
+        chunks = [names[i:i+chunksize] for i in range(0,len(names),chunksize)]
+        pool = concurrent.futures.ProcessPoolExecutor(min(workers,len(chunks)))
+        try:
+            for res in pool.map(functools.partial(_load_matching,path,filters),chunks):
+                for summary in res:
+                    yield summary
+        finally:
+            pool.shutdown(cancel_futures=True)
     
     # Meta Operations
     
@@ -141,8 +597,7 @@ class DB(object):
     def meta_prefix(self,meta):
         '''constructs a prefix object of issue types if
         specified in the config file'''
-        try:
-            meta_timer = util.Timer("Meta prefix '%s' load" % meta)
+        with trace.span("Meta prefix '%s' load" % meta):
             choices = self.ui.config('metadata',meta)
             if choices is not None:
                 ret = prefix.Prefix(util.split_list(choices))
@@ -153,5 +608,175 @@ class DB(object):
                         ret.add(choice)
             else: ret = None
             return ret
-        finally:
-            self.ui.debug(meta_timer)
\ No newline at end of file
+
+class Batch(object):
+    '''A set of issues to be written to the database together.
+    
+    The issues are passed to the store's put() at once, so they're
+    written together as far as the store allows - see storage.JSONStore
+    for how issue files are replaced.  The database's caches are then
+    updated once for the whole batch.
+    
+    Putting the same issue more than once writes only its last state.
+    
+    If size is set, the issues put are written whenever that many are
+    waiting, so there is no limit to how many issues one batch can write,
+    as an import does, but only each chunk of issues is written together.
+    The caches are still only updated once, by commit().
+    '''
+    def __init__(self,db,fsync=True,size=None):
+        self.db = db
+        self.fsync = fsync
+        self.size = size
+        self._issues = {}
+        # what's been written but not yet passed to DB._written()
+        self._summaries = {}
+        self._added = []
+        self._stamp = None
+    
+    def put(self,*issues):
+        for iss in issues:
+            self._issues[iss.id] = iss
+        if self.size is not None and len(self._issues) >= self.size:
+            self._write()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,type,value,traceback):
+        if type is None:
+            self.commit()
+        return False
+    
+    def commit(self):
+        '''Writes every issue put to the batch, and updates the caches'''
+        self._write()
+        if not self._summaries:
+            return
+        summaries, added, stamp = self._summaries, self._added, self._stamp
+        self._summaries, self._added, self._stamp = {}, [], None
+        self.db._written(summaries,added,stamp)
+    
+    def _write(self):
+        '''Writes the issues waiting to be written'''
+        if not self._issues:
+            return
+        store = self.db.store
+        if not self._summaries:
+            self._stamp = store.stamp()
+        issues = [i for i in self._issues.values()]
+        self._issues = {}
+        self._added.extend(store.put(issues,self.fsync))
+        for iss in issues:
+            self._summaries[iss.id] = iss.summary()
+
+# fields get_issues() can sort by
+sort_fields = ['creation_date','resolved_date','severity','assigned_to','title']
+
+def _ordered(items,key,reverse=False,limit=None):
+    '''Returns an iterator of the items, summary data, sorted by key, a
+    function returning the value to sort an item by, or None to sort it
+    last.  Items which tie are ordered by their id, reversed along with
+    the values, as every store orders them.  Only limit items are returned,
+    if set, which are picked with a bounded heap rather than sorting
+    every item.  If key is None the items are returned in the order given.'''
+    if key is None:
+        return items if limit is None else itertools.islice(items,limit)
+    def sort_key(item):
+        k = key(item)
+        # sorting on missing first reverses along with the values, so
+        # flip it to keep them last
+        return ((k is None) != reverse,k,item['id'])
+    if limit is None:
+        return iter(sorted(items,key=sort_key,reverse=reverse))
+    import heapq
+    if reverse:
+        return iter(heapq.nlargest(limit,items,key=sort_key))
+    return iter(heapq.nsmallest(limit,items,key=sort_key))
+
+def sort_key(field,severities):
+    '''Returns a function of an issue's summary data to the value it is
+    sorted by for the given field, or None if it has none.  Severities
+    are ordered by their place in the list severities.'''
+    if field == 'severity':
+        order = dict((v,n) for n, v in enumerate(severities))
+        def key(summary):
+            v = summary.get(field)
+            return (order.get(v,len(order)),v) if v is not None else None
+        return key
+    return lambda summary: summary.get(field)
+
+# the date range filters, see matches(), with the date field each
+# compares, and whether it's the earliest date allowed, or the date
+# every issue must be before
+date_filters = {'created_since':('creation_date',True),
+                'created_before':('creation_date',False),
+                'resolved_since':('resolved_date',True)}
+
+def matches(iss,filters):
+    '''Indicates whether an issue, as a dict of its data, matches
+    the given filters.  Missing data is treated as None.
+    
+      resolved        True: only resolved issues; False: only open issues
+      assigned_to     the user the issue is assigned to, None if unassigned
+      listener        a collection of users, at least one must be a listener
+      grep            text to match, case insensitively, in the title
+      created_since   issues created at or after this time
+      created_before  issues created before this time
+      resolved_since  issues resolved at or after this time
+    
+    Times are seconds since the epoch, and issues without the date
+    don't match a date filter.  All other filters (issue, target,
+    severity, status, category, resolution, creator) must equal the
+    issue's value.
+    '''
+    for key, val in filters.items():
+        if key in date_filters:
+            field, since = date_filters[key]
+            date = iss.get(field)
+            if date is None or (date < val if since else date >= val):
+                return False
+        elif key == 'resolved':
+            if bool(iss.get('resolution')) != bool(val):
+                return False
+        elif key == 'listener':
+            if set(iss.get('listeners') or []).isdisjoint(val):
+                return False
+        elif key == 'grep':
+            if val.lower() not in (iss.get('title') or '').lower():
+                return False
+        elif iss.get(key) != val:
+            return False
+    return True
+
+def _load_matching(path,filters,names):
+    '''Reads the given issue files in path, returning a list of the
+    summary data of those which match the filters.
+    
+    Run in worker processes by DB._parallel_issues()'''
+    ret = []
+    for name in names:
+        summary = issue.JSON_to_Issue(os.path.join(path,name)).summary()
+        if matches(summary,filters):
+            ret.append(summary)
+    return ret
+
+# how many seconds a background build started by DB._build_in_background()
+# is trusted to still be running, before another may be started
+build_timeout = 600
+
+def _build(path,name,marker):
+    '''Loads the lazy property name of the database at path, building
+    and writing it, then removes marker.  Run in a new process by
+    DB._build_in_background().'''
+    from abundant import ui as usrint
+    try:
+        ui = usrint.UI()
+        database = DB(path,recurse=False,ui=ui)
+        ui.db_conf(database)
+        getattr(database,name)
+    finally:
+        try:
+            os.remove(marker)
+        except OSError:
+            pass
@@ -28,6 +28,10 @@ class SeriousAbort(Abort):
     '''Raised when the issue should have been previously prevented
     in the code.'''
 
+class OutputClosed(Exception):
+    '''Raised when whatever is reading output, such as a pager, goes
+    away before the command is done writing it.'''
+
 class ConfigError(Exception):
     '''Raised if parsing a config file fails'''
     def __init__(self,error,line,*args):
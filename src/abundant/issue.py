@@ -13,7 +13,7 @@ Created on Feb 2, 2011
 
 import json,os,time
 
-from abundant import error,util
+from abundant import error,trace,util
 
 class Issue:
     '''
@@ -24,6 +24,10 @@ class Issue:
     When working with an issue, it is important to remember that almost all data
     is optional, and defaults to None or the empty list.  In general, data without
     values should be hidden from the user as if it didn't exist at all.
+    
+    Issues are slotted to keep them small, and an issue constructed by
+    lazy_Issue() from partial data, such as cached summary data, only loads
+    the rest of its data from its file the first time that data is accessed.
     '''
     
     # display strings for issue components 
@@ -50,6 +54,16 @@ class Issue:
     _dates = set(['creation_date','resolved_date'])
     # issue data that is likely to be multi-line
     _long = set(['listeners','paths','description','reproduction','expected','trace','comments'])
+    # issue data which defaults to the empty list
+    _lists = set(['children','listeners','paths','comments'])
+    # issue data small enough to be cached, see cache.IssueCache
+    _summary = ['id','parent','children','duplicates',
+                'creator','assigned_to','listeners',
+                'issue','target','severity','status','resolution','category',
+                'creation_date','resolved_date','projection','estimate',
+                'title']
+    
+    __slots__ = _order + ['_source']
     
 
     def __init__(self,
@@ -103,6 +117,8 @@ class Issue:
         self.expected = expected
         self.trace = trace
         self.comments = comments if comments else []
+        # directory to load unset data from, see lazy_Issue()
+        self._source = None
         
         #new issue
         if self.id == None and self.creation_date == None:
@@ -111,6 +127,29 @@ class Issue:
                                 (self.title if self.title else '')+
                                 (self.creator if self.creator else ''))
     
+    def __getattr__(self,name):
+        '''Only called for data which has not been set, which is
+        loaded from the issue's file if it was lazily constructed'''
+        if name in self._pretty and self._source is not None:
+            self._load()
+            return object.__getattribute__(self,name)
+        raise AttributeError(name)
+    
+    def _load(self):
+        '''Loads any unset data from the issue's store.  Data which
+        has already been set, and possibly changed, is left alone.'''
+        full = self._source.load(self.id)
+        self._source = None
+        for key in self._order:
+            try:
+                object.__getattribute__(self,key)
+            except AttributeError:
+                setattr(self,key,getattr(full,key))
+    
+    def _data(self):
+        '''Returns a dict of all the issue's data'''
+        return dict((k,getattr(self,k)) for k in self._order)
+    
     def pretty(self,key):
         return self._pretty[key]
     
@@ -118,24 +157,43 @@ class Issue:
         ''' Returns the suggested filename for this issue '''
         return self.id+ext
     
+    def summary(self):
+        '''Returns a dict of the non-empty summary data of this issue,
+        which can be passed back to the constructor to construct a
+        (partial) copy of this issue.'''
+        ret = {}
+        for k in self._summary:
+            v = getattr(self,k)
+            if v != None and v != []:
+                ret[k] = v
+        return ret
+    
+    def to_JSON_str(self):
+        ''' Converts the issue to a JSON string, as it is stored on disk.
+        '''
+        dict = {}
+        for k, v in self._data().items():
+            if(v != None and v != []):
+                dict[k] = v
+        return json.dumps(dict,indent=1,sort_keys=True)
+    
     def to_JSON(self, path, file=None):
         ''' Converts the issue to a JSON datastructure and writes it
         to the specified path and file.
+        
+        The file is replaced atomically, so readers never see a partially
+        written issue.  To write several issues together, which is safer
+        and faster, use DB.batch().
         '''
         if file == None:
             file = self.filename()
-        dict = {}
-        for k, v in self.__dict__.items():
-            if(v != None and v != []):
-                dict[k] = v
-        with open(os.path.join(path,file),'w') as issue_file:
-            json.dump(dict,issue_file,indent=1,sort_keys=True)
+        util.atomic_write(os.path.join(path,file),self.to_JSON_str(),True)
         
     def details(self, ui=None, db=None, skip=[]):
         out = []
         for key in self._order:
             if key not in skip:
-                val = self.__dict__[key]
+                val = getattr(self,key)
                 if val is None or val == []:
                     continue
                 
@@ -159,7 +217,7 @@ class Issue:
         '''Returns the difference of two issues.
         See util.diff_dict for the expected structure
         of the returned data.'''
-        return util.diff_dict(self.__dict__,iss.__dict__)
+        return util.diff_dict(self._data(),iss._data())
     
     def descChanges(self, iss, ui=None, skip=['id']):
         '''Returns a structured string describing the changes
@@ -212,11 +270,24 @@ def comment_to_str(com,ui=None):
         return ret + " by %s" % com[0]
     return ret
     
+def lazy_Issue(store,data,known=Issue._summary):
+    '''Constructs an issue from partial data, such as cached summary
+    data.  The keys listed in known, which must include 'id', are taken
+    to be complete - any which are missing from data are empty.  The rest
+    of the issue's data is loaded from the given storage.Store the first
+    time it is accessed.'''
+    iss = Issue.__new__(Issue)
+    for key in known:
+        val = data.get(key)
+        setattr(iss,key,[] if val is None and key in Issue._lists else val)
+    iss._source = store
+    return iss
+    
 def JSON_to_Issue(file):
     ''' Constructs a new issue from JSON data in the
     specified file '''
     try:
-        with open(file) as issue_file:
+        with trace.span("Issue read",'io',False,file=file), open(file) as issue_file:
             return Issue(**json.load(issue_file))
     except IOError:
         raise error.NoSuchIssue("No issue could be found at: \n  %s" % file)
@@ -18,7 +18,7 @@ issue IDs, commands, usernames, and more.
 Created on Feb 14, 2011
 '''
 
-import bisect
+import bisect,mmap,os
 from abundant import error;
 
 #
@@ -30,6 +30,11 @@ from abundant import error;
 #
 # Revision 49331875cb8c contains the Trie structure.
 #
+# To keep insertions cheap without giving up the sorted list, items added
+# with add() or update() are buffered, and merged into the list in a single
+# sort the next time the structure is searched.  Since the existing list is
+# one sorted run, this merge is close to linear.
+#
 class Prefix:
     '''
     An prefix data structure built on a sorted list, which uses binary search.
@@ -40,8 +45,20 @@ class Prefix:
     '''
     def __init__(self, ls=[], presorted=False):
         self._aliases = {}
-        self._list = ls if presorted else sorted(ls)
+        # sorted by the lower case keys that are searched
+        self._list = ls if presorted else sorted(ls,key=str.lower)
         self._keys = [s.lower() for s in self._list]
+        self._lens = None
+        self._pending = {}
+    
+    def _merge(self):
+        '''Merges any buffered insertions into the sorted list'''
+        items = dict(zip(self._keys, self._list))
+        items.update(self._pending)
+        self._keys = sorted(items)
+        self._list = [items[k] for k in self._keys]
+        self._pending = {}
+        self._lens = None
     
     # Note that since we usually use these methods together, it's wasteful to
     # Compute prefix.lower() for both - as such, these methods assume prefix
@@ -68,6 +85,7 @@ class Prefix:
         If an item exactly matches the prefix, it will be returned even if
         there exist other (longer) items which match the prefix
         '''
+        if self._pending: self._merge()
         pre = prefix.lower()
         ret = self._list[self._getindex(pre):self._getnextindex(pre)]
         if ret:
@@ -78,56 +96,44 @@ class Prefix:
     
     def prefix(self, item):
         '''Return the unique prefix of the given item, or None if not found'''
-        ln = len(self._keys)
+        if self._pending: self._merge()
         item = item.lower()
         index = self._getindex(item)
-        if index >= ln:
+        if index >= len(self._keys):
             return None
         match = self._keys[index]
         if not match.startswith(item):
             return None
-        
-        siblings = []
-        if index > 0:
-            siblings.append(self._keys[index-1])
-        if index < ln-1:
-            siblings.append(self._keys[index+1])
-        
-        if not siblings: #list contains only item
-            return match[0]
-        
-        return self._uniqueprefix(match,siblings)
-        
-    def _uniqueprefix(self,match,others):
-        '''Returns the unique prefix of match, against the set of others'''
-        ret = []
-        #print("START:",match,others)
-        while match:
-            others = [s[1:] for s in others if s and s[0] == match[0]]
-            ret.append(match[0])
-            match = match[1:]
-            #print("WHILE:",match,others,''.join(ret))
-            if not others:
-                return ''.join(ret)
-        return None
+        return match[:self._prefixlen(index)]
+    
+    def _prefixlen(self, index):
+        '''Returns the length of the unique prefix of the key at index'''
+        if self._lens is None:
+            self._lens = _prefixlens(self._keys)
+        return self._lens[index]
     
     def add(self,item):
         '''Add an item to the data structure.
         
-        This uses list.insert() which is O(n) - for many insertions,
-        it may be dramatically faster to simply build a new Prefix entirely.'''
-        lower = item.lower()
-        index = self._getindex(lower)
-        # If overwriting same key
-        if index < len(self._keys) and self._keys[index] == lower:
-            self._list[index] = item
-        else:
-            self._keys.insert(index,lower)
-            self._list.insert(index,item)
+        Items are buffered until the next lookup, so adding many items
+        at once costs a single merge, see update().'''
+        self._pending[item.lower()] = item
+    
+    def update(self,items):
+        '''Add many items to the data structure at once.'''
+        for item in items:
+            self._pending[item.lower()] = item
     
     def alias(self,alias,item):
         '''Add an item to the trie which maps to another item'''
-        self._aliases[alias] = self[item]
+        # exact items can be aliased without merging buffered insertions
+        lower = item.lower()
+        target = self._pending.get(lower)
+        if target is None:
+            index = self._getindex(lower)
+            if index < len(self._keys) and self._keys[index] == lower:
+                target = self._list[index]
+        self._aliases[alias] = target if target == item else self[item]
         self.add(alias)
         
     def pref_str(self,pref,short=False):
@@ -138,8 +144,160 @@ class Prefix:
         return item[:len(pref)]+':'+(tail[:4]+('...' if len(tail) > 4 else '') if short else tail)
     
     def __iter__(self):
+        if self._pending: self._merge()
         return iter(self._list)
 
+def _lcp(a, b):
+    '''Returns the length of the common prefix of two strings'''
+    i = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        i += 1
+    return i
+
+def _prefixlens(keys):
+    '''Computes the length of the shortest unique prefix of every key in
+    a sorted list, in one pass.
+    
+    In a sorted list, the key sharing the longest prefix with any key is
+    one of its neighbors, so a key's unique prefix is one character longer
+    than the longer of its common prefixes with its two neighbors - or the
+    whole key, if it is itself the prefix of a neighbor.'''
+    import array # not needed by the small prefixes ab builds at startup
+    lens = array.array('L')
+    prev = 0
+    for i in range(len(keys)):
+        key = keys[i]
+        nxt = _lcp(key, keys[i+1]) if i+1 < len(keys) else 0
+        lens.append(min(max(prev, nxt)+1, len(key)))
+        prev = nxt
+    return lens
+
+class _MappedList(object):
+    '''A read-only sequence of the fixed-width records in a memory-mapped
+    FilePrefix file.  Supports just enough of the list interface for
+    Prefix to search it in place with bisect.'''
+    def __init__(self, mm, width):
+        self._mm = mm
+        self._width = width
+        self._rec = width+1
+        self._len = (len(mm) - FilePrefix._header) // self._rec
+    
+    def __len__(self):
+        return self._len
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("record index out of range")
+        off = FilePrefix._header + index*self._rec
+        return self._mm[off:off+self._width].decode('ascii')
+    
+    def __iter__(self):
+        for i in range(self._len):
+            yield self[i]
+
+class FilePrefix(Prefix):
+    '''A Prefix over a file of sorted, fixed-width, lower case ASCII
+    strings, such as issue IDs.
+    
+    The file is memory-mapped and binary searched in place, so a lookup
+    touches only O(log n) pages, and nothing is read up front.  The
+    header records a stamp, an integer identifying the state of the
+    data the file was built from; stamp is a function returning the
+    current stamp, and is used by add() to keep the file current.
+    Callers should compare the stamp of the file against the current
+    state of their data before trusting it.
+    
+    add() rewrites the file, and is therefore O(n).
+    '''
+    _header = 64
+    _magic = 'abundant-prefix'
+    version = 1
+    
+    def __init__(self, path, stamp=None):
+        self.path = path
+        self._stamp_func = stamp
+        self._aliases = {}
+        self._pending = {}
+        with open(path, 'rb') as f:
+            header = f.read(self._header).decode('ascii').split()
+            if len(header) != 4 or header[0] != self._magic or int(header[1]) != self.version:
+                raise ValueError("%s is not a prefix file" % path)
+            self.width = int(header[2])
+            self.stamp = int(header[3])
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._list = self._keys = _MappedList(self._mm, self.width)
+    
+    @classmethod
+    def _header_str(cls, width, stamp):
+        return ("%s %d %d %d" % (cls._magic, cls.version, width, stamp)).ljust(cls._header-1)+'\n'
+    
+    @classmethod
+    def write(cls, path, items, stamp):
+        '''Writes the given sorted items to a new prefix file at path.
+        
+        Raises ValueError if the items are not all the same width,
+        or are not lower case ASCII.'''
+        width = len(items[0]) if items else 0
+        out = [cls._header_str(width, stamp)]
+        for i in items:
+            if len(i) != width or i != i.lower():
+                raise ValueError("Cannot store %r in a prefix file of width %d" % (i, width))
+            out.append(i+'\n')
+        data = ''.join(out).encode('ascii')
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    
+    def close(self):
+        self._mm.close()
+    
+    def _prefixlen(self, index):
+        '''Computes the length of the unique prefix of the key at index from
+        its neighbors, rather than reading the whole file to build a table'''
+        keys = self._keys
+        key = keys[index]
+        prev = _lcp(keys[index-1], key) if index > 0 else 0
+        nxt = _lcp(key, keys[index+1]) if index+1 < len(keys) else 0
+        return min(max(prev, nxt)+1, len(key))
+    
+    def add(self, item):
+        '''Add an item to the prefix file, and update its stamp.'''
+        items = self._list[:]
+        index = bisect.bisect_left(items, item)
+        if index < len(items) and items[index] == item:
+            return
+        items.insert(index, item)
+        stamp = self._stamp_func() if self._stamp_func else self.stamp
+        self.close()
+        self.write(self.path, items, stamp)
+        self.__init__(self.path, self._stamp_func)
+    
+    def update(self, items):
+        '''Add many items to the prefix file, rewriting it once, and
+        update its stamp.  If there are no new items, only the stamp
+        is rewritten.'''
+        stamp = self._stamp_func() if self._stamp_func else self.stamp
+        new = set(items).difference(self._list[:] if items else [])
+        if not new:
+            with open(self.path, 'r+b') as f:
+                f.write(self._header_str(self.width, stamp).encode('ascii'))
+            self.stamp = stamp
+            return
+        items = sorted(new.union(self._list[:]))
+        self.close()
+        self.write(self.path, items, stamp)
+        self.__init__(self.path, self._stamp_func)
+    
+    def alias(self, alias, item):
+        raise NotImplementedError("FilePrefix does not support aliases")
+
 def _test():
     p = Prefix(reversed(['a','and','hello','pi','yellow','code','contribute','hell']))
     
@@ -0,0 +1,245 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Counts issues grouped by their metadata, for ab stats, and over time,
+for ab burndown.
+
+Issues are counted from a cache.ColumnIndex, a snapshot of every
+issue's metadata as dictionary encoded columns, rather than by loading
+them.  A filter compares a column's codes with the code of the value
+it wants, and issues are grouped by combining the codes of each field
+grouped by into one key.  If NumPy is installed each step is a single
+vectorized operation on whole columns, otherwise it's a pass over the
+arrays in Python, which is still far quicker than building an issue
+for each row.
+
+Burndowns count the issues created and resolved in each period by
+bisecting the sorted dates of cache.DateIndex at the period's edges.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import itertools,operator,time
+from abundant import cache,error,util
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the fields issues can be grouped and filtered by
+fields = cache.ColumnIndex.fields
+
+class Group(object):
+    '''The issues with one combination of values of the fields grouped
+    by: how many there are, how many are resolved, and the total age in
+    seconds of the open ones'''
+    def __init__(self,values,count,resolved,age):
+        self.values = values
+        self.count = count
+        self.resolved = resolved
+        self.age = age
+
+    @property
+    def open(self):
+        return self.count - self.resolved
+
+    def mean_age(self):
+        '''The mean age in seconds of the open issues, or None if there are none'''
+        return self.age / self.open if self.open else None
+
+def group(db,by,filters,now=None):
+    '''Returns a list of the Groups of the issues matching filters, one
+    per combination of the values of the fields in by which they have,
+    largest first.  With no fields, there is one group of every matching
+    issue, unless none match.
+
+    filters are as db.get_issues() takes.  Filters on the fields in
+    fields, and resolved, are applied to the columns directly, others,
+    such as listener and grep, by finding the issues which match them.'''
+    for f in by:
+        if f not in fields:
+            raise error.Abort("Cannot group by %s, choices: %s" % (f,util.list2str(fields)))
+    if now is None:
+        now = time.time()
+    columns = db.column_index
+    ids = None
+    others = dict((k,v) for k, v in filters.items() if k not in fields and k != 'resolved')
+    if others:
+        ids = set(i.id for i in db.get_issues(**others))
+
+    codes = {}
+    for f, value in filters.items():
+        if f in fields:
+            codes[f] = columns.code(f,value)
+            if codes[f] is None:
+                return [] # no issue has that value
+
+    counter = _count_numpy if numpy is not None else _count
+    counts = counter(columns,by,codes,filters.get('resolved'),ids,now)
+    ret = [Group(tuple(columns.values[f][c] for f, c in zip(by,key)),count,resolved,age)
+           for key, (count,resolved,age) in counts.items()]
+    ret.sort(key=lambda g: (-g.count,[(v is None,str(v)) for v in g.values]))
+    return ret
+
+def _count(columns,by,codes,resolved,ids,now):
+    '''Returns a dict of tuples of the codes of the fields in by to the
+    (count, resolved, age) of the issues with them, for the issues whose
+    fields have the given codes, and which are resolved or not, if
+    resolved isn't None, and are in ids, if it isn't None'''
+    res = columns.codes['resolution']
+    mask = None
+    selections = [[c == code for c in columns.codes[f]] for f, code in codes.items()]
+    if resolved is not None:
+        selections.append([c != 0 for c in res] if resolved else [c == 0 for c in res])
+    if ids is not None:
+        selections.append([i in ids for i in columns.ids])
+    for selection in selections:
+        mask = selection if mask is None else list(map(operator.and_,mask,selection))
+
+    keys = zip(*[columns.codes[f] for f in by]) if by else itertools.repeat(())
+    rows = zip(keys,res,columns.dates)
+    if mask is not None:
+        rows = itertools.compress(rows,mask)
+    counts = {}
+    for key, r, date in rows:
+        count = counts.get(key)
+        if count is None:
+            count = counts[key] = [0,0,0.0]
+        count[0] += 1
+        if r:
+            count[1] += 1
+        else:
+            count[2] += now - date
+    return counts
+
+def _count_numpy(columns,by,codes,resolved,ids,now):
+    '''As _count(), with NumPy'''
+    if not len(columns):
+        return {}
+    def column(f):
+        codes = columns.codes[f]
+        return numpy.frombuffer(codes,dtype='u%d' % codes.itemsize)
+    res = column('resolution')
+    mask = numpy.ones(len(columns),dtype=bool)
+    for f, code in codes.items():
+        mask &= column(f) == code
+    if resolved is not None:
+        mask &= (res != 0) if resolved else (res == 0)
+    if ids is not None:
+        mask &= numpy.fromiter((i in ids for i in columns.ids),dtype=bool,count=len(columns))
+
+    # combine the codes of each row into one key, in mixed radix
+    key = numpy.zeros(int(mask.sum()),dtype=numpy.int64)
+    for f in by:
+        key = key * len(columns.values[f]) + column(f)[mask]
+    keys, groups = numpy.unique(key,return_inverse=True)
+    opened = res[mask] == 0
+    ages = numpy.where(opened,now - numpy.frombuffer(columns.dates,dtype=numpy.float64)[mask],0.0)
+    count = numpy.bincount(groups,minlength=len(keys))
+    open_count = numpy.bincount(groups,weights=opened,minlength=len(keys))
+    age = numpy.bincount(groups,weights=ages,minlength=len(keys))
+
+    counts = {}
+    for n, k in enumerate(keys.tolist()):
+        key = []
+        for f in reversed(by):
+            k, c = divmod(k,len(columns.values[f]))
+            key.append(c)
+        counts[tuple(reversed(key))] = (int(count[n]),int(count[n]-open_count[n]),float(age[n]))
+    return counts
+
+class Period(object):
+    '''The issues opened and resolved from start until end, and the
+    backlog of issues still open at end, with the sums of their estimates'''
+    def __init__(self,start,end):
+        self.start = start
+        self.end = end
+        self.opened = self.resolved = self.backlog = 0
+        self.opened_estimate = self.resolved_estimate = self.backlog_estimate = 0.0
+
+# how many days each size of period lasts
+period_days = {'day':1,'week':7}
+
+def periods(size,count=None,since=None,now=None):
+    '''Returns the times of the edges of consecutive periods of the
+    given size, day or week, each starting at local midnight, and weeks
+    on Monday, up to the period containing now.  Starts at the period
+    containing since, if set, or otherwise count periods before the end.'''
+    days = period_days[size]
+    if now is None:
+        now = time.time()
+    def start(t):
+        lt = time.localtime(t)
+        return (lt.tm_year,lt.tm_mon,lt.tm_mday-(lt.tm_wday if size == 'week' else 0))
+    def edge(day,n):
+        # mktime normalizes days out of the month's range, and works out DST
+        return time.mktime((day[0],day[1],day[2]+n*days,0,0,0,0,0,-1))
+    if since is not None:
+        first = start(min(since,now))
+        n = 1
+        while edge(first,n) <= now:
+            n += 1
+        return [edge(first,i) for i in range(n+1)]
+    last = start(now)
+    return [edge(last,i) for i in range(1-count,2)]
+
+def burndown(db,edges,filters=None):
+    '''Returns a Period for each pair of consecutive times in edges,
+    counting the issues matching filters, as db.get_issues() takes,
+    opened and resolved in each, and the backlog open at its end.
+    
+    Issues opened and resolved before each edge are found by bisecting
+    the date index, so only the issues dated before the last edge are
+    looked at.  Resolved issues without a resolved date can't be placed
+    in time, so are left out.'''
+    index = db.date_index
+    summaries = db.issue_cache
+    keep = set(i.id for i in db.get_issues(**filters)) if filters else None
+    ret = [Period(a,b) for a, b in zip(edges,edges[1:])]
+    
+    def tally(field,resolved):
+        '''Returns the number and estimate of the issues dated before the
+        first edge, and sets the counts of each period'''
+        ids = index.range(field,before=edges[-1])
+        positions = [index.position(field,e) for e in edges]
+        totals = [0,0.0]
+        def add(id,counts):
+            summary = summaries.get(id)
+            if summary is None or (keep is not None and id not in keep):
+                return
+            if resolved and not summary.get('resolution'):
+                return # reopened
+            if not resolved and summary.get('resolution') and summary.get('resolved_date') is None:
+                return
+            counts[0] += 1
+            counts[1] += summary.get('estimate') or 0
+        for id in ids[:positions[0]]:
+            add(id,totals)
+        for period, start, end in zip(ret,positions,positions[1:]):
+            counts = [0,0.0]
+            for id in ids[start:end]:
+                add(id,counts)
+            if resolved:
+                period.resolved, period.resolved_estimate = counts
+            else:
+                period.opened, period.opened_estimate = counts
+        return totals
+    
+    opened, opened_estimate = tally('creation_date',False)
+    resolved, resolved_estimate = tally('resolved_date',True)
+    for period in ret:
+        opened += period.opened
+        opened_estimate += period.opened_estimate
+        resolved += period.resolved
+        resolved_estimate += period.resolved_estimate
+        period.backlog = opened - resolved
+        period.backlog_estimate = opened_estimate - resolved_estimate
+    return ret
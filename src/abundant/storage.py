@@ -0,0 +1,498 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Where a database's issues are kept.
+
+By default each issue is a JSON file in the .ab/issues directory, which
+merges well in version control.  Setting
+
+  [storage]
+  backend = sqlite
+
+in ab.conf instead keeps every issue in a single SQLite file,
+.ab/issues.sqlite, with an indexed column for each piece of metadata
+and each date, so that the filtering, sorting and limiting of list is
+answered by a query rather than by reading a cache of every issue.
+Use ab migrate to move a database's issues from one to the other.
+
+Each backend is a Store, which is all the database reads and writes
+issues through.  A MemoryStore, which keeps issues in memory, can be
+passed to a DB in place of its configured store, so tests and
+benchmarks can run commands without touching the filesystem.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import json,os,time
+from abundant import error,issue,trace,util
+
+# the backends which can be configured by [storage] backend
+backends = ['json','sqlite']
+
+class Store(object):
+    '''Base class of the places a database's issues can be kept.
+
+    A store holds issues by their full id, and implements:
+
+      load(id)          the Issue with the given id, raising
+                        error.NoSuchIssue if there isn't one
+      contains(id)      whether there is an issue with the given id
+      ids()             a sorted list of the ids of every issue
+      issues()          generates every Issue, in order of id
+      put(issues,fsync) writes a list of issues, replacing any with the
+                        same ids, and returns a list of the ids which
+                        didn't already exist
+      delete(ids)       removes the issues with the given ids
+      query(...)        finds issues by their summary data, see query()
+
+    Stores which set indexed answer query() themselves, and stand in
+    for the database's cache.IssueCache, so they also implement its
+    interface: epoch, generation, refresh(), update(), changes(),
+    get(), items(), len() and iterating over every issue's summary
+    data.  Otherwise the database keeps an IssueCache and indexes of
+    the store in its .cache directory, see DB.get_issues(), and uses
+    those rather than query().
+    '''
+    # the backend's name, see backends
+    name = None
+    indexed = False
+    # whether the store outlives the process, so the database's indexes
+    # of it are worth writing to its .cache directory
+    persistent = True
+
+    def create(self):
+        '''Sets up a new, empty store'''
+        pass
+
+    def stamp(self):
+        '''Returns a value which changes whenever issues are added or
+        removed, which the database's on-disk prefix of issue ids (see
+        prefix.FilePrefix) is checked against, or None if the prefix
+        should only be kept in memory.'''
+        return None
+
+    def sync(self):
+        '''Flushes issues put without fsync to disk'''
+        pass
+
+    def close(self):
+        pass
+
+    def destroy(self):
+        '''Removes every issue, and anything else the store keeps'''
+        self.delete(self.ids())
+        self.close()
+
+    def refresh(self):
+        '''Picks up changes made by other processes.  Returns self.'''
+        return self
+
+    def update(self,summaries):
+        '''Does nothing, put() records the issues it writes'''
+        pass
+
+    def can_filter(self,key):
+        '''Indicates whether query() can apply the filter key'''
+        return True
+
+    def query(self,filters,sort=None,reverse=False,limit=None,order=None):
+        '''Returns an iterator of the summary data of the issues matching
+        the given filters (see db.matches()), which can_filter() must
+        allow, ordered by the field sort, if set, with the issues missing
+        it last, and limited to the first limit issues, if set.  order is
+        the list of severities, in order, to sort severity by.
+
+        By default the summary data of every issue is checked in turn.'''
+        from abundant import db
+        key = db.sort_key(sort,order or []) if sort is not None else None
+        return db._ordered((i for i in self if db.matches(i,filters)),key,reverse,limit)
+
+class JSONStore(Store):
+    '''Issues stored as JSON files in a directory, one per issue, named
+    for its id.  This is the default, since it merges well in version
+    control.
+
+    Issues put together are each written to a temporary file, and once
+    every file has been written (and flushed to disk, if fsync is set)
+    they are renamed over the original files, so a crash or a concurrent
+    reader never sees a partially written issue, and sees related
+    changes, such as the two ends of a parent/child link, all at once or
+    very nearly so.
+    '''
+    name = 'json'
+
+    def __init__(self,path):
+        self.path = path
+
+    def _file(self,id):
+        return os.path.join(self.path,id+issue.ext)
+
+    def create(self):
+        os.makedirs(self.path,exist_ok=True)
+
+    def stamp(self):
+        # the directory's mtime changes whenever a file is added or removed
+        return os.stat(self.path).st_mtime_ns
+
+    def sync(self):
+        util.fsync_dir(self.path)
+
+    def load(self,id):
+        return issue.JSON_to_Issue(self._file(id))
+
+    def contains(self,id):
+        return os.path.exists(self._file(id))
+
+    def ids(self):
+        return sorted(i[:-len(issue.ext)] for i in os.listdir(self.path) if i.endswith(issue.ext))
+
+    def issues(self):
+        for id in self.ids():
+            yield self.load(id)
+
+    def put(self,issues,fsync=True):
+        tmps = []
+        try:
+            for iss in issues:
+                path = self._file(iss.id)
+                tmps.append((util.write_tmp(path,iss.to_JSON_str(),fsync),path))
+            added = [i.id for i in issues if not self.contains(i.id)]
+            while tmps:
+                tmp, path = tmps[0]
+                os.replace(tmp,path)
+                tmps.pop(0)
+        finally:
+            for tmp, _ in tmps:
+                try: os.unlink(tmp)
+                except OSError: pass
+        if fsync:
+            self.sync()
+        return added
+
+    def delete(self,ids):
+        for id in ids:
+            try:
+                os.unlink(self._file(id))
+            except FileNotFoundError:
+                pass
+
+class SQLiteStore(Store):
+    '''Issues stored in a SQLite database.
+
+    Each issue is a row of the issues table, holding the issue's full
+    data and its summary data (see Issue.summary()) as JSON, along with
+    a column for each of the fields in columns, which are indexed.  The
+    listeners of each issue are rows of the listeners table.
+
+    The store also stands in for the cache.IssueCache of a database
+    stored as files, so the indexes derived from it (see
+    cache.DerivedIndex) work unchanged.  Every write is stamped with a
+    new generation, and removed issues are recorded in the removed
+    table, so changes() is a query as well.
+    '''
+    name = 'sqlite'
+    indexed = True
+    version = 1
+    # summary data stored in indexed columns, which can be queried
+    columns = ['creator','assigned_to','issue','target','severity','status',
+               'resolution','category','creation_date','resolved_date','title']
+    # the filters query() can apply, see db.matches()
+    filters = set(['resolved','listener','grep','created_since','created_before',
+                   'resolved_since']+columns)
+
+    def __init__(self,path,ui=None):
+        self.path = path
+        self.ui = ui
+        self._conn = None
+        self.epoch = None
+        self.generation = 0
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._connect()
+        return self._conn
+
+    def _connect(self):
+        import sqlite3
+        with trace.span("SQLite open",path=self.path):
+            conn = sqlite3.connect(self.path)
+            conn.create_function('contains',2,_contains,deterministic=True)
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value)")
+                version = conn.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+                if version is None:
+                    self._create(conn)
+                elif version[0] != self.version:
+                    conn.close()
+                    raise error.Abort("%s is version %s of the SQLite store, expected %s" %
+                                      (self.path,version[0],self.version))
+            self._conn = conn
+            self._load_info()
+
+    def _create(self,conn):
+        conn.execute("CREATE TABLE issues (id TEXT PRIMARY KEY, gen INTEGER NOT NULL, %s, "
+                     "summary TEXT NOT NULL, data TEXT NOT NULL)" % ', '.join(self.columns))
+        for col in self.columns+['gen']:
+            conn.execute("CREATE INDEX issues_%s ON issues (%s)" % (col,col))
+        conn.execute("CREATE TABLE listeners (id TEXT NOT NULL, user TEXT NOT NULL)")
+        conn.execute("CREATE INDEX listeners_id ON listeners (id)")
+        conn.execute("CREATE INDEX listeners_user ON listeners (user)")
+        conn.execute("CREATE TABLE removed (id TEXT PRIMARY KEY, gen INTEGER NOT NULL)")
+        conn.executemany("INSERT INTO info VALUES (?,?)",
+                         [('version',self.version),
+                          ('epoch',util.hash("%r%d" % (time.time(),os.getpid()))),
+                          ('generation',0)])
+
+    def _load_info(self):
+        info = dict(self.conn.execute("SELECT key, value FROM info"))
+        self.epoch = info['epoch']
+        self.generation = info['generation']
+
+    def create(self):
+        self.conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def destroy(self):
+        self.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def refresh(self):
+        if self._conn is not None:
+            self._load_info()
+        else:
+            self._connect()
+        return self
+
+    def can_filter(self,key):
+        return key in self.filters
+
+    def ids(self):
+        '''Returns a sorted list of every issue id'''
+        return [r[0] for r in self.conn.execute("SELECT id FROM issues ORDER BY id")]
+
+    def contains(self,id):
+        return self.conn.execute("SELECT 1 FROM issues WHERE id = ?",(id,)).fetchone() is not None
+
+    def load(self,id):
+        with trace.span("Issue read",'io',False,id=id):
+            row = self.conn.execute("SELECT data FROM issues WHERE id = ?",(id,)).fetchone()
+        if row is None:
+            raise error.NoSuchIssue("No issue could be found with id: \n  %s" % id)
+        return issue.Issue(**json.loads(row[0]))
+
+    def issues(self):
+        for row in self.conn.execute("SELECT data FROM issues ORDER BY id"):
+            yield issue.Issue(**json.loads(row[0]))
+
+    def put(self,issues,fsync=True):
+        '''Writes the given issues in one transaction.  SQLite always
+        syncs the transaction to disk, so fsync is ignored.'''
+        added = []
+        with trace.span("SQLite write",issues=len(issues)), self.conn as conn:
+            gen = self._next_generation(conn)
+            for iss in issues:
+                summary = iss.summary()
+                if not self.contains(iss.id):
+                    added.append(iss.id)
+                conn.execute("INSERT OR REPLACE INTO issues VALUES (?,?,%s,?,?)" %
+                             ','.join('?'*len(self.columns)),
+                             [iss.id,gen]+[summary.get(c) for c in self.columns]+
+                             [json.dumps(summary,sort_keys=True),iss.to_JSON_str()])
+                conn.execute("DELETE FROM listeners WHERE id = ?",(iss.id,))
+                conn.executemany("INSERT INTO listeners VALUES (?,?)",
+                                 [(iss.id,u) for u in summary.get('listeners',[])])
+                conn.execute("DELETE FROM removed WHERE id = ?",(iss.id,))
+        self.generation = gen
+        return added
+
+    def delete(self,ids):
+        with self.conn as conn:
+            gen = self._next_generation(conn)
+            for id in ids:
+                conn.execute("DELETE FROM issues WHERE id = ?",(id,))
+                conn.execute("DELETE FROM listeners WHERE id = ?",(id,))
+                conn.execute("INSERT OR REPLACE INTO removed VALUES (?,?)",(id,gen))
+        self.generation = gen
+
+    def _next_generation(self,conn):
+        '''Starts a write by incrementing the stored generation, which
+        locks the database, so the write is stamped after every write
+        made so far by any process, and returns it'''
+        conn.execute("UPDATE info SET value = value + 1 WHERE key = 'generation'")
+        return conn.execute("SELECT value FROM info WHERE key = 'generation'").fetchone()[0]
+
+    def query(self,filters,sort=None,reverse=False,limit=None,order=None):
+        '''The filters, sort and limit are pushed down to a single SQL
+        query, see Store.query()'''
+        from abundant import db
+        where, params = [], []
+        for key, val in sorted(filters.items()):
+            if key in db.date_filters:
+                field, since = db.date_filters[key]
+                where.append("%s %s ?" % (field,'>=' if since else '<'))
+                params.append(val)
+            elif key == 'resolved':
+                where.append("coalesce(resolution,'') %s ''" % ('!=' if val else '='))
+            elif key == 'listener':
+                val = sorted(val)
+                where.append("id IN (SELECT id FROM listeners WHERE user IN (%s))" %
+                             ','.join('?'*len(val)))
+                params.extend(val)
+            elif key == 'grep':
+                where.append("contains(title,?)")
+                params.append(val.lower())
+            elif key not in self.columns:
+                raise ValueError("Cannot query by %s" % key)
+            elif val is None:
+                where.append("%s IS NULL" % key)
+            else:
+                where.append("%s = ?" % key)
+                params.append(val)
+
+        sql = "SELECT summary FROM issues"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if sort is not None:
+            if sort not in self.columns:
+                raise ValueError("Cannot sort by %s" % sort)
+            desc = " DESC" if reverse else ""
+            value = sort
+            if sort == 'severity' and order:
+                value = "CASE severity %s ELSE %d END%s, severity" % (
+                    ' '.join("WHEN ? THEN %d" % n for n in range(len(order))),len(order),desc)
+                params.extend(order)
+            sql += " ORDER BY %s IS NULL, %s%s, id%s" % (sort,value,desc,desc)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with trace.span("SQLite query",sql=sql):
+            cursor = self.conn.execute(sql,params)
+        return (json.loads(row[0]) for row in cursor)
+
+    # the cache.IssueCache interface
+
+    def changes(self,since):
+        '''Returns a dict of ids to summary data of the issues which have
+        changed after the given generation, and a set of the ids of issues
+        which have been removed after it.'''
+        changed = dict((id,json.loads(s)) for id, s in
+                       self.conn.execute("SELECT id, summary FROM issues WHERE gen > ?",(since,)))
+        removed = set(r[0] for r in self.conn.execute("SELECT id FROM removed WHERE gen > ?",(since,)))
+        return changed, removed
+
+    def __iter__(self):
+        '''Iterates over the summary data of each issue'''
+        return (json.loads(r[0]) for r in self.conn.execute("SELECT summary FROM issues"))
+
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM issues").fetchone()[0]
+
+    def items(self):
+        '''Returns an iterator of (id, summary data) pairs of every issue'''
+        return ((id,json.loads(s)) for id, s in self.conn.execute("SELECT id, summary FROM issues"))
+
+    def get(self,id):
+        '''Returns the summary data of the issue with the given full id,
+        or None if there is no such issue'''
+        row = self.conn.execute("SELECT summary FROM issues WHERE id = ?",(id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+class MemoryStore(Store):
+    '''Issues kept in memory, which are lost when the process exits, for
+    tests and benchmarks to pass to a DB in place of its files, so they
+    measure or check the commands, rather than the filesystem:
+    
+      db = DB(path,ui=ui,store=MemoryStore(issues))
+    
+    Issues are copied as they're put, so changing an Issue after putting
+    it doesn't change the stored issue.
+    '''
+    name = 'memory'
+    indexed = True
+    persistent = False
+
+    def __init__(self,issues=()):
+        # ids to the JSON of each issue, and to [generation, summary data]
+        self._issues = {}
+        self._entries = {}
+        self._removed = {}
+        self.epoch = util.hash("%r%d%d" % (time.time(),os.getpid(),id(self)))
+        self.generation = 0
+        issues = [i for i in issues]
+        if issues:
+            self.put(issues)
+
+    def load(self,id):
+        try:
+            return issue.Issue(**json.loads(self._issues[id]))
+        except KeyError:
+            raise error.NoSuchIssue("No issue could be found with id: \n  %s" % id)
+
+    def contains(self,id):
+        return id in self._issues
+
+    def ids(self):
+        return sorted(self._issues)
+
+    def issues(self):
+        for id in self.ids():
+            yield self.load(id)
+
+    def put(self,issues,fsync=True):
+        gen = self.generation + 1
+        added = [i.id for i in issues if i.id not in self._issues]
+        for iss in issues:
+            self._issues[iss.id] = iss.to_JSON_str()
+            self._entries[iss.id] = [gen,json.loads(json.dumps(iss.summary()))]
+            self._removed.pop(iss.id,None)
+        self.generation = gen
+        return added
+
+    def delete(self,ids):
+        gen = self.generation + 1
+        for id in ids:
+            if self._issues.pop(id,None) is not None:
+                del self._entries[id]
+                self._removed[id] = gen
+        self.generation = gen
+
+    # the cache.IssueCache interface
+
+    def changes(self,since):
+        changed = dict((id,e[1]) for id, e in self._entries.items() if e[0] > since)
+        removed = set(id for id, g in self._removed.items() if g > since)
+        return changed, removed
+
+    def __iter__(self):
+        return (e[1] for e in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        return ((id,e[1]) for id, e in self._entries.items())
+
+    def get(self,id):
+        entry = self._entries.get(id)
+        return entry[1] if entry is not None else None
+
+def _contains(title,text):
+    '''SQL function: whether title contains text, which is lower case,
+    case insensitively, as db.matches() checks grep'''
+    return title is not None and text in title.lower()
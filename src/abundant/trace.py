@@ -0,0 +1,206 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Tracing, to see where a command spends its time.
+
+Code to be traced is wrapped in a span, and spans nest:
+
+  with trace.span("Issue cache load"):
+      ...
+
+Tracing is off unless a command is run with --debug, which writes a
+line for each span as it ends, indented by how deeply it's nested, or
+with --trace-file FILE, which records every span and writes them to FILE
+in Chrome's trace event format, to be opened in chrome://tracing or
+https://ui.perfetto.dev.  While tracing is off span() does nothing
+but return a shared, empty span, so spans can be used freely, even
+once per issue read.  Spans which are that frequent should pass
+debug=False, so they're recorded by --trace-file but not written at
+--debug.
+
+Spans record wall clock time with time.perf_counter() and CPU time
+with time.process_time().
+
+For more detail than spans give, a command run with --profile[=FILE],
+or with the AB_PROFILE environment variable set to a file or
+directory, is run under cProfile, see profile().
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import os,time
+
+# the ui to write spans to at --debug, and the list of spans recorded
+# for --trace-file; tracing is on if either is set
+_ui = None
+_events = None
+_path = None
+# how many spans are open
+_depth = 0
+# trace event timestamps are relative to this
+_origin = time.perf_counter()
+
+def enabled():
+    return _ui is not None or _events is not None
+
+def start(ui=None,path=None):
+    '''Turns tracing on, writing spans to ui as they end if it's set,
+    and recording them to be written to path by stop() if it's set.
+    Does nothing if neither is set.'''
+    global _ui,_events,_path
+    _ui = ui
+    _events = [] if path else None
+    _path = path
+
+def stop(ui,**info):
+    '''Turns tracing off, and writes the recorded spans, and any info
+    passed, to the path passed to start(), if any.  Failing to write
+    them is reported to ui.'''
+    global _ui,_events,_path
+    events, path = _events, _path
+    _ui = _events = _path = None
+    if path:
+        import json
+        from abundant import util
+        try:
+            util.atomic_write(path,json.dumps({'traceEvents':events,'displayTimeUnit':'ms',
+                                               'otherData':info}))
+        except EnvironmentError as err:
+            ui.alert("Failed to write trace to %s: %s" % (path,err))
+
+class Span(object):
+    '''A timed section of code, which starts when it's constructed and
+    ends when end() is called, or its with block exits.
+
+    A Span constructed while tracing is off still times itself, and is
+    recorded if tracing is on when it ends, or by record().  Use span()
+    rather than constructing one directly unless that's needed.'''
+    def __init__(self,name,cat='ab',debug=True,**args):
+        global _depth
+        self.name = name
+        self.cat = cat
+        self.debug = debug
+        self.args = args
+        self.depth = _depth
+        _depth += 1
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        self.end_time = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,type,value,traceback):
+        self.end()
+
+    def end(self):
+        global _depth
+        self.end_time = time.perf_counter()
+        self.cpu = time.process_time() - self.cpu
+        _depth = max(_depth-1,0)
+        if enabled():
+            record(self)
+
+    def duration(self):
+        return (self.end_time if self.end_time is not None else time.perf_counter()) - self.start
+
+class _NullSpan(object):
+    '''The span returned by span() when tracing is off'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self,type,value,traceback):
+        pass
+
+    def end(self):
+        pass
+
+_null = _NullSpan()
+
+def span(name,cat='ab',debug=True,**args):
+    '''Returns a new Span, or, if tracing is off, an empty span.
+
+    cat is the span's category in the trace file, and args are recorded
+    with it.  Spans with debug set to False aren't written at --debug.'''
+    if _ui is None and _events is None:
+        return _null
+    return Span(name,cat,debug,**args)
+
+# how many functions to write at --debug when profiling
+profile_entries = 25
+# whether a profile() is running, since only one profiler can run at a time
+_profiling = False
+
+def profile_path(cwd,path,env,task):
+    '''Works out where to write a profile of task to, from the path
+    given to --profile, or if that's not set the AB_PROFILE environment
+    variable env, relative to cwd.  If env is a directory, a file named
+    for the command and process is written in it, so every command run
+    in a script can be profiled.  Returns None if neither is set.'''
+    if path:
+        return os.path.join(cwd,path)
+    if env:
+        env = os.path.join(cwd,env)
+        if os.path.isdir(env):
+            return os.path.join(env,"ab-%s-%d.prof" % (task,os.getpid()))
+        return env
+    return None
+
+class _Profile(object):
+    '''Runs a with block under cProfile'''
+    def __init__(self,ui,path):
+        self.ui = ui
+        self.path = path
+
+    def __enter__(self):
+        global _profiling
+        import cProfile
+        _profiling = True
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self,type,value,traceback):
+        global _profiling
+        self.profiler.disable()
+        _profiling = False
+        import io,pstats
+        stats = pstats.Stats(self.profiler)
+        try:
+            stats.dump_stats(self.path)
+        except EnvironmentError as err:
+            self.ui.alert("Failed to write profile to %s: %s" % (self.path,err))
+        if self.ui.is_debug():
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats('cumulative').print_stats(profile_entries)
+            self.ui.debug("Profile written to %s\n%s" % (self.path,out.getvalue().strip('\n')))
+
+def profile(ui,path):
+    '''Returns a context manager which runs its with block under
+    cProfile, writing the stats to path, for pstats or a viewer like
+    snakeviz to read, and at --debug the profile_entries functions
+    with the highest cumulative time to ui.  Does nothing if path is
+    None, or if a profile is already running, such as when one command
+    runs another.'''
+    if path is None or _profiling:
+        return _null
+    return _Profile(ui,path)
+
+def record(*spans):
+    '''Records spans which have ended'''
+    for s in spans:
+        if _ui is not None and s.debug:
+            _ui.debug("%sTrace: %s took %f (cpu %f)" % ('  '*s.depth,s.name,s.duration(),s.cpu))
+        if _events is not None:
+            args = dict(s.args)
+            args['cpu_ms'] = s.cpu*1000
+            _events.append({'name':s.name,'cat':s.cat,'ph':'X','pid':os.getpid(),'tid':0,
+                            'ts':(s.start-_origin)*1e6,'dur':s.duration()*1e6,'args':args})
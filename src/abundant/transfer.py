@@ -0,0 +1,225 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Moves issues in and out of a database in bulk.
+
+Issues are exported as JSON Lines, one JSON object of an issue's data
+per line, holding the same data as the issue's file.  Imports read
+JSON Lines, or CSV with a header row naming the field in each column.
+
+In CSV, children, listeners and paths are comma separated lists, and
+comments, if given at all, are a JSON array of [user, date, text]
+arrays.  In either format dates are seconds since the epoch, as they
+are stored, or a date like 2011-03-14, optionally followed by a time,
+like 2011-03-14 15:09 or 2011-03-14T15:09:26.
+
+Both directions stream, so the number of issues is only limited by the
+size of the issue cache, which holds the summary of every issue.
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import json,re,time
+from abundant import error,issue,util
+
+# issues are written in batches of this many
+batch_size = 1000
+
+_id_re = re.compile(r'[0-9a-f]{40}$')
+_metas = ['issue','severity','status','resolution','category']
+
+def to_JSON_line(iss):
+    '''Returns an issue's data as a line of JSON, without the newline'''
+    return json.dumps(dict((k,v) for k, v in iss._data().items() if v is not None and v != []),
+                      sort_keys=True)
+
+def export(issues,write):
+    '''Writes each issue as a line of JSON by calling write, returning
+    how many issues were written'''
+    count = 0
+    for iss in issues:
+        write(to_JSON_line(iss)+'\n')
+        count += 1
+    return count
+
+def guess_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def records(fp,format='jsonl'):
+    '''Generates (line number, dict) pairs of the records in an open
+    JSON Lines or CSV file'''
+    if format == 'csv':
+        import csv
+        reader = csv.DictReader(fp)
+        for row in reader:
+            yield reader.line_num, dict((k,v) for k, v in row.items() if k is not None)
+    elif format == 'jsonl':
+        for line, text in enumerate(fp,1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as err:
+                raise error.Abort("Line %d is not valid JSON: %s" % (line,err))
+            if not isinstance(record,dict):
+                raise error.Abort("Line %d is not a JSON object" % line)
+            yield line, record
+    else:
+        raise error.Abort("Unknown import format %s, choices: jsonl, csv" % format)
+
+class Importer(object):
+    '''Turns imported records into issues, validating them against the
+    database: metadata must be one of the values listed in the config,
+    and users must be in the users file, unless add_users is set, in
+    which case unknown users are added to it by write_users(), unless
+    check is set to only validate the records.'''
+    def __init__(self,ui,db,add_users=False,check=False):
+        self.ui = ui
+        self.db = db
+        self.add_users = add_users
+        self.check = check
+        # users added by the records converted, and by the one being
+        # converted, and how many have been written to the users file
+        self.added_users = []
+        self._pending = []
+        self._written = 0
+        # ids of the issues imported so far
+        self.ids = set()
+
+    def _abort(self,line,msg):
+        raise error.Abort("Line %d: %s" % (line,msg))
+
+    def _date(self,line,field,value):
+        try:
+            return util.parse_date(value)
+        except ValueError:
+            self._abort(line,"%s is not a valid date for %s" % (value,field))
+
+    def _list(self,line,field,value):
+        if isinstance(value,str):
+            if value.lstrip().startswith('['):
+                try:
+                    value = json.loads(value)
+                except ValueError as err:
+                    self._abort(line,"%s is not a valid JSON list: %s" % (field,err))
+            elif field == 'comments':
+                self._abort(line,"comments must be a JSON list")
+            else:
+                value = util.split_list(value)
+        if not isinstance(value,list):
+            self._abort(line,"%s must be a list" % field)
+        return value
+
+    def _meta(self,line,meta,value):
+        choices = self.db.meta_prefix[meta]
+        if choices is None:
+            return value
+        try:
+            return choices[value]
+        except error.UnknownPrefix:
+            self._abort(line,"%s is not a valid option for %s" % (value,meta))
+        except error.AmbiguousPrefix as err:
+            self._abort(line,"%s is an ambiguous option for %s, choices: %s" %
+                        (value,meta,util.list2str(err.choices)))
+
+    def _user(self,line,value):
+        '''Returns the user named value, which must be a user's full
+        name, or their email address, not just a prefix'''
+        users = self.db.usr_prefix
+        try:
+            user = users[value]
+            if (user.lower() == value.lower() or
+                '<%s>' % value.lower() in user.lower() or value in ['me','nobody']):
+                return user if user != 'nobody' else None
+        except (error.UnknownPrefix,error.AmbiguousPrefix):
+            pass
+        if not self.add_users:
+            self._abort(line,"%s is not a known user, use --add-users to add them" % value)
+        users.add(value)
+        lt, gt = value.find('<'), value.find('>')
+        if 0 <= lt < gt:
+            users.alias(value[lt+1:gt],value)
+        self._pending.append(value)
+        return value
+
+    def write_users(self):
+        '''Appends the users added by the records converted so far to the
+        users file.  Call this once their issues have been written, so an
+        import which stops early doesn't add the users of issues it didn't.'''
+        new = self.added_users[self._written:]
+        if new and not self.check:
+            with open(self.db.users,'a') as f:
+                f.write(''.join('%s\n' % u for u in new))
+        self._written = len(self.added_users)
+
+    def convert(self,line,record):
+        '''Returns an Issue of the data in record, read from the given line'''
+        self._pending = []
+        iss = self._convert(line,record)
+        self.added_users.extend(self._pending)
+        return iss
+
+    def _convert(self,line,record):
+        unknown = [k for k in record if k not in issue.Issue._pretty]
+        if unknown:
+            self._abort(line,"unknown field%s %s" % ('s' if len(unknown) > 1 else '',
+                                                     util.list2str(sorted(unknown))))
+        data = dict((k,v) for k, v in record.items() if v is not None and v != '' and v != [])
+        if not isinstance(data.get('title'),str) or not data['title'].strip():
+            self._abort(line,"every issue needs a title")
+
+        for field in issue.Issue._lists:
+            if field in data:
+                data[field] = self._list(line,field,data[field])
+        for field in issue.Issue._dates:
+            if field in data:
+                data[field] = self._date(line,field,data[field])
+        if isinstance(data.get('estimate'),str):
+            try:
+                data['estimate'] = float(data['estimate'])
+            except ValueError:
+                self._abort(line,"%s is not a valid estimate" % data['estimate'])
+        for meta in _metas:
+            if meta in data:
+                data[meta] = self._meta(line,meta,data[meta])
+            elif meta != 'resolution':
+                # as ab new does
+                default = self.ui.config('metadata',meta+'.default')
+                if default:
+                    data[meta] = default
+        for field in ['creator','assigned_to']:
+            if field in data:
+                data[field] = self._user(line,data[field])
+        if 'listeners' in data:
+            data['listeners'] = [u for u in (self._user(line,i) for i in data['listeners']) if u]
+        for comment in data.get('comments',[]):
+            if not isinstance(comment,list) or len(comment) != 3:
+                self._abort(line,"comments must be [user, date, text] lists")
+            comment[0] = self._user(line,comment[0])
+            comment[1] = self._date(line,'comments',comment[1])
+
+        if 'creation_date' not in data:
+            data['creation_date'] = time.time()
+        if 'id' in data:
+            data['id'] = data['id'].lower()
+            if not _id_re.match(data['id']):
+                self._abort(line,"%s is not a valid issue id" % data['id'])
+            if data['id'] in self.ids or self.db.has_issue(data['id']):
+                self._abort(line,"issue %s already exists" % data['id'])
+        else:
+            # as Issue() generates ids, but unique even if the data isn't
+            seed = repr(data['creation_date'])+data['title']+(data.get('creator') or '')
+            data['id'] = util.hash(seed)
+            n = 0
+            while data['id'] in self.ids or self.db.has_issue(data['id']):
+                n += 1
+                data['id'] = util.hash("%s:%d" % (seed,n))
+        self.ids.add(data['id'])
+        return issue.Issue(**data)
@@ -15,8 +15,19 @@ Many methods modeled from Mercurial
 Created on Feb 16, 2011
 '''
 
-import os,sys,tempfile,time
-from abundant import config,error,util
+import os,sys,time
+from abundant import error,trace,util
+
+# parsed config files, and the filestat of each file they were parsed
+# from, including included files, so that long running processes such
+# as the command server only reparse config files which have changed
+_parsed = {}
+
+# the version of the config snapshots written by UI.db_conf()
+_snapshot_version = 1
+# seconds in the past a config file must have been modified to be trusted
+# not to change again without its stat changing, see cache.IssueCache
+_racy = 2
 
 quiet = 0
 normal = 1
@@ -26,43 +37,93 @@ debug = 3
 class UI:
     def __init__(self,inp=sys.stdin,out=sys.stdout,err=sys.stderr):
         '''Takes file-like objects for input, output,
-        and errors.'''
+        and errors.
+        
+        Config files are not parsed until a setting is first
+        needed, which some commands, like help, never do.'''
         self.inp = inp
         self.out = out
         self.err = err
         
-        #populate config defaults
-        self._conf = config.config()
-        self._conf.set('metadata','status.resolved','Closed')
-        self._conf.set('metadata','status.opened','Open')
-        self._conf.set('metadata','resolution.default','Resolved')
-        self._conf.set('ui','short_date','%d/%m/%y %I:%M%p','default')
-        self._conf.set('ui','long_date','%a, %b. %d %y at %I:%M:%S%p','default')
-        
         self.volume = normal
         
-        # parse system config files
-        self._conf.update(self._load_conf_files(util.configpaths()))
+        self._conf = None
+        self._conf_errors = 0
+        
+        # output waiting to be written, when buffering, see pager()
+        self._buffer = None
+        self._buffered = 0
+        self._bufsize = 0
+        self._pager = None
+    
+    def _config(self):
+        '''Returns the config settings, populating them from the
+        defaults and the system config files the first time.'''
+        if self._conf is None:
+            from abundant import config
+            with trace.span("Config parse"):
+                conf = config.config()
+                #populate config defaults
+                conf.set('metadata','status.resolved','Closed')
+                conf.set('metadata','status.opened','Open')
+                conf.set('metadata','resolution.default','Resolved')
+                conf.set('ui','short_date','%d/%m/%y %I:%M%p','default')
+                conf.set('ui','long_date','%a, %b. %d %y at %I:%M:%S%p','default')
+                
+                # parse system config files
+                conf.update(self._load_conf_files(util.configpaths()))
+            self._conf = conf
+        return self._conf
+    
+    def copy(self,inp=None,out=None,err=None):
+        '''Returns a new UI object with a copy of this one's config and
+        volume, reading from and writing to the given streams instead,
+        if they are passed.'''
+        ret = UI.__new__(UI)
+        ret.__dict__.update(self.__dict__)
+        if self._conf is not None:
+            ret._conf = self._conf.copy()
+        ret._buffer = None
+        ret._pager = None
+        if inp is not None: ret.inp = inp
+        if out is not None: ret.out = out
+        if err is not None: ret.err = err
+        return ret
     
     def _load_conf_files(self, files):
+        from abundant import config
         conf = config.config()
         for f in files:
             try:
-                tconf = config.config()
-                with open(f) as fp:
-                    tconf.read(f,fp)
+                if util.filestat(f) is None:
+                    continue # file doesn't exist
+                if f in _parsed and all(util.filestat(i) == st for i, st in _parsed[f][0]):
+                    tconf = _parsed[f][1]
+                else:
+                    tconf = config.config()
+                    with trace.span("Config file",path=f), open(f) as fp:
+                        tconf.read(f,fp)
+                    _parsed[f] = ([(i,util.filestat(i)) for i in tconf.files],tconf)
                 self.debug("Loaded config file at %s" % f)
                 conf.update(tconf)
             except IOError:
                 pass # file doesn't exist
             except error.ConfigError as err:
+                self._conf_errors += 1
                 self.alert("** Warning: Parsing a config file failed: %s" % err.line)
                 self.flush()
         return conf
     
     def db_conf(self, db):
-        # load db specific config files
-        self._conf.update(self._load_conf_files([db.conf,db.local_conf]))
+        # load db specific config files, or if no config has been loaded
+        # yet, the database's snapshot of every config file
+        if self._conf is None:
+            self._conf = self._read_snapshot(db)
+            if self._conf is None:
+                self._config().update(self._load_conf_files([db.conf,db.local_conf]))
+                self._write_snapshot(db)
+        else:
+            self._config().update(self._load_conf_files([db.conf,db.local_conf]))
         
         # populate psudo-usernames 'me' and 'nobody'
         name = self.config('ui','username')
@@ -87,8 +148,82 @@ class UI:
             if lt >= 0 and gt >= 0 and gt > lt:
                 db.usr_prefix.alias(name[lt+1:gt], name)
     
+    def _snapshot_paths(self, db):
+        return util.configpaths() + [db.conf,db.local_conf]
+    
+    def _read_snapshot(self, db):
+        '''Returns the config saved by _write_snapshot() in the database's
+        .cache directory, or None if it's missing, or if any of the files
+        it was built from, or files which could have been, have changed.'''
+        from abundant import config
+        import json
+        path = os.path.join(db.cache,'config')
+        try:
+            with trace.span("Config snapshot read",path=path), open(path) as f:
+                data = json.load(f)
+            if data['version'] != _snapshot_version:
+                return None
+            paths = self._snapshot_paths(db)
+            if [p for p,_ in data['files'][:len(paths)]] != paths:
+                return None
+            for p, st in data['files']:
+                if list(util.filestat(p) or []) != (st or []):
+                    return None
+            conf = config.config.from_snapshot(data['config'])
+        except (IOError,ValueError,KeyError,TypeError):
+            return None
+        self.debug("Loaded config snapshot at %s" % path)
+        return conf
+    
+    def _write_snapshot(self, db):
+        '''Saves the config, once the database's config files have been
+        loaded, along with the stat of every file it was or could have
+        been loaded from, so later commands can skip parsing them.'''
+        if self._conf_errors or not self.configbool('cache','enabled',True):
+            return # so warnings are repeated, or no caching is wanted
+        paths = self._snapshot_paths(db)
+        racy = (time.time() - _racy) * 1e9
+        files = []
+        for p in paths + [f for f in self._conf.files if f not in paths]:
+            st = util.filestat(p)
+            if st is not None and st[0] >= racy:
+                return # might change again without its stat changing
+            files.append([p,st])
+        from abundant import cache
+        with trace.span("Config snapshot write"):
+            cache.write_cache_file(os.path.join(db.cache,'config'),
+                                   {'version':_snapshot_version,'files':files,
+                                    'config':self._conf.to_snapshot()},self)
+    
     def config(self, section, name, default=None):
-        return self._conf.get(section,name,default)
+        return self._config().get(section,name,default)
+    
+    _booleans = {'1': True, 'yes': True, 'true': True, 'on': True, 'always': True,
+                 '0': False, 'no': False, 'false': False, 'off': False, 'never': False}
+    
+    def configbool(self, section, name, default=False):
+        '''Returns a config value as a boolean
+        
+        From Mercurial's ui.py'''
+        v = self.config(section, name, None)
+        if v is None or isinstance(v, bool):
+            return default if v is None else v
+        b = self._booleans.get(v.lower())
+        if b is None:
+            raise error.Abort("%s.%s is not a boolean ('%s')" % (section, name, v))
+        return b
+    
+    def configint(self, section, name, default=None):
+        '''Returns a config value as an integer
+        
+        From Mercurial's ui.py'''
+        v = self.config(section, name, None)
+        if v is None:
+            return default
+        try:
+            return int(v)
+        except ValueError:
+            raise error.Abort("%s.%s is not an integer ('%s')" % (section, name, v))
     
     #
     #Date / Time
@@ -124,9 +259,15 @@ class UI:
 
         The ui object's volume must be as high as the message volume to actually output.'''
         if self.volume >= volume:
-            for a in msg:
-                self.out.write(str(a))
-            if ln: self.out.write('\n')
+            out = ''.join(map(str,msg))
+            if ln: out += '\n'
+            if self._buffer is not None:
+                self._buffer.append(out)
+                self._buffered += len(out)
+                if self._buffered >= self._bufsize:
+                    self._write_buffer()
+            else:
+                self._write(out)
             
     def quiet(self,*msg,ln=True):
         '''Write a message to the output stream, even if quiet.'''
@@ -146,6 +287,12 @@ class UI:
     
     def alert(self,*msg,ln=True):
         '''Writes a message to the error stream.  Not affected by volume.'''
+        if self._buffer:
+            # so it comes after what's been output so far
+            try:
+                self._write_buffer()
+            except error.OutputClosed:
+                pass
         for a in msg:
             self.err.write(str(a))
         if ln: self.err.write('\n')
@@ -183,6 +330,7 @@ class UI:
         input, notably editing an issue.
         
         From Mercurial's ui.py'''
+        import tempfile
         try:
             (fd, name) = tempfile.mkstemp(prefix="ab-editor-", suffix=".txt", text=False)
             # this closes fd too when it's done
@@ -206,12 +354,119 @@ class UI:
             return 'notepad'
         return self.config('ui', 'editor', os.environ['EDITOR'] or 'vi')
     
+    #
+    #Output buffering and paging
+    #
+    def pager(self,command):
+        '''Buffers output from here on, writing it in large chunks rather
+        than a line at a time, for commands which may output a lot.
+        
+        If output is to a terminal it's also sent through a pager, set
+        by [pager] pager, or $PAGER, by default less, unless [ui] paginate
+        is turned off or command is listed in [pager] ignore.
+        
+        If the pager exits, or output is to a pipe which is closed, such
+        as by head, the next write raises error.OutputClosed, so the
+        command stops rather than working out output no one will read.
+        close_pager() writes what's left, and is called by exec() once the
+        command is done.'''
+        if self._buffer is not None:
+            return
+        self._buffer = []
+        self._buffered = 0
+        self._bufsize = 65536
+        
+        if not self.configbool('ui','paginate',True):
+            return
+        if command in [i.strip() for i in self.config('pager','ignore','').split(',')]:
+            return
+        try:
+            if not self.out.isatty():
+                return
+        except (AttributeError,ValueError):
+            return
+        cmd = self.config('pager','pager',os.environ.get('PAGER') or 'less')
+        if not cmd or cmd == 'cat':
+            return
+        
+        import subprocess
+        env = dict(os.environ)
+        # quit if the output fits on screen, keep colors, don't clear the screen
+        env.setdefault('LESS','FRX')
+        env.setdefault('LV','-c')
+        self.flush()
+        try:
+            self._pager = subprocess.Popen(cmd,shell=True,stdin=subprocess.PIPE,stdout=self.out,
+                                           env=env,universal_newlines=True)
+        except (OSError,ValueError) as err:
+            self.debug("Failed to start pager '%s': %s" % (cmd,err))
+            return
+        self._pager_out = self.out
+        self.out = self._pager.stdin
+        # smaller chunks, so the first page shows up quickly
+        self._bufsize = 4096
+        self.debug("Paging output of %s through '%s'" % (command,cmd))
+    
+    def close_pager(self):
+        '''Writes any buffered output, stops buffering, and if output is
+        being paged waits for the user to quit the pager.'''
+        if self._buffer is not None:
+            try:
+                self._write_buffer()
+            except error.OutputClosed:
+                pass
+            self._buffer = None
+        if self._pager is not None:
+            try:
+                self.out.close()
+            except OSError:
+                pass # the pager already quit
+            self.out = self._pager_out
+            self._pager.wait()
+            self._pager = None
+    
+    def _write(self,out):
+        try:
+            self.out.write(out)
+        except BrokenPipeError:
+            self._output_closed()
+    
+    def _write_buffer(self):
+        out = ''.join(self._buffer)
+        del self._buffer[:]
+        self._buffered = 0
+        self._write(out)
+        if self._pager is not None:
+            try:
+                self.out.flush()
+            except BrokenPipeError:
+                self._output_closed()
+    
+    def _output_closed(self):
+        '''Stops writing output once whatever's reading it has gone away'''
+        if self._buffer is not None:
+            self._buffer = []
+        try:
+            # otherwise Python complains when it fails to flush the
+            # stream on exit
+            devnull = os.open(os.devnull,os.O_WRONLY)
+            try:
+                os.dup2(devnull,self.out.fileno())
+            finally:
+                os.close(devnull)
+        except (AttributeError,OSError,ValueError):
+            pass
+        raise error.OutputClosed()
+    
     def flush(self):
-        '''Fush StdOut and StdErr
+        '''Fush the output and error streams
         
         From Mercurial ui.py'''
-        try: sys.stdout.flush()
+        if self._buffer:
+            self._write_buffer()
+        try: self.out.flush()
+        except BrokenPipeError: self._output_closed()
         except: pass
-        try: sys.stderr.flush()
+        try: self.err.flush()
         except: pass
         
\ No newline at end of file
@@ -9,19 +9,38 @@
 '''
 A set of utility operations used throughout Abundant.
 
+Every command imports this module, so modules which only some commands
+need, like optparse, hashlib, subprocess and even re, are imported by
+the functions which use them.
+
 @author: Michael Diamond
 Created on Feb 7, 2011
 '''
 
-import hashlib, optparse, os, re, subprocess, sys, time
+import os, sys
 from abundant import error
 
 def hash(text):
     '''Return a hash of the given text for use as an id.
     
     Currently SHA1 hashing is used.  It should be plenty for our purposes.'''
+    import hashlib
     return hashlib.sha1(text.encode('utf-8')).hexdigest()
 
+class lazy_re(object):
+    '''A regular expression which is compiled, and re imported, the
+    first time it's used.  Otherwise acts like a compiled pattern.'''
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self._re = None
+    
+    def __getattr__(self, name):
+        if self._re is None:
+            import re
+            self._re = re.compile(self.pattern, self.flags)
+        return getattr(self._re, name)
+
 def find_db(p):
     '''Identifies the issue database to work with
     
@@ -33,6 +52,54 @@ def find_db(p):
 
     return p
 
+def write_tmp(path,data,fsync=False):
+    '''Writes data to a new temporary file next to path, to then be
+    renamed over path with os.replace(), and returns the temporary
+    file's name.  If fsync is set the data is flushed to disk first.
+    
+    The temporary file does not share path's extension, so it will
+    not be mistaken for a real file if it is left behind.'''
+    tmp = "%s.%d.tmp" % (path,os.getpid())
+    try:
+        with open(tmp,'w') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    except:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+    return tmp
+
+def atomic_write(path,data,fsync=False):
+    '''Replaces the contents of path with data, such that readers see
+    either the old or the new contents, never a partial write.'''
+    os.replace(write_tmp(path,data,fsync),path)
+
+def fsync_dir(path):
+    '''Flushes a directory's entries, such as renames, to disk.
+    Not possible on every platform, in which case this does nothing.'''
+    try:
+        fd = os.open(path,os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def filestat(path):
+    '''Returns a tuple identifying the current state of a file,
+    its (mtime, size, inode), or None if it does not exist.'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns,st.st_size,st.st_ino)
+
 def list2str(ls,lines=False,pad='  '):
     '''Returns a list as a pretty string'''
     try:
@@ -45,11 +112,32 @@ def list2str(ls,lines=False,pad='  '):
     except:
         return str(ls)
 
-_split_pat = re.compile(r'\s*,\s*')
+_split_pat = lazy_re(r'\s*,\s*')
 def split_list(string):
     '''Splits a string of comma separated items into a list'''
     return _split_pat.split(string.strip())
 
+date_formats = ['%Y-%m-%dT%H:%M:%S','%Y-%m-%d %H:%M:%S','%Y-%m-%d %H:%M','%Y-%m-%d']
+
+def parse_date(value):
+    '''Returns a date as seconds since the epoch, given a number of
+    seconds since the epoch, as dates are stored, or a local date like
+    2011-03-14, optionally followed by a time, like 2011-03-14 15:09 or
+    2011-03-14T15:09:26.  Raises ValueError if it's neither.'''
+    if isinstance(value,(int,float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError,ValueError):
+        pass
+    import time
+    for fmt in date_formats:
+        try:
+            return time.mktime(time.strptime(value.strip(),fmt))
+        except (AttributeError,ValueError):
+            continue
+    raise ValueError("%s is not a valid date" % value)
+
 def expandpath(path):
     '''Expands system variables in paths
     
@@ -130,14 +218,76 @@ def diff_dict(to,fro):
                 diff[key] = (to[key],fro[key])  
     return diff 
 
-parser_option = optparse.make_option
+class parser_option(object):
+    '''Describes a command line option, taking the same arguments as
+    optparse.make_option(), and also implicit, which lets a long option
+    that takes a value be given without one, as --opt rather than
+    --opt=VALUE, in which case it's set to implicit.
+    
+    The optparse.Option itself is only made when option() is called,
+    which parse_cli() only does when there are options to parse, so
+    commands run without options never import optparse.'''
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self._option = None
+    
+    def option(self):
+        if self._option is None:
+            self._option = _optparse_classes()[0](*self.args, **self.kwargs)
+        return self._option
+    
+    def dest(self):
+        '''The attribute this option is stored to, worked out the same
+        way optparse does'''
+        if 'dest' in self.kwargs:
+            return self.kwargs['dest']
+        longs = [i for i in self.args if i.startswith('--')]
+        if longs:
+            return longs[0][2:].replace('-','_')
+        return self.args[0][1]
 
-class _ThrowParser(optparse.OptionParser):
-    def error(self, msg):
-        """Overrides optparse's default error handling
-        and instead raises an exception which will be caught upstream
-        """
-        raise optparse.OptParseError(msg)
+class _Values(object):
+    '''The options parsed from the command line, like optparse.Values'''
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+_optparse_cls = None
+
+def _optparse_classes():
+    '''Defines, the first time it's called, and returns the
+    optparse.Option and optparse.OptionParser subclasses parse_cli()
+    uses, so optparse is only imported when it's needed.'''
+    global _optparse_cls
+    if _optparse_cls is None:
+        import optparse
+        class Option(optparse.Option):
+            ATTRS = optparse.Option.ATTRS + ['implicit']
+        
+        class ThrowParser(optparse.OptionParser):
+            def error(self, msg):
+                """Overrides optparse's default error handling
+                and instead raises an exception which will be caught upstream
+                """
+                raise optparse.OptParseError(msg)
+            
+            def _process_long_opt(self, rargs, values):
+                """Sets options with an implicit value given without
+                one, rather than taking the next argument as the value
+                """
+                if '=' not in rargs[0]:
+                    option = self._long_opt[self._match_long_opt(rargs[0])]
+                    if getattr(option, 'implicit', None) is not None:
+                        option.process(rargs.pop(0), option.implicit, values, self)
+                        return
+                optparse.OptionParser._process_long_opt(self, rargs, values)
+        _optparse_cls = (Option, ThrowParser)
+    return _optparse_cls
+
+def _ThrowParser(**kwargs):
+    '''Constructs an optparse.OptionParser which raises an exception,
+    to be caught upstream, rather than exiting on errors.'''
+    return _optparse_classes()[1](**kwargs)
 
 def parse_cli(args, opts):
     '''Parses command line input into options and positional arguments
@@ -147,8 +297,20 @@ def parse_cli(args, opts):
     returns a tuple of the remaining positional arguments
     and the options parsed out of the arguments.
     '''
+    if not any(len(i) > 1 and i[0] == '-' for i in args):
+        # nothing to parse, every option takes its default
+        defaults = {}
+        for opt in opts:
+            dest = opt.dest()
+            if 'default' in opt.kwargs:
+                defaults[dest] = opt.kwargs['default']
+            elif dest not in defaults:
+                defaults[dest] = None
+        return _Values(defaults), list(args)
+    
+    import optparse
     # help is handled elsewhere
-    parser = _ThrowParser(add_help_option=False,option_list=opts)
+    parser = _ThrowParser(add_help_option=False,option_list=[i.option() for i in opts])
     
     try:
         return parser.parse_args(args)
@@ -159,23 +321,29 @@ def option_str(options):
     '''Constructs an option string
     
     Based on optparse.HelpFormatter code and styled after 
-    Mercurial's help output, turns an optparse.Option into
+    Mercurial's help output, turns parser_option()s into
     a string for displaying help info.
     '''
     
     max_len = 80
     multi_set = set(['append','append_const','count'])
+    # actions which take a value, see optparse.Option.TYPED_ACTIONS
+    typed_set = set(['store','append'])
     
     optstrs = []
     for option in options:
-        str = (' ' + ' '.join(i for i in option._short_opts) + 
-               ' ' + ' '.join(i for i in option._long_opts))
-        if option.takes_value():
-            metavar = option.metavar or option.dest.upper()
-            str = "%s %s" % (str,metavar)
-        if option.action in multi_set:
+        action = option.kwargs.get('action','store')
+        str = (' ' + ' '.join(i for i in option.args if not i.startswith('--')) + 
+               ' ' + ' '.join(i for i in option.args if i.startswith('--')))
+        if action in typed_set:
+            metavar = option.kwargs.get('metavar') or option.dest().upper()
+            if option.kwargs.get('implicit') is not None:
+                str = "%s[=%s]" % (str,metavar)
+            else:
+                str = "%s %s" % (str,metavar)
+        if action in multi_set:
             str = "%s %s" % (str,'[+]')
-        optstrs.append((str,option.help if option.help else ''))
+        optstrs.append((str,option.kwargs.get('help') or ''))
     
     opt_len = max([len(i) for (i,_) in optstrs])+2
     hlp_len = max_len - opt_len
@@ -222,6 +390,7 @@ def system(cmd, environ={}, cwd=None, onerr=None, errprefix=None, out=None):
         if val is True:
             return '1'
         return str(val)
+    import subprocess
     origcmd = cmd
     env = dict(os.environ)
     env.update((k, py2shell(v)) for k, v in environ.items())
@@ -242,59 +411,7 @@ def system(cmd, environ={}, cwd=None, onerr=None, errprefix=None, out=None):
         raise onerr(errmsg)
     return rc
 
-class Timer:
-    '''A simple runtime-timer to track how long given processes take.
-    
-    Note that attempting to repr() or str() this class without calling stop()
-    will stop the Timer, and that a stopped timer cannot be restarted.
-    If you want to time how long an operation takes, start your Timer, ignore it,
-    then print the Timer.  If you need more granular measurements, use multiple
-    Timers, or implement something else, Timer isn't what you're looking for.'''
-    def __init__(self,desc,pattern="Timer: %s took %f",use_clock=False):
-        self.pattern = pattern
-        self.desc = desc
-        self.use_clock = use_clock or is_windows()
-        self.stopped = False
-        
-        self.time = time.time()
-        self.clock = time.clock()
-    
-    def stop(self):
-        times = (time.time(),time.clock())
-        
-        # We check stopped after making time calls to minimize time taken by Timer class
-        if self.stopped:
-            raise error.SeriousAbort("Called Timer.stop() more than once.")
-        else:
-            self.stopped = True
-        
-        self.time = times[0] - self.time
-        self.clock = times[1] - self.clock
-        
-        return self.duration()
-    
-    def duration(self):
-        if self.stopped:
-            return self.clock if self.use_clock else self.time
-        else:
-            if self.use_clock:
-                return time.clock() - self.clock
-            else:
-                return time.time() - self.time
-    
-    def __repr__(self):
-        try:
-            self.stop()
-        except: pass
-        return '(%f, %f)' % (self.time, self.clock)
-    
-    def __str__(self):
-        try:
-            self.stop()
-        except: pass
-        return self.pattern % (self.desc, self.clock if self.use_clock else self.time)
-
-_ab_pat = re.compile(r'\s*AB:.*')
+_ab_pat = lazy_re(r'\s*AB:.*')
 def ab_strip(lines):
     '''Used to process files containing input from the user.
     
@@ -304,7 +421,7 @@ def ab_strip(lines):
         if not _ab_pat.match(line):
             yield line
 
-_bracket_pat = re.compile(r'^\s*\[.+\]\s*$')
+_bracket_pat = lazy_re(r'^\s*\[.+\]\s*$')
 def bracket_strip(lines):
     '''Used to process files containing input from the user.
     
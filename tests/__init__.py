@@ -0,0 +1,25 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Tests for Abundant, run from the root of the repository:
+
+  python3 -m pytest tests
+  python3 -m unittest discover tests
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import os,sys
+
+src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'src')
+
+# test the abundant package alongside this one, not an installed one
+if src not in sys.path:
+    sys.path.insert(0,src)
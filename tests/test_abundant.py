@@ -0,0 +1,79 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Tests of parsing the command line
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import io,json,os,tempfile,unittest
+import tests
+from abundant import abundant,commands,util
+from abundant import ui as usrint
+
+class ParserTest(unittest.TestCase):
+    def test_no_conflicting_options(self):
+        '''Every command's options, with the global ones, build a parser.
+        optparse only builds one once an option is passed, so a conflict
+        would otherwise only show up when a user passes one.'''
+        for task, entry in commands.table.items():
+            with self.subTest(task=task):
+                util._ThrowParser(add_help_option=False,
+                                  option_list=[i.option() for i in abundant.globalArgs+entry[1]])
+
+    def test_consistent_letters(self):
+        '''Options with the same name take the same letter in every command'''
+        letters = {}
+        for task, entry in commands.table.items():
+            for opt in entry[1]:
+                shorts = [i for i in opt.args if not i.startswith('--')]
+                letters.setdefault(opt.dest(),{}).setdefault(tuple(shorts),[]).append(task)
+        for name in ['open','resolved','assigned_to','listener','limit']:
+            with self.subTest(option=name):
+                self.assertEqual(len(letters[name]),1,letters[name])
+
+    def test_options_after_prefix(self):
+        '''Global options parse alongside each command's own'''
+        options, args = util.parse_cli(['3f','-t','trace','--debug','--trace-file','out.json'],
+                                       abundant.globalArgs+commands.table['edit'][1])
+        self.assertEqual(args,['3f'])
+        self.assertEqual(options.trace,'trace')
+        self.assertEqual(options.trace_file,'out.json')
+
+class TraceFileTest(unittest.TestCase):
+    def run_ab(self,*args):
+        out, err = io.StringIO(), io.StringIO()
+        ret = abundant.exec(list(args),self.dir.name,usrint.UI(io.StringIO(),out,err))
+        return ret, out.getvalue(), err.getvalue()
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_writes_trace(self):
+        ret, out, err = self.run_ab('version','--trace-file','trace.json')
+        self.assertEqual(ret,0)
+        self.assertEqual(err,'')
+        with open(os.path.join(self.dir.name,'trace.json')) as file:
+            events = json.load(file)['traceEvents']
+        self.assertIn("Full command execution",[e['name'] for e in events])
+
+    def test_unwritable_trace(self):
+        '''The command's result isn't lost to an error writing its trace'''
+        path = os.path.join(self.dir.name,'missing','trace.json')
+        ret, out, err = self.run_ab('version','--trace-file',path)
+        self.assertEqual(ret,0)
+        self.assertIn("Abundant",out)
+        self.assertIn("Failed to write trace to %s" % path,err)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Tests of the issue cache and the indexes derived from it
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import os,time,unittest
+from unittest import mock
+from tests.test_db import DBTestCase
+from abundant import cache,issue
+
+class IssueCacheTest(DBTestCase):
+    def cache(self):
+        '''Returns a new IssueCache of the database, read from its file'''
+        return cache.IssueCache(self.db.issues,os.path.join(self.db.cache,'issues'),self.ui).refresh()
+
+    def test_round_trip(self):
+        '''Summaries read back from the cache file are the issues' summaries'''
+        parent = self.new("Parent",creator="Ann <ann@example.com>",severity="High",estimate=0)
+        child = self.new("Child",parent=parent.id,creator="Ann <ann@example.com>",
+                         listeners=["Bob","Ann <ann@example.com>"],resolution="Fixed",
+                         resolved_date=1300000000.5)
+        parent.children.append(child.id)
+        self.db.put_issue(parent)
+        summaries = self.cache()
+        self.assertEqual(len(summaries),2)
+        for iss in [parent,child]:
+            self.assertEqual(summaries.get(iss.id),iss.summary())
+        self.assertEqual(sorted(s['title'] for s in summaries),["Child","Parent"])
+        self.assertEqual(dict(summaries.items())[child.id],child.summary())
+
+    def test_summaries_are_copies(self):
+        '''Changing a summary doesn't change the cache'''
+        iss = self.new("Listened to",listeners=["Bob"])
+        summaries = self.cache()
+        summaries.get(iss.id)['listeners'].append("Eve")
+        self.assertEqual(summaries.get(iss.id)['listeners'],["Bob"])
+
+    def age(self):
+        '''Backdates the issues directory, as if it was last changed a
+        while ago, so the cache can trust it'''
+        past = time.time_ns() - 60*10**9
+        os.utime(self.db.issues,ns=(past,past))
+
+    def test_added_by_another_process(self):
+        self.new("First")
+        self.age()
+        summaries = self.cache()
+        other = self.open()
+        second = issue.Issue(title="Second")
+        other.put_issue(second) # not through summaries
+        self.assertEqual(summaries.refresh().get(second.id)['title'],"Second")
+        self.assertEqual(len(summaries),2)
+
+    def test_replaced_by_another_process(self):
+        iss = self.new("Before",severity="Low")
+        self.age()
+        summaries = self.cache()
+        changed = self.open().get_issue(iss.id)
+        changed.severity = "High"
+        self.open().put_issue(changed)
+        gen = summaries.generation
+        self.assertEqual(summaries.refresh().get(iss.id)['severity'],"High")
+        self.assertEqual(summaries.changes(gen),({iss.id:changed.summary()},set()))
+
+    def test_removed_by_another_process(self):
+        first, second = self.new("First"), self.new("Second")
+        self.age()
+        summaries = self.cache()
+        gen = summaries.generation
+        os.remove(os.path.join(self.db.issues,first.id+issue.ext))
+        summaries.refresh()
+        self.assertIsNone(summaries.get(first.id))
+        self.assertEqual(summaries.changes(gen),({},set([first.id])))
+        self.assertEqual([s['id'] for s in summaries],[second.id])
+
+    def test_unchanged_directory_isnt_listed(self):
+        '''While the issues directory hasn't changed it isn't listed again'''
+        iss = self.new("Cached")
+        self.age()
+        self.cache() # records the directory's mtime
+        with mock.patch('os.listdir',side_effect=AssertionError("listed the issues")):
+            summaries = self.cache()
+        self.assertEqual(summaries.get(iss.id),iss.summary())
+
+    def test_rewritten_in_place(self):
+        '''An issue file rewritten in place, which doesn't change the
+        directory, is still noticed, by the cache and its indexes'''
+        iss = self.new("Before",severity="Low")
+        path = os.path.join(self.db.issues,iss.id+issue.ext)
+        past = time.time_ns() - 60*10**9
+        os.utime(path,ns=(past,past))
+        self.age()
+        self.db.field_index # build and write the cache and index
+        directory = os.stat(self.db.issues).st_mtime_ns
+        iss.title, iss.severity = "After", "High"
+        with open(path,'w') as file:
+            file.write(iss.to_JSON_str())
+        os.utime(self.db.issues,ns=(directory,directory))
+        db = self.open()
+        self.assertEqual(db.field_index.lookup({'severity':'High'}),set([iss.id]))
+        self.assertEqual([i.title for i in db.get_issues()],["After"])
+
+    def test_recent_directory_is_checked(self):
+        '''A directory changed too recently to trust is checked every time'''
+        self.new("First")
+        self.cache()
+        listdir = os.listdir
+        with mock.patch('os.listdir',side_effect=listdir) as listed:
+            self.cache()
+        self.assertEqual(listed.call_count,1)
+
+    def test_indexes_round_trip(self):
+        '''Field and date indexes read back from their files answer the same'''
+        first = self.new("First",severity="High",creation_date=1300000000.0)
+        second = self.new("Second",severity="Low",resolution="Fixed",
+                          creation_date=1300000100.0,resolved_date=1300000200.0)
+        for name in ['field_index','date_index']:
+            getattr(self.db,name) # build and write each index
+        db = self.open()
+        self.assertEqual(db.field_index.lookup({'severity':'High'}),set([first.id]))
+        self.assertEqual(db.field_index.lookup({'resolved':True}),set([second.id]))
+        self.assertEqual(db.date_index.range('creation_date',since=1300000050.0),[second.id])
+        self.assertEqual(list(db.date_index.ordered('resolved_date')),[second.id])
+
+    def test_indexes_follow_changes(self):
+        '''Indexes loaded from their files pick up issues changed since'''
+        first = self.new("First",severity="High")
+        self.db.field_index
+        self.age()
+        second = self.new("Second",severity="High")
+        first.severity = "Low"
+        self.db.put_issue(first)
+        db = self.open()
+        self.assertEqual(db.field_index.lookup({'severity':'High'}),set([second.id]))
+        os.remove(os.path.join(self.db.issues,second.id+issue.ext))
+        self.assertEqual(self.open().field_index.lookup({'severity':'High'}),set())
+
+if __name__ == '__main__':
+    unittest.main()
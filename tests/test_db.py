@@ -0,0 +1,142 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Tests of the database, its caches and indexes
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import io,os,tempfile,time,unittest
+from unittest import mock
+import tests
+from abundant import commands,error,issue
+from abundant import db as database, ui as usrint
+
+class DBTestCase(unittest.TestCase):
+    '''Runs each test against a new, empty database'''
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.ui = usrint.UI(io.StringIO(),io.StringIO(),io.StringIO())
+        commands.init(self.ui,self.dir.name)
+        self.db = self.open()
+
+    def tearDown(self):
+        self.db.store.close()
+        self.dir.cleanup()
+
+    def open(self,path=None):
+        '''Returns a new DB object for the database, or the one at path,
+        as a command would load it'''
+        db = database.DB(path or self.dir.name,ui=self.ui)
+        self.ui.db_conf(db)
+        return db
+
+    def new(self,title,**data):
+        '''Writes a new issue with the given data'''
+        iss = issue.Issue(title=title)
+        for k, v in data.items():
+            setattr(iss,k,v)
+        self.db.put_issue(iss)
+        return iss
+
+class PrefixTest(DBTestCase):
+    def age(self):
+        past = time.time_ns() - 60*10**9
+        os.utime(self.db.issues,ns=(past,past))
+
+    def test_unknown_prefix(self):
+        '''An unknown prefix doesn't rebuild a current prefix file'''
+        iss = self.new("First")
+        self.age()
+        db = self.open()
+        self.assertEqual(db.get_issue_id(iss.id[:8]),iss.id)
+        with mock.patch('abundant.prefix.FilePrefix.write') as write:
+            with self.assertRaises(error.Abort):
+                db.get_issue_id('g')
+        self.assertEqual(write.call_count,0)
+
+    def test_added_since_loaded(self):
+        first = self.new("First")
+        self.age()
+        db = self.open()
+        db.get_issue_id(first.id)
+        second = self.new("Second")
+        self.assertEqual(db.get_issue_id(second.id[:8]),second.id)
+
+    def test_added_in_the_same_instant(self):
+        '''An issue added without changing the directory's mtime, as a
+        filesystem with coarse timestamps could, is still found'''
+        self.new("First")
+        self.open().iss_prefix # written as the directory changed
+        mtime = os.stat(self.db.issues).st_mtime_ns
+        second = self.new("Second")
+        os.utime(self.db.issues,ns=(mtime,mtime))
+        self.assertEqual(self.open().get_issue_id(second.id[:8]),second.id)
+
+class UncachedTest(DBTestCase):
+    def test_sorted_reads_each_issue_once(self):
+        '''Sorting issues found without the cache doesn't read them again'''
+        for n in range(5):
+            self.new("Issue %d" % n,severity=["Low","High"][n % 2])
+        read = issue.JSON_to_Issue
+        with mock.patch('abundant.issue.JSON_to_Issue',side_effect=read) as reads:
+            found = self.open().get_issues(use_cache=False,sort='severity')
+            self.assertEqual([i.severity for i in found],["High"]*2+["Low"]*3)
+        self.assertEqual(reads.call_count,5)
+
+class SimilarTest(DBTestCase):
+    def test_not_built_inline(self):
+        '''Looking up duplicates as new does doesn't build the index'''
+        first = self.new("login form crashes on startup")
+        with mock.patch('subprocess.Popen') as popen:
+            found = self.open().similar_issues(issue.Issue(title=first.title),5,current=False)
+        self.assertEqual(found,[])
+        self.assertEqual(popen.call_count,1)
+        self.assertIn('similar_index',popen.call_args[0][0])
+        self.assertFalse(os.path.exists(os.path.join(self.db.cache,'similar')))
+
+    def test_stored_index(self):
+        first = self.new("login form crashes on startup")
+        self.db.similar_index # build and write the index
+        self.new("unrelated issue about the report page")
+        db = self.open()
+        with mock.patch('subprocess.Popen'):
+            found = db.similar_issues(issue.Issue(title="login form crashes on submit"),5,current=False)
+        self.assertEqual([i.id for i, score in found],[first.id])
+        self.assertNotIn('issue_cache',db.__dict__)
+
+    def test_current_index_not_rebuilt(self):
+        self.new("login form crashes on startup")
+        past = time.time_ns() - 60*10**9
+        os.utime(self.db.issues,ns=(past,past))
+        self.db.similar_index
+        with mock.patch('subprocess.Popen') as popen:
+            self.open().similar_issues(issue.Issue(title="login form crashes"),5,current=False)
+        self.assertEqual(popen.call_count,0)
+
+    def test_stale_index_rebuilt(self):
+        '''Issues added by another command, such as an import, are added
+        to the stored index in the background, so a later lookup finds them'''
+        self.new("unrelated issue about the report page")
+        self.db.similar_index
+        other = self.open()
+        dup = issue.Issue(title="login form crashes on startup")
+        other.put_issue(dup) # doesn't update the stored index
+        lookup = issue.Issue(title="login form crashes on submit")
+        with mock.patch('subprocess.Popen') as popen:
+            self.assertEqual(self.open().similar_issues(lookup,5,current=False),[])
+        self.assertEqual(popen.call_count,1)
+        # run the build the process would have
+        database._build(*popen.call_args[0][0][-3:])
+        found = self.open().similar_issues(lookup,5,current=False)
+        self.assertEqual([i.id for i, score in found],[dup.id])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Tests of the storage backends, each of which runs the same tests
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import os,random,tempfile,unittest
+from tests.test_db import DBTestCase
+from abundant import error,issue,storage
+from abundant import db as database
+
+users = ["Ann <ann@example.com>","Bob <bob@example.com>","Cy <cy@example.com>"]
+severities = ['Low','Medium','High','Critical']
+
+def sample(count=40,seed=0):
+    '''Returns a list of count issues with a spread of metadata and dates'''
+    r = random.Random(seed)
+    ret = []
+    for n in range(count):
+        iss = issue.Issue(id="%040x" % r.getrandbits(160),title="Issue %d %s" % (n,r.choice(["crash","slow","typo"])),
+                          creation_date=1300000000.0+n*3600)
+        iss.creator = r.choice(users)
+        iss.assigned_to = r.choice(users+[None])
+        iss.listeners = r.sample(users,r.randint(0,2))
+        iss.severity = r.choice(severities+[None])
+        iss.issue = r.choice(['Bug','Feature Request'])
+        if r.random() < 0.4:
+            iss.resolution = r.choice(['Fixed','Duplicate'])
+            iss.resolved_date = iss.creation_date+r.randint(1,100)*3600
+        if r.random() < 0.5:
+            iss.estimate = r.randint(1,8)
+        ret.append(iss)
+    return ret
+
+# filters to check each backend finds the same issues with
+filter_cases = [{},{'resolved':False},{'resolved':True},{'severity':'High'},
+                {'assigned_to':None},{'assigned_to':users[0],'resolved':False},
+                {'listener':set([users[1]])},{'grep':'CRASH'},{'issue':'Bug','severity':'Low'},
+                {'created_since':1300000000.0+10*3600,'created_before':1300000000.0+30*3600},
+                {'resolved_since':1300000000.0+20*3600}]
+
+class StoreTests(object):
+    '''The behavior every Store shares, mixed into a TestCase for each'''
+    def make_store(self,path):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = self.make_store(self.dir.name)
+        self.store.create()
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def test_put_and_load(self):
+        issues = sample(5)
+        self.assertEqual(sorted(self.store.put(issues)),sorted(i.id for i in issues))
+        for iss in issues:
+            self.assertTrue(self.store.contains(iss.id))
+            self.assertEqual(self.store.load(iss.id).to_JSON_str(),iss.to_JSON_str())
+        self.assertEqual(self.store.ids(),sorted(i.id for i in issues))
+        self.assertEqual([i.id for i in self.store.issues()],sorted(i.id for i in issues))
+
+    def test_put_replaces(self):
+        iss = sample(1)[0]
+        self.store.put([iss])
+        iss.title = "Renamed"
+        self.assertEqual(self.store.put([iss]),[])
+        self.assertEqual(self.store.load(iss.id).title,"Renamed")
+        self.assertEqual(len(self.store.ids()),1)
+
+    def test_missing(self):
+        self.assertFalse(self.store.contains('0'*40))
+        with self.assertRaises(error.NoSuchIssue):
+            self.store.load('0'*40)
+
+    def test_delete(self):
+        first, second = sample(2)
+        self.store.put([first,second])
+        self.store.delete([first.id])
+        self.assertFalse(self.store.contains(first.id))
+        self.assertEqual(self.store.ids(),[second.id])
+
+class IndexedStoreTests(StoreTests):
+    '''Stores which stand in for the issue cache, and answer query()'''
+    def test_query(self):
+        '''query() finds the issues matching each filter, in order'''
+        issues = sample()
+        self.store.put(issues)
+        summaries = [i.summary() for i in issues]
+        for filters in filter_cases:
+            if not all(self.store.can_filter(k) for k in filters):
+                continue
+            with self.subTest(filters=filters):
+                expected = [s['id'] for s in summaries if database.matches(s,filters)]
+                found = [s['id'] for s in self.store.query(filters)]
+                self.assertEqual(sorted(found),sorted(expected))
+                newest = [s['id'] for s in self.store.query(filters,'creation_date',True,3)]
+                self.assertEqual(newest,sorted(expected,reverse=True,
+                                               key=lambda i: next(s['creation_date'] for s in summaries
+                                                                  if s['id'] == i))[:3])
+
+    def test_changes(self):
+        first, second = sample(2)
+        self.store.put([first,second])
+        gen = self.store.generation
+        second.severity = 'Critical'
+        self.store.put([second])
+        self.store.delete([first.id])
+        self.assertGreater(self.store.generation,gen)
+        changed, removed = self.store.changes(gen)
+        self.assertEqual(changed,{second.id:second.summary()})
+        self.assertEqual(removed,set([first.id]))
+        self.assertEqual(self.store.get(second.id),second.summary())
+        self.assertEqual(len(self.store),1)
+        self.assertEqual(dict(self.store.items()),{second.id:second.summary()})
+
+class JSONStoreTest(StoreTests,unittest.TestCase):
+    def make_store(self,path):
+        return storage.JSONStore(os.path.join(path,'issues'))
+
+    def test_stamp(self):
+        '''The stamp changes when issues are added or removed'''
+        iss = sample(1)[0]
+        past = os.stat(self.store.path).st_mtime_ns - 10**9
+        os.utime(self.store.path,ns=(past,past))
+        self.store.put([iss])
+        self.assertNotEqual(self.store.stamp(),past)
+
+class SQLiteStoreTest(IndexedStoreTests,unittest.TestCase):
+    def make_store(self,path):
+        return storage.SQLiteStore(os.path.join(path,'issues.sqlite'))
+
+    def test_reopen(self):
+        '''Issues and generations outlive the connection'''
+        iss = sample(1)[0]
+        self.store.put([iss])
+        gen = self.store.generation
+        self.store.close()
+        store = self.make_store(self.dir.name).refresh()
+        self.assertEqual(store.generation,gen)
+        self.assertEqual(store.get(iss.id),iss.summary())
+        store.close()
+
+    def test_generations_across_connections(self):
+        '''Writes by another connection are stamped after those already made'''
+        first, second = sample(2)
+        self.store.put([first])
+        gen = self.store.generation
+        other = self.make_store(self.dir.name)
+        other.put([second])
+        other.close()
+        changed, removed = self.store.refresh().changes(gen)
+        self.assertEqual(list(changed),[second.id])
+
+class MemoryStoreTest(IndexedStoreTests,unittest.TestCase):
+    def make_store(self,path):
+        return storage.MemoryStore()
+
+    def test_copies(self):
+        '''Changing an issue after putting it doesn't change the store'''
+        iss = sample(1)[0]
+        self.store.put([iss])
+        iss.title = "Changed"
+        self.assertNotEqual(self.store.load(iss.id).title,"Changed")
+
+class BackendTest(DBTestCase):
+    '''Each backend, used through a DB, finds the same issues, in the same
+    order, including those which tie on the field sorted by'''
+    def test_get_issues(self):
+        issues = sample()
+        self.db.put_issue(*issues)
+        dbs = {'json':self.open(),'files':self.open(),
+               'memory':database.DB(self.dir.name,ui=self.ui,store=storage.MemoryStore(issues))}
+        sqlite = self.db.open_store('sqlite')
+        sqlite.put(issues)
+        dbs['sqlite'] = database.DB(self.dir.name,ui=self.ui,store=sqlite)
+        try:
+            for filters in filter_cases:
+                for sort in [None,'creation_date','resolved_date','severity','title']:
+                    results = {}
+                    for name, db in dbs.items():
+                        found = db.get_issues(sort=sort,reverse=True,limit=5 if sort else None,
+                                              use_cache=name != 'files',**dict(filters))
+                        results[name] = [i.id for i in found]
+                        if sort is None:
+                            results[name].sort()
+                    with self.subTest(filters=filters,sort=sort):
+                        for name in ['files','sqlite','memory']:
+                            self.assertEqual(results[name],results['json'],name)
+        finally:
+            sqlite.close()
+
+if __name__ == '__main__':
+    unittest.main()
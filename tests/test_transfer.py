@@ -0,0 +1,118 @@
+# Copyright 2011 Michael Diamond
+#
+# This file is part of Abundant.
+#
+# This software may be used and distributed according to the terms of
+# the  GNU General Public License version 3 or any later version.
+# See http://www.gnu.org/licenses/ for the full license text.
+
+'''
+Tests of exporting and importing issues
+
+@author: Michael Diamond
+Created on Oct 17, 2026
+'''
+
+import io,os,tempfile,unittest
+from unittest import mock
+from tests.test_db import DBTestCase
+from tests.test_storage import sample, users
+from abundant import abundant,commands,util
+from abundant import ui as usrint
+
+class TransferTest(DBTestCase):
+    def setUp(self):
+        DBTestCase.setUp(self)
+        self.other = tempfile.TemporaryDirectory()
+        commands.init(self.ui,self.other.name)
+
+    def tearDown(self):
+        self.other.cleanup()
+        DBTestCase.tearDown(self)
+
+    def run_ab(self,path,*args):
+        out, err = io.StringIO(), io.StringIO()
+        ret = abundant.exec(list(args),path,usrint.UI(io.StringIO(),out,err))
+        self.assertEqual(err.getvalue(),'')
+        self.assertEqual(ret,0)
+        return out.getvalue()
+
+    def stored(self,path):
+        '''Returns a dict of the id to the JSON of every issue in the database at path'''
+        db = self.open(path)
+        try:
+            return dict((i.id,i.to_JSON_str()) for i in db.store.issues())
+        finally:
+            db.store.close()
+
+    def test_round_trip(self):
+        '''Issues exported from one database and imported into another
+        are stored exactly as they were'''
+        issues = sample()
+        issues[0].comments = [[users[0],issues[0].creation_date+60,"First\nsecond line"]]
+        issues[1].parent = issues[0].id
+        issues[0].children = [issues[1].id]
+        issues[2].paths = ["src/a.py","src/b.py"]
+        issues[3].title = "Quotes \" and commas, in a title"
+        self.db.put_issue(*issues)
+
+        exported = os.path.join(self.other.name,'issues.jsonl')
+        self.assertIn("Exported %d issues" % len(issues),
+                      self.run_ab(self.dir.name,'export','--output',exported))
+        self.run_ab(self.other.name,'import',exported,'--add-users')
+        self.assertEqual(self.stored(self.other.name),self.stored(self.dir.name))
+
+        # and exporting again writes the same file
+        again = os.path.join(self.dir.name,'again.jsonl')
+        self.run_ab(self.other.name,'export','--output',again)
+        with open(exported) as first, open(again) as second:
+            self.assertEqual(first.read(),second.read())
+
+    def test_check_writes_nothing(self):
+        issues = sample(3)
+        self.db.put_issue(*issues)
+        exported = os.path.join(self.other.name,'issues.jsonl')
+        self.run_ab(self.dir.name,'export','--output',exported)
+        self.run_ab(self.other.name,'import',exported,'--add-users','--check')
+        self.assertEqual(self.stored(self.other.name),{})
+
+    def test_invalid_record(self):
+        '''Importing stops at an invalid record, keeping the issues and
+        users of the records before it, however they fell into batches'''
+        path = os.path.join(self.other.name,'issues.jsonl')
+        with open(path,'w') as file:
+            file.write('{"title":"First","creator":"%s"}\n{"title":"Second"}\n'
+                       '{"title":"","creator":"%s"}\n{"title":"Fourth"}\n' % (users[0],users[1]))
+        for size in [1000,1]:
+            with self.subTest(batch_size=size):
+                db = os.path.join(self.other.name,str(size))
+                commands.init(self.ui,db)
+                out, err = io.StringIO(), io.StringIO()
+                with mock.patch('abundant.transfer.batch_size',size):
+                    ret = abundant.exec(['import',path,'--add-users'],db,
+                                        usrint.UI(io.StringIO(),out,err))
+                self.assertNotEqual(ret,0)
+                self.assertIn("Line 3: every issue needs a title",err.getvalue())
+                self.assertIn("Imported 2 issues before the invalid record",out.getvalue())
+                self.assertEqual(sorted(i.title for i in self.open(db).get_issues()),
+                                 ["First","Second"])
+                with open(os.path.join(db,'.ab','users')) as file:
+                    self.assertEqual(file.read().split('\n'),[users[0],''])
+
+    def test_import_csv(self):
+        path = os.path.join(self.other.name,'issues.csv')
+        with open(path,'w',newline='') as file:
+            file.write('title,creator,listeners,creation_date,estimate\n'
+                       'First,%s,"%s, %s",2011-03-14,2\n'
+                       'Second,%s,,2011-03-14 15:09,\n' % (users[0],users[1],users[2],users[1]))
+        self.run_ab(self.other.name,'import',path,'--add-users')
+        imported = sorted(self.open(self.other.name).get_issues(),key=lambda i: i.title)
+        self.assertEqual([i.title for i in imported],["First","Second"])
+        self.assertEqual(imported[0].listeners,[users[1],users[2]])
+        self.assertEqual(imported[0].creation_date,util.parse_date("2011-03-14"))
+        self.assertEqual(imported[0].estimate,2)
+        self.assertEqual(imported[1].creator,users[1])
+        self.assertIsNone(imported[1].estimate)
+
+if __name__ == '__main__':
+    unittest.main()